@@ -0,0 +1,307 @@
+from datetime import date, datetime, timedelta
+from typing import Dict
+import asyncio
+import time
+
+from sqlalchemy import Date, Integer, cast, extract, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import env_int
+from .fleet import area_of, fleet_store
+from .crud import order_history
+from .models import Car, User
+from .tariff import Repricer, Tariff
+
+# 订单统计：在数据库中按 车辆×日期×小时 聚合订单，结果累加到内存中的按日汇总；
+# 之后只增量聚合新订单和刚结束的订单，报表直接从汇总计算，不再逐条读取订单。
+# 订单统计读取近期表和归档表的并集，归档不影响报表
+
+# 增量刷新的最小间隔（秒）
+ANALYTICS_REFRESH_INTERVAL = env_int("SCENIC_ANALYTICS_REFRESH_INTERVAL", 10)
+# 只聚合开始超过该秒数的订单：并发事务提交顺序可能与id顺序不同，
+# 留出时间让较小id的事务提交，避免水位线越过尚未可见的订单
+ANALYTICS_SETTLE_SECONDS = 5
+# 按id查询已结束订单时每批的数量
+OPEN_ORDER_BATCH = 500
+# 批量重新计费时每批读取的订单数
+REPRICE_BATCH = 5000
+
+class DayStats:
+    """单日汇总：按开始日期归属，收入和骑行时长在订单结束后计入"""
+    __slots__ = ("hours", "cars")
+
+    def __init__(self):
+        # 每小时开始的订单数
+        self.hours = [0] * 24
+        # car_id -> [订单数, 收入, 骑行秒数]
+        self.cars: Dict[int, list] = {}
+
+    def add(self, car_id: int, hour: int, rides: int, revenue: float, seconds: float) -> None:
+        self.hours[hour] += rides
+        stats = self.cars.get(car_id)
+        if stats is None:
+            stats = self.cars[car_id] = [0, 0.0, 0.0]
+        stats[0] += rides
+        stats[1] += revenue
+        stats[2] += seconds
+
+def _order_columns(dialect: str, orders):
+    """开始日期、开始小时、骑行秒数的SQL表达式，orders为 order_history() 子查询"""
+    c = orders.c
+    if dialect == "sqlite":
+        return (
+            func.date(c.start_at),
+            cast(func.strftime("%H", c.start_at), Integer),
+            (func.julianday(c.end_at) - func.julianday(c.start_at)) * 86400,
+        )
+    return (
+        cast(c.start_at, Date),
+        cast(extract("hour", c.start_at), Integer),
+        extract("epoch", c.end_at - c.start_at),
+    )
+
+def _as_date(value) -> date:
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+class OrderAnalytics:
+    def __init__(self, interval: float = ANALYTICS_REFRESH_INTERVAL):
+        self.interval = interval
+        # 已聚合的最大订单id
+        self.watermark = 0
+        # 已聚合但尚未结束的订单 id -> 开始日期，结束后补计收入和时长
+        self._open: Dict[int, date] = {}
+        self._days: Dict[date, DayStats] = {}
+        self._refreshed_at = 0.0
+        self._lock = asyncio.Lock()
+        # 每次刷新有新数据时加1，用于报表缓存
+        self.version = 0
+        self._reports: Dict[tuple, dict] = {}
+
+    def _day(self, day: date) -> DayStats:
+        stats = self._days.get(day)
+        if stats is None:
+            stats = self._days[day] = DayStats()
+        return stats
+
+    async def refresh(self, session: AsyncSession) -> bool:
+        """增量聚合新订单和已结束的订单，返回是否有新数据"""
+        async with self._lock:
+            changed = await self._aggregate_new(session)
+            changed = await self._aggregate_closed(session) or changed
+            self._refreshed_at = time.monotonic()
+            if changed:
+                self.version += 1
+                self._reports.clear()
+            return changed
+
+    async def refresh_if_stale(self, session: AsyncSession) -> None:
+        if time.monotonic() - self._refreshed_at >= self.interval:
+            await self.refresh(session)
+
+    async def _aggregate_new(self, session: AsyncSession) -> bool:
+        settled = datetime.now() - timedelta(seconds=ANALYTICS_SETTLE_SECONDS)
+        orders = order_history()
+        c = orders.c
+        upper = (await session.execute(
+            select(func.max(c.id))
+            .where(c.id > self.watermark, c.start_at <= settled)
+        )).scalar()
+        if upper is None or upper <= self.watermark:
+            return False
+        in_range = (c.id > self.watermark, c.id <= upper)
+        day_col, hour_col, seconds_col = _order_columns(session.bind.dialect.name, orders)
+        # 一次GROUP BY聚合新增订单，数据库只返回 车辆×日期×小时 的汇总行
+        rows = await session.execute(
+            select(
+                c.car_id, day_col, hour_col,
+                func.count(),
+                func.coalesce(func.sum(c.fee), 0),
+                func.coalesce(func.sum(seconds_col), 0),
+            )
+            .where(*in_range)
+            .group_by(c.car_id, day_col, hour_col)
+        )
+        for car_id, day, hour, rides, revenue, seconds in rows:
+            self._day(_as_date(day)).add(car_id, hour, rides, float(revenue), float(seconds))
+        open_orders = await session.execute(
+            select(c.id, day_col).where(*in_range, c.end_at.is_(None))
+        )
+        self._open.update((order_id, _as_date(day)) for order_id, day in open_orders)
+        self.watermark = upper
+        return True
+
+    async def _aggregate_closed(self, session: AsyncSession) -> bool:
+        if not self._open:
+            return False
+        open_ids = sorted(self._open)
+        c = order_history().c
+        changed = False
+        for start in range(0, len(open_ids), OPEN_ORDER_BATCH):
+            batch = open_ids[start:start + OPEN_ORDER_BATCH]
+            rows = await session.execute(
+                select(c.id, c.car_id, c.start_at, c.end_at, c.fee)
+                .where(c.id.in_(batch), c.end_at.is_not(None))
+            )
+            for order_id, car_id, start_at, end_at, fee in rows:
+                seconds = (end_at - start_at).total_seconds()
+                # 订单数已在开始时计入
+                self._day(start_at.date()).add(car_id, start_at.hour, 0, fee or 0.0, seconds)
+                self._open.pop(order_id, None)
+                changed = True
+        return changed
+
+    def report(self, start: date, end: date, granularity: str = "daily") -> dict:
+        """[start, end] 日期范围内的报表，同一版本的相同参数只计算一次"""
+        key = (start, end, granularity)
+        cached = self._reports.get(key)
+        if cached is not None:
+            return cached
+        periods: Dict[date, list] = {}
+        hours = [0] * 24
+        cars: Dict[int, list] = {}
+        day = start
+        while day <= end:
+            stats = self._days.get(day)
+            if stats is not None:
+                period = periods.setdefault(_period_start(day, granularity), [0, 0.0])
+                for hour, count in enumerate(stats.hours):
+                    hours[hour] += count
+                for car_id, (rides, revenue, seconds) in stats.cars.items():
+                    period[0] += rides
+                    period[1] += revenue
+                    total = cars.setdefault(car_id, [0, 0.0, 0.0])
+                    total[0] += rides
+                    total[1] += revenue
+                    total[2] += seconds
+            day += timedelta(days=1)
+
+        window = ((end - start).days + 1) * 86400
+        car_rows = []
+        # 景区 -> [车辆数, 订单数, 收入, 骑行秒数]，车辆数包含没有订单的车辆
+        areas: Dict[str, list] = {}
+        for car in fleet_store.rows():
+            areas.setdefault(area_of(car["name"]), [0, 0, 0.0, 0.0])[0] += 1
+        for car_id, (rides, revenue, seconds) in cars.items():
+            car = fleet_store.get(car_id)
+            name = car["name"] if car else str(car_id)
+            area = area_of(name)
+            car_rows.append({
+                "car_id": car_id,
+                "name": name,
+                "area": area,
+                "rides": rides,
+                "revenue": round(revenue, 2),
+                "utilization": round(seconds / window, 4),
+            })
+            total = areas.setdefault(area, [0, 0, 0.0, 0.0])
+            if car is None:
+                total[0] += 1
+            total[1] += rides
+            total[2] += revenue
+            total[3] += seconds
+        car_rows.sort(key=lambda row: row["rides"], reverse=True)
+
+        rides = sum(row[0] for row in cars.values())
+        revenue = sum(row[1] for row in cars.values())
+        seconds = sum(row[2] for row in cars.values())
+        closed = rides - sum(1 for day in self._open.values() if start <= day <= end)
+        dates = sorted(periods)
+        result = {
+            "total_orders": rides,
+            "total_revenue": round(revenue, 2),
+            "average_order_value": round(revenue / closed, 2) if closed > 0 else 0.0,
+            "average_duration_minutes": round(seconds / closed / 60, 2) if closed > 0 else 0.0,
+            "dates": [d.isoformat() for d in dates],
+            "daily_orders": [periods[d][0] for d in dates],
+            "daily_revenue": [round(periods[d][1], 2) for d in dates],
+            "hourly_orders": hours,
+            "car_names": [row["name"] for row in car_rows],
+            "car_usage_counts": [row["rides"] for row in car_rows],
+            "cars": car_rows,
+            "areas": [
+                {
+                    "area": area,
+                    "cars": count,
+                    "rides": area_rides,
+                    "revenue": round(area_revenue, 2),
+                    "utilization": round(area_seconds / (window * count), 4) if count else 0.0,
+                }
+                for area, (count, area_rides, area_revenue, area_seconds) in sorted(areas.items())
+            ],
+        }
+        self._reports[key] = result
+        return result
+
+def _period_start(day: date, granularity: str) -> date:
+    if granularity == "weekly":
+        return day - timedelta(days=day.weekday())
+    if granularity == "monthly":
+        return day.replace(day=1)
+    return day
+
+async def active_users(session: AsyncSession, start: date, end: date) -> int:
+    """日期范围内下过单的用户数"""
+    c = order_history().c
+    result = await session.execute(
+        select(func.count(func.distinct(c.user_id))).where(
+            c.start_at >= datetime.combine(start, datetime.min.time()),
+            c.start_at < datetime.combine(end + timedelta(days=1), datetime.min.time()),
+        )
+    )
+    return result.scalar() or 0
+
+async def users_by_role(session: AsyncSession) -> Dict[int, int]:
+    result = await session.execute(select(User.role, func.count()).group_by(User.role))
+    return {role: count for role, count in result}
+
+async def reprice_orders(session: AsyncSession, tariffs: Dict[str, Tariff], start: date, end: date) -> dict:
+    """用多套计费规则重新计算日期范围内已结束订单的费用，用于比较调价效果"""
+    c = order_history().c
+    query = (
+        select(c.user_id, c.start_at, c.end_at, c.fee, Car.name)
+        .outerjoin(Car, Car.id == c.car_id)
+        .where(
+            c.end_at >= datetime.combine(start, datetime.min.time()),
+            c.end_at < datetime.combine(end + timedelta(days=1), datetime.min.time()),
+        )
+        # 每日封顶按结束时间依次累计
+        .order_by(c.end_at)
+        .execution_options(yield_per=REPRICE_BATCH)
+    )
+    orders = 0
+    actual = 0.0
+    totals = {name: 0.0 for name in tariffs}
+    # 景区 -> [订单数, 实收, 各规则费用...]
+    areas: Dict[str, list] = {}
+    # 每套规则各自累计每日封顶
+    pricers = {name: Repricer(tariff) for name, tariff in tariffs.items()}
+    result = await session.stream(query)
+    async for partition in result.partitions():
+        for user_id, start_at, end_at, fee, name in partition:
+            area = area_of(name or "")
+            area_totals = areas.setdefault(area, [0, 0.0, {key: 0.0 for key in tariffs}])
+            orders += 1
+            actual += fee or 0.0
+            area_totals[0] += 1
+            area_totals[1] += fee or 0.0
+            for key, pricer in pricers.items():
+                price = pricer.price(user_id, start_at, end_at, area)
+                totals[key] += price
+                area_totals[2][key] += price
+    return {
+        "orders": orders,
+        "actual_revenue": round(actual, 2),
+        "revenue": {key: round(value, 2) for key, value in totals.items()},
+        "areas": [
+            {
+                "area": area,
+                "orders": count,
+                "actual_revenue": round(area_actual, 2),
+                "revenue": {key: round(value, 2) for key, value in area_revenue.items()},
+            }
+            for area, (count, area_actual, area_revenue) in sorted(areas.items())
+        ],
+    }
+
+# 创建订单统计实例
+order_analytics = OrderAnalytics()
@@ -1,24 +1,75 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
 
 from .. import crud, schemas, models
 from ..db import get_session
+from ..fleet import fleet_store
+from ..geo import nearby_index
+from ..history import battery_history, pick_resolution, to_epoch, RAW
+from ..reservations import reservation_service
+from .users import get_current_user
 
 router = APIRouter(
     prefix="/cars",
     tags=["cars"],
 )
 
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match 是否包含该ETag：逗号分隔的列表或 *，按弱比较忽略 W/ 前缀"""
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+def _cached_response(request: Request, payload: Tuple[bytes, str]) -> Response:
+    """返回内存快照中的预序列化结果，ETag未变化时返回304"""
+    body, etag = payload
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache",
+        "X-Fleet-Version": str(fleet_store.version),
+    }
+    if _etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @router.get("/", response_model=List[schemas.Car])
-async def read_cars(skip: int = 0, limit: int = 100, session: AsyncSession = Depends(get_session)):
-    """获取车辆列表"""
+async def read_cars(request: Request, skip: int = 0, limit: int = 100,
+                    session: AsyncSession = Depends(get_session)):
+    """获取车辆列表，优先读取内存中的车队快照"""
+    if fleet_store.loaded:
+        return _cached_response(request, fleet_store.list_payload(skip, limit))
     cars = await crud.get_cars(session, skip=skip, limit=limit)
     return cars
 
+# 需在 /{car_id} 之前声明
+@router.get("/nearby", response_model=List[schemas.NearbyCar])
+async def read_nearby_cars(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius: float = Query(300, gt=0, le=5000),
+    limit: int = Query(10, ge=1, le=100),
+):
+    """查询半径（米）内最近的可租车辆，按距离排序；预留给候补用户的车辆不返回"""
+    if not fleet_store.loaded:
+        raise HTTPException(status_code=503, detail="车辆位置尚未加载")
+    nearest = nearby_index.nearest(lat, lng, k=limit, radius=radius, exclude=reservation_service.holds)
+    return [{**fleet_store.get(car_id), "distance": round(distance, 1)} for distance, car_id in nearest]
+
 @router.get("/{car_id}", response_model=schemas.Car)
-async def read_car(car_id: int, session: AsyncSession = Depends(get_session)):
+async def read_car(request: Request, car_id: int, session: AsyncSession = Depends(get_session)):
     """获取单个车辆详情"""
+    if fleet_store.loaded:
+        payload = fleet_store.car_payload(car_id)
+        if payload is not None:
+            return _cached_response(request, payload)
     db_car = await crud.get_car(session, car_id=car_id)
     if db_car is None:
         raise HTTPException(status_code=404, detail="车辆不存在")
@@ -47,4 +98,31 @@ async def update_car_battery(car_id: int, battery: int, session: AsyncSession =
     db_car = await crud.update_car_battery(session=session, car_id=car_id, battery=battery)
     if db_car is None:
         raise HTTPException(status_code=404, detail="车辆不存在")
-    return db_car
\ No newline at end of file
+    return db_car
+
+@router.get("/{car_id}/battery/history", response_model=schemas.BatteryHistory)
+async def read_battery_history(
+    car_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    resolution: Optional[str] = Query(None, pattern="^(raw|1m|15m|1h)$"),
+    max_points: int = Query(1000, ge=10, le=10000),
+    current_user: schemas.Principal = Depends(get_current_user),
+):
+    """查询车辆电量历史（运维/管理员），未指定粒度时按点数自动选择"""
+    if current_user.role < 1:
+        raise HTTPException(status_code=403, detail="无权限查看电量历史")
+    end_ts = to_epoch(end) if end else int(datetime.now(timezone.utc).timestamp())
+    start_ts = to_epoch(start) if start else end_ts - int(timedelta(days=1).total_seconds())
+    if start_ts > end_ts:
+        raise HTTPException(status_code=400, detail="开始时间不能晚于结束时间")
+    resolution = resolution or pick_resolution(start_ts, end_ts, max_points)
+    records = battery_history.query(car_id, start_ts, end_ts, resolution)
+    if resolution == RAW:
+        return schemas.BatteryHistory(car_id=car_id, resolution=resolution,
+                                      t=[r[0] for r in records], battery=[r[1] for r in records])
+    return schemas.BatteryHistory(
+        car_id=car_id, resolution=resolution,
+        t=[r[0] for r in records], battery=[round(r[1], 2) for r in records],
+        min=[r[2] for r in records], max=[r[3] for r in records],
+    )
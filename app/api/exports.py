@@ -0,0 +1,109 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Iterable, Optional, Sequence
+import csv
+import io
+import json
+
+from .. import crud, schemas
+from ..db import async_session
+from ..history import battery_history, to_epoch, RAW
+from .users import get_current_user
+
+router = APIRouter(
+    prefix="/exports",
+    tags=["exports"],
+)
+
+# 导出格式 -> (Content-Type, 文件扩展名)
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+HISTORY_COLUMNS = {
+    RAW: ("ts", "battery"),
+    "rollup": ("ts", "avg", "min", "max", "count"),
+}
+
+# 时间按ISO格式输出
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"),
+                                 default=lambda value: value.isoformat())
+
+def encode_rows(rows: Iterable[Sequence], columns: Sequence[str], fmt: str) -> bytes:
+    """把一批记录编码为CSV行或NDJSON行"""
+    if fmt == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode("utf-8")
+    lines = [_json_encoder.encode(dict(zip(columns, row))) for row in rows]
+    lines.append("")
+    return "\n".join(lines).encode("utf-8")
+
+def encode_header(columns: Sequence[str], fmt: str) -> bytes:
+    if fmt != "csv":
+        return b""
+    # 带BOM，Excel可以直接识别UTF-8
+    return ("\ufeff" + ",".join(columns) + "\r\n").encode("utf-8")
+
+def _streaming_response(chunks: AsyncIterator[bytes], fmt: str, name: str) -> StreamingResponse:
+    media_type, extension = EXPORT_FORMATS[fmt]
+    filename = f"{name}-{datetime.now():%Y%m%d%H%M%S}.{extension}"
+    return StreamingResponse(chunks, media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{filename}"',
+    })
+
+def _require_admin(current_user: schemas.Principal) -> None:
+    if current_user.role != 2:
+        raise HTTPException(status_code=403, detail="无权限导出数据")
+
+@router.get("/orders")
+async def export_orders(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    user_id: Optional[int] = None,
+    car_id: Optional[int] = None,
+    start_from: Optional[datetime] = None,
+    start_to: Optional[datetime] = None,
+    status: Optional[str] = Query(None, pattern="^(open|closed)$"),
+    current_user: schemas.Principal = Depends(get_current_user),
+):
+    """流式导出订单（管理员），边读边发送，内存占用与订单数量无关"""
+    _require_admin(current_user)
+    is_open = None if status is None else status == "open"
+    columns = crud.ORDER_EXPORT_COLUMNS
+    
+    async def chunks():
+        yield encode_header(columns, format)
+        # 响应发送期间一直占用会话，使用独立的会话而不是请求依赖
+        async with async_session() as session:
+            async for rows in crud.stream_orders(
+                session, user_id=user_id, car_id=car_id,
+                start_from=start_from, start_to=start_to, is_open=is_open,
+            ):
+                yield encode_rows(rows, columns, format)
+    
+    return _streaming_response(chunks(), format, "orders")
+
+@router.get("/cars/{car_id}/battery")
+async def export_battery_history(
+    car_id: int,
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    resolution: str = Query(RAW, pattern="^(raw|1m|15m|1h)$"),
+    current_user: schemas.Principal = Depends(get_current_user),
+):
+    """流式导出车辆电量历史（管理员），时间戳为Unix秒"""
+    _require_admin(current_user)
+    end_ts = to_epoch(end) if end else int(datetime.now(timezone.utc).timestamp())
+    start_ts = to_epoch(start) if start else end_ts - int(timedelta(days=30).total_seconds())
+    if start_ts > end_ts:
+        raise HTTPException(status_code=400, detail="开始时间不能晚于结束时间")
+    columns = HISTORY_COLUMNS[RAW if resolution == RAW else "rollup"]
+    
+    async def chunks():
+        yield encode_header(columns, format)
+        for records in battery_history.iter_query(car_id, start_ts, end_ts, resolution):
+            yield encode_rows(records, columns, format)
+    
+    return _streaming_response(chunks(), format, f"car{car_id}-battery-{resolution}")
@@ -1,53 +1,59 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from typing import List, Optional
+from datetime import datetime
 
-from .. import crud, schemas, models
+from .. import crud, schemas
 from ..db import get_session
-from .users import get_current_user
-from ..models import Car, RentOrder
+from ..responses import FAST_JSON, rows_response
+from ..rides import ride_registry
+from ..tariff import tariff_engine
+from .users import get_current_user, load_user_profile
 
 router = APIRouter(
     prefix="",
     tags=["orders"],
 )
 
-# 注意：这个版本使用自定义的事务管理，避免与CRUD函数中的commit冲突
+async def check_deposit(session: AsyncSession, current_user: schemas.Principal):
+    """计费规则要求押金时检查用户押金"""
+    min_deposit = tariff_engine.current().rules.min_deposit
+    if min_deposit > 0:
+        profile = await load_user_profile(session, current_user.phone)
+        if profile.deposit < min_deposit:
+            raise HTTPException(status_code=403, detail=f"押金不足，租车需缴纳押金{min_deposit:g}元")
+
 @router.post("/rent/{car_id}", response_model=schemas.RentResponse)
-async def rent_car(car_id: int, current_user: models.User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
+async def rent_car(car_id: int, current_user: schemas.Principal = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
     """租车接口"""
+    await check_deposit(session, current_user)
+    
+    # 每个用户同时只能有一个未结束的订单，从内存登记中检查
+    if ride_registry.active(current_user.id) is not None:
+        raise HTTPException(status_code=409, detail="您有未结束的订单，请先还车")
+    
     try:
-        # 检查车辆是否存在且可租
-        car = await session.get(Car, car_id)
-        if not car or car.status != 0:
-            raise HTTPException(status_code=400, detail="车辆不可租")
-        
-                # 更新车辆状态
-        car.status = 1
-        
-        # 创建订单
-        db_order = RentOrder(
-            user_id=current_user.id,
-            car_id=car_id
-        )
-        session.add(db_order)
-        
-        # 提交事务
-        await session.commit()
-        
-        return {
-            "order_id": db_order.id,
-            "start_at": db_order.start_at
-        }
+        # 条件更新车辆状态并创建订单，在一个事务内完成
+        order = await crud.rent_car(session, car_id=car_id, user_id=current_user.id)
     except Exception as e:
-        # 如果是HTTPException，直接抛出
-        if isinstance(e, HTTPException):
-            raise e
         # 其他错误返回500
         raise HTTPException(status_code=500, detail=f"租车过程中发生错误: {str(e)}")
+    
+    if order is None:
+        # 区分车辆不存在、用户已有未结束的订单和车辆已被他人租用/维修中
+        if await crud.get_car(session, car_id=car_id) is None:
+            raise HTTPException(status_code=404, detail="车辆不存在")
+        if ride_registry.active(current_user.id) is not None:
+            raise HTTPException(status_code=409, detail="您有未结束的订单，请先还车")
+        raise HTTPException(status_code=409, detail="车辆不可租")
+    
+    return {
+        "order_id": order.id,
+        "start_at": order.start_at
+    }
 
 @router.post("/return/{order_id}", response_model=schemas.ReturnResponse)
-async def return_car(order_id: int, current_user: models.User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
+async def return_car(order_id: int, current_user: schemas.Principal = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
     """还车接口"""
     # 检查订单是否属于当前用户
     order = await crud.get_order(session, order_id)
@@ -61,8 +67,10 @@ async def return_car(order_id: int, current_user: models.User = Depends(get_curr
     if order.end_at:
         raise HTTPException(status_code=400, detail="订单已经完成")
     
-    # 处理还车
+    # 处理还车，并发重复还车时只有一个请求成功
     order = await crud.return_car(session, order_id)
+    if order is None:
+        raise HTTPException(status_code=409, detail="订单已经完成")
     
     return {
         "order_id": order.id,
@@ -71,17 +79,57 @@ async def return_car(order_id: int, current_user: models.User = Depends(get_curr
     }
 
 @router.get("/orders", response_model=List[schemas.RentOrder])
-async def read_orders(current_user: models.User = Depends(get_current_user), skip: int = 0, limit: int = 100, session: AsyncSession = Depends(get_session)):
-    """获取订单列表"""
+async def read_orders(
+    response: Response,
+    current_user: schemas.Principal = Depends(get_current_user),
+    cursor: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=500),
+    car_id: Optional[int] = None,
+    start_from: Optional[datetime] = None,
+    start_to: Optional[datetime] = None,
+    status: Optional[str] = Query(None, pattern="^(open|closed)$"),
+    session: AsyncSession = Depends(get_session),
+):
+    """获取订单列表（按时间倒序）。
+    下一页的游标在响应头 X-Next-Cursor 中，作为 cursor 参数传入即可获取下一页；
+    status=open 只返回未还车的订单，status=closed 只返回已完成的订单"""
     # 管理员可以查看所有订单，普通用户只能查看自己的订单
-    if current_user.role == 2:
-        orders = await crud.get_orders(session, skip=skip, limit=limit)
-    else:
-        orders = await crud.get_orders_by_user(session, user_id=current_user.id)
+    filters = dict(
+        user_id=None if current_user.role == 2 else current_user.id,
+        car_id=car_id,
+        start_from=start_from,
+        start_to=start_to,
+        is_open=None if status is None else status == "open",
+        before_id=cursor,
+        limit=limit + 1,
+    )
+    if FAST_JSON:
+        # 直接编码列元组，跳过逐行校验
+        rows = await crud.list_order_rows(session, **filters)
+        headers = {}
+        if len(rows) > limit:
+            rows = rows[:limit]
+            headers["X-Next-Cursor"] = str(rows[-1][0])
+        return rows_response(rows, crud.ORDER_COLUMNS, headers=headers)
+    orders = await crud.list_orders(session, **filters)
+    # 多取一条用于判断是否还有下一页
+    if len(orders) > limit:
+        orders = orders[:limit]
+        response.headers["X-Next-Cursor"] = str(orders[-1].id)
     return orders
 
+# 需在 /orders/{order_id} 之前声明
+@router.get("/orders/active", response_model=Optional[schemas.RentOrder])
+async def read_active_order(current_user: schemas.Principal = Depends(get_current_user),
+                            session: AsyncSession = Depends(get_session)):
+    """当前用户进行中的订单，没有时返回null"""
+    if ride_registry.loaded:
+        return ride_registry.active(current_user.id)
+    orders = await crud.list_orders(session, user_id=current_user.id, is_open=True, limit=1)
+    return orders[0] if orders else None
+
 @router.get("/orders/{order_id}", response_model=schemas.RentOrder)
-async def read_order(order_id: int, current_user: models.User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
+async def read_order(order_id: int, current_user: schemas.Principal = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
     """获取单个订单详情"""
     order = await crud.get_order(session, order_id=order_id)
     if order is None:
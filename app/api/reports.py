@@ -0,0 +1,46 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date, timedelta
+from typing import Optional
+
+from .. import schemas
+from ..analytics import order_analytics, active_users, users_by_role
+from ..db import get_session
+from .users import get_current_user
+
+router = APIRouter(
+    prefix="/reports",
+    tags=["reports"],
+)
+
+# 未指定日期时默认统计最近的天数
+DEFAULT_REPORT_DAYS = 30
+
+@router.get("")
+async def read_report(
+    type: str = Query("daily", pattern="^(daily|weekly|monthly)$"),
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    current_user: schemas.Principal = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+):
+    """运营报表（管理员）：订单量、收入、车辆/景区利用率、高峰时段分布"""
+    if current_user.role != 2:
+        raise HTTPException(status_code=403, detail="无权限查看报表")
+    end_date = end_date or date.today()
+    start_date = start_date or end_date - timedelta(days=DEFAULT_REPORT_DAYS - 1)
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="开始日期不能晚于结束日期")
+    
+    await order_analytics.refresh_if_stale(session)
+    report = dict(order_analytics.report(start_date, end_date, type))
+    roles = await users_by_role(session)
+    report.update(
+        start_date=start_date.isoformat(),
+        end_date=end_date.isoformat(),
+        active_users=await active_users(session, start_date, end_date),
+        tourist_count=roles.get(0, 0),
+        operator_count=roles.get(1, 0),
+        admin_count=roles.get(2, 0),
+    )
+    return report
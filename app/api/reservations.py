@@ -0,0 +1,46 @@
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import schemas
+from ..db import get_session
+from ..fleet import area_of, fleet_store
+from ..reservations import reservation_service
+from .orders import check_deposit
+from .users import get_current_user
+
+router = APIRouter(
+    prefix="/reservations",
+    tags=["reservations"],
+)
+
+@router.post("/waitlist", response_model=schemas.Reservation, status_code=201)
+async def join_waitlist(
+    body: schemas.WaitlistJoin,
+    current_user: schemas.Principal = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+):
+    """加入景区的候补队列，有车辆空闲时预留给队首用户并通过 /ws/status 通知"""
+    if not any(area_of(car["name"]) == body.area for car in fleet_store.rows()):
+        raise HTTPException(status_code=404, detail="景区不存在")
+    await check_deposit(session, current_user)
+    if reservation_service.status(current_user.id)["status"] != "none":
+        raise HTTPException(status_code=409, detail="已在候补队列中或已有预留车辆")
+    reservation_service.join(current_user.id, body.area)
+    return reservation_service.status(current_user.id)
+
+@router.get("/me", response_model=schemas.Reservation)
+async def read_my_reservation(current_user: schemas.Principal = Depends(get_current_user)):
+    """当前用户的候补位置或预留车辆"""
+    return reservation_service.status(current_user.id)
+
+@router.delete("/me", status_code=204)
+async def cancel_my_reservation(current_user: schemas.Principal = Depends(get_current_user)):
+    """退出候补队列，或放弃已预留的车辆"""
+    status = reservation_service.status(current_user.id)["status"]
+    if status == "waiting":
+        reservation_service.leave(current_user.id)
+    elif status == "held":
+        await reservation_service.cancel_hold(current_user.id)
+    else:
+        raise HTTPException(status_code=404, detail="没有候补或预留")
+    return Response(status_code=204)
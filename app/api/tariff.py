@@ -0,0 +1,42 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date, timedelta
+
+from .. import schemas
+from ..analytics import reprice_orders
+from ..db import get_session
+from ..tariff import tariff_engine, compile_tariff
+from .users import get_current_user
+
+router = APIRouter(
+    prefix="/tariff",
+    tags=["tariff"],
+)
+
+# 未指定日期时默认试算最近的天数
+DEFAULT_WHAT_IF_DAYS = 30
+
+@router.get("", response_model=schemas.TariffRules)
+async def read_tariff():
+    """当前生效的计费规则"""
+    return tariff_engine.current().rules
+
+@router.post("/what-if")
+async def tariff_what_if(
+    body: schemas.TariffWhatIf,
+    current_user: schemas.Principal = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+):
+    """用候选计费规则重新计算历史订单费用，与实收和当前规则对比（管理员）"""
+    if current_user.role != 2:
+        raise HTTPException(status_code=403, detail="无权限试算计费规则")
+    end_date = body.end_date or date.today()
+    start_date = body.start_date or end_date - timedelta(days=DEFAULT_WHAT_IF_DAYS - 1)
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="开始日期不能晚于结束日期")
+    result = await reprice_orders(session, {
+        "current": tariff_engine.current(),
+        "candidate": compile_tariff(body.rules),
+    }, start_date, end_date)
+    result.update(start_date=start_date.isoformat(), end_date=end_date.isoformat())
+    return result
@@ -0,0 +1,22 @@
+from fastapi import APIRouter, HTTPException
+
+from .. import schemas
+from ..telemetry import telemetry_buffer, handle_message, TELEMETRY_MAX_BATCH
+
+router = APIRouter(
+    prefix="/telemetry",
+    tags=["telemetry"],
+)
+
+@router.post("/", response_model=schemas.TelemetryResult, status_code=202)
+async def report_telemetry(batch: schemas.TelemetryBatch):
+    """批量上报车辆电量和状态，合并后定期写入数据库"""
+    if len(batch.reports) > TELEMETRY_MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"单次最多上报{TELEMETRY_MAX_BATCH}条")
+    accepted, rejected = telemetry_buffer.submit_many(batch.reports)
+    return schemas.TelemetryResult(accepted=accepted, rejected=rejected)
+
+@router.get("/stats")
+async def telemetry_stats():
+    """遥测缓冲区统计"""
+    return telemetry_buffer.stats()
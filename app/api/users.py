@@ -2,14 +2,17 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
-import jwt
+from jose import JWTError, jwt
 from typing import Optional
+import time
 
 from ..db import get_session
-from ..schemas import UserCreate, UserLogin, User
+from ..schemas import UserCreate, UserLogin, User, Principal, UserRoleUpdate, UserDepositUpdate
 from ..crud import create_user as crud_create_user
-from ..crud import get_user_by_phone, verify_password
-from ..models import User as UserModel
+from ..crud import get_user_by_phone, update_user_password, update_user_role, update_user_deposit
+from ..bus import bus
+from ..principals import PrincipalCache, PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL, PRINCIPAL_VERSION_TTL
+from .. import passwords
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -21,6 +24,10 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 # OAuth2密码流
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="users/token")
 
+# 已认证用户缓存
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL, PRINCIPAL_VERSION_TTL)
+bus.subscribe("user", principal_cache.apply)
+
 # 创建访问令牌
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -28,30 +35,74 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": int(time.time())})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-# 获取当前用户
-async def get_current_user(token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_session)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="无法验证凭据",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+credentials_exception = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="无法验证凭据",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+def decode_token(token: str) -> dict:
+    """校验令牌签名和有效期，无效令牌直接拒绝，不访问数据库"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        phone: str = payload.get("sub")
-        if phone is None:
-            raise credentials_exception
     except JWTError:
         raise credentials_exception
-    
-    user = await get_user_by_phone(session, phone)
-    if user is None:
+    if payload.get("sub") is None:
         raise credentials_exception
+    return payload
+
+def token_subject(token: str) -> Optional[str]:
+    """令牌有效时返回令牌主体（手机号），用于按用户限流"""
+    try:
+        return decode_token(token)["sub"]
+    except HTTPException:
+        return None
+
+async def load_user_profile(session: AsyncSession, phone: str) -> User:
+    """从缓存或数据库获取完整的用户信息"""
+    user = principal_cache.get(phone)
+    if user is None:
+        db_user = await get_user_by_phone(session, phone)
+        if db_user is None:
+            raise credentials_exception
+        user = User.model_validate(db_user, from_attributes=True)
+        principal_cache.put(phone, user)
+        principal_cache.put_version(phone, db_user.token_version)
     return user
 
+# 获取当前用户：令牌中的用户ID和角色足以完成大多数接口的授权
+async def get_current_user(token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_session)):
+    payload = decode_token(token)
+    phone: str = payload["sub"]
+    
+    cached = principal_cache.get(phone)
+    if cached is not None:
+        return cached
+    
+    # 令牌版本与数据库一致（角色未变更）时，直接使用令牌中的声明；版本未知时查询数据库
+    user_id, role = payload.get("uid"), payload.get("role")
+    version = principal_cache.version(phone)
+    if user_id is not None and role is not None and version is not None and payload.get("ver", 0) == version:
+        return Principal(id=user_id, phone=phone, role=role)
+    
+    return await load_user_profile(session, phone)
+
+# 获取当前用户的完整信息（昵称、押金等令牌中没有的字段）
+async def get_current_user_profile(token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_session)):
+    payload = decode_token(token)
+    return await load_user_profile(session, payload["sub"])
+
+# 密码哈希线程池已满时的响应
+password_busy_exception = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="服务繁忙，请稍后重试",
+    headers={"Retry-After": "1"},
+)
+
 # 用户注册
 @router.post("/register", response_model=User)
 async def register_user(user: UserCreate, session: AsyncSession = Depends(get_session)):
@@ -61,25 +112,64 @@ async def register_user(user: UserCreate, session: AsyncSession = Depends(get_se
             status_code=400,
             detail="该手机号已被注册"
         )
-    return await crud_create_user(session=session, user=user)
+    try:
+        return await crud_create_user(session=session, user=user)
+    except passwords.PasswordHasherBusy:
+        raise password_busy_exception
 
 # 用户登录
 @router.post("/token")
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), session: AsyncSession = Depends(get_session)):
     user = await get_user_by_phone(session, phone=form_data.username)
-    if not user or not verify_password(form_data.password, user.password):
+    try:
+        verified = user is not None and await passwords.verify_password_async(form_data.password, user.password)
+    except passwords.PasswordHasherBusy:
+        raise password_busy_exception
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="手机号或密码错误",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    
+    # 计算成本调整后，登录成功时顺便按新成本重新哈希
+    if passwords.needs_rehash(user.password):
+        try:
+            await update_user_password(session, user.id, await passwords.hash_password_async(form_data.password))
+        except passwords.PasswordHasherBusy:
+            pass
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.phone, "role": user.role}
+        data={"sub": user.phone, "role": user.role, "uid": user.id, "ver": user.token_version or 0},
+        expires_delta=access_token_expires
     )
+    principal_cache.put_version(user.phone, user.token_version)
     return {"access_token": access_token, "token_type": "bearer", "user_id": user.id, "role": user.role}
 
 # 获取当前用户信息
 @router.get("/me", response_model=User)
-async def read_users_me(current_user: UserModel = Depends(get_current_user)):
-    return current_user
\ No newline at end of file
+async def read_users_me(current_user: User = Depends(get_current_user_profile)):
+    return current_user
+
+# 修改用户角色（管理员）
+@router.put("/{user_id}/role", response_model=User)
+async def update_role(user_id: int, body: UserRoleUpdate, current_user: Principal = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
+    if current_user.role != 2:
+        raise HTTPException(status_code=403, detail="无权限修改用户角色")
+    db_user = await update_user_role(session, user_id=user_id, role=body.role)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="用户不存在")
+    # 旧令牌中的角色已失效
+    principal_cache.invalidate(db_user.phone, db_user.token_version)
+    return db_user
+
+# 修改用户押金（管理员）
+@router.put("/{user_id}/deposit", response_model=User)
+async def update_deposit(user_id: int, body: UserDepositUpdate, current_user: Principal = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
+    if current_user.role != 2:
+        raise HTTPException(status_code=403, detail="无权限修改用户押金")
+    db_user = await update_user_deposit(session, user_id=user_id, deposit=body.deposit)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="用户不存在")
+    principal_cache.invalidate(db_user.phone, db_user.token_version)
+    return db_user
\ No newline at end of file
@@ -1,77 +1,333 @@
-from fastapi import WebSocket, WebSocketDisconnect
-from typing import List, Dict
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+from typing import Callable, Dict, List, Optional, Set
 import asyncio
+import itertools
+import json
+import time
 
 from .. import crud
 from ..db import get_session
+from ..fleet import broadcaster, fleet_store, TOPIC_PREFIXES
+from ..geo import nearby_index
+from ..bus import bus
+from ..metrics import registry, ws_broadcast_latency, ws_broadcast_fanout, ws_resyncs
+from ..reservations import reservation_service
+from .users import decode_token
+
+# 每个连接的发送队列长度，超过后视为慢客户端
+SEND_QUEUE_SIZE = 64
+# 每个连接最多订阅的主题数
+MAX_TOPICS_PER_CONNECTION = 100
+
+def encode_message(message) -> str:
+    """把消息序列化为JSON文本，广播时只序列化一次"""
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":"), default=str)
+
+# 单个WebSocket连接：独立的发送队列和发送任务，慢客户端不会拖慢其他连接
+class ClientConnection:
+    def __init__(self, connection_id: int, websocket: WebSocket):
+        self.id = connection_id
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        self.writer: Optional[asyncio.Task] = None
+        # 订阅的主题，为空时接收全部车辆
+        self.topics: Set[str] = set()
+        # 登录用户的id，用于推送候补预留等个人通知
+        self.user_id: Optional[int] = None
+        # 滞后统计
+        self.sent = 0
+        self.dropped = 0
+        self.resyncs = 0
+        self.max_lag = 0
+    
+    def offer(self, payload: str) -> bool:
+        """把已序列化的消息放入发送队列，队列已满时返回False"""
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            return False
+        self.max_lag = max(self.max_lag, self.queue.qsize())
+        return True
+    
+    def resync(self, snapshot_payload: str) -> None:
+        """丢弃积压的增量，用一条全量快照代替"""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(snapshot_payload)
+        self.resyncs += 1
+    
+    async def run_writer(self):
+        while True:
+            payload = await self.queue.get()
+            await self.websocket.send_text(payload)
+            self.sent += 1
+    
+    def stats(self) -> dict:
+        return {
+            "id": self.id,
+            "lag": self.queue.qsize(),
+            "max_lag": self.max_lag,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "resyncs": self.resyncs,
+            "topics": len(self.topics),
+        }
 
 # WebSocket连接管理器
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[int, WebSocket] = {}
+    def __init__(self, snapshot_provider: Optional[Callable[..., dict]] = None):
+        self.active_connections: Dict[int, ClientConnection] = {}
+        # 主题索引 topic -> 订阅该主题的连接ID
+        self.subscribers: Dict[str, Set[int]] = {}
+        # 用户索引 user_id -> 该用户的连接ID
+        self.users: Dict[int, Set[int]] = {}
+        # 慢客户端积压时用全量快照代替积压的增量
+        self.snapshot_provider = snapshot_provider
+        self._ids = itertools.count(1)
+        # 最近一次广播发送的连接数
+        self.last_fanout = 0
     
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        # 为新连接分配一个临时ID
-        connection_id = len(self.active_connections) + 1
-        self.active_connections[connection_id] = websocket
+        # 为新连接分配一个唯一ID
+        connection_id = next(self._ids)
+        client = ClientConnection(connection_id, websocket)
+        # 新连接（包括重连）先收到一次全量快照，之后只接收增量
+        if self.snapshot_provider:
+            client.offer(encode_message(self.snapshot_provider()))
+        client.writer = asyncio.create_task(self._write(client))
+        self.active_connections[connection_id] = client
         return connection_id
     
     def disconnect(self, connection_id: int):
-        if connection_id in self.active_connections:
-            del self.active_connections[connection_id]
+        client = self.active_connections.pop(connection_id, None)
+        if not client:
+            return
+        self._unsubscribe(client, list(client.topics))
+        self._unbind_user(client)
+        if client.writer and client.writer is not asyncio.current_task():
+            client.writer.cancel()
+    
+    async def _write(self, client: ClientConnection):
+        try:
+            await client.run_writer()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"发送消息失败，断开连接 {client.id}: {e}")
+            self.disconnect(client.id)
     
     async def send_personal_message(self, message: dict, connection_id: int):
-        if connection_id in self.active_connections:
-            await self.active_connections[connection_id].send_json(message)
-    
-    async def broadcast(self, message: dict):
-        """广播消息给所有连接的客户端"""
-        # 创建一个发送任务列表
-        tasks = []
-        for connection in self.active_connections.values():
-            # 添加发送消息的任务
-            tasks.append(connection.send_json(message))
+        client = self.active_connections.get(connection_id)
+        if client and not client.offer(encode_message(message)):
+            client.dropped += 1
+    
+    def send_to_user(self, user_id: int, message: dict):
+        """发送给该用户的所有连接"""
+        payload = encode_message(message)
+        for connection_id in self.users.get(user_id, ()):
+            client = self.active_connections[connection_id]
+            if not client.offer(payload):
+                client.dropped += 1
+    
+    def handle_message(self, connection_id: int, data: str):
+        """处理客户端消息：
+        {"action": "subscribe", "topics": ["car:3", "area:西湖", "status:0"]}
+        {"action": "unsubscribe", "topics": [...]}
+        {"action": "auth", "token": "..."}  登录后接收个人通知（候补车辆已预留等）
+        未订阅任何主题的连接接收全部车辆"""
+        client = self.active_connections.get(connection_id)
+        if not client:
+            return
+        try:
+            message = json.loads(data)
+            action = message.get("action")
+            if action == "auth":
+                self._authenticate(client, message.get("token"))
+                return
+            topics = message.get("topics") or []
+            if action not in ("subscribe", "unsubscribe") or not isinstance(topics, list):
+                raise ValueError("未知的操作")
+            topics = [_validate_topic(topic) for topic in topics]
+        except (ValueError, AttributeError) as e:
+            client.offer(encode_message({"type": "error", "detail": f"无效的消息: {e}"}))
+            return
+        
+        if action == "subscribe":
+            if len(client.topics | set(topics)) > MAX_TOPICS_PER_CONNECTION:
+                client.offer(encode_message({"type": "error", "detail": "订阅主题过多"}))
+                return
+            self._subscribe(client, topics)
+        else:
+            self._unsubscribe(client, topics)
         
-        # 并发执行所有发送任务
-        if tasks:
-            try:
-                await asyncio.gather(*tasks)
-            except Exception as e:
-                print(f"广播消息时出错: {e}")
+        client.offer(encode_message({"type": "subscribed", "topics": sorted(client.topics)}))
+        # 订阅范围变化后发送一次对应范围的快照
+        if self.snapshot_provider:
+            client.offer(encode_message(self.snapshot_provider(client.topics)))
+    
+    def _authenticate(self, client: ClientConnection, token):
+        try:
+            user_id = decode_token(token if isinstance(token, str) else "").get("uid")
+        except HTTPException:
+            user_id = None
+        if user_id is None:
+            client.offer(encode_message({"type": "error", "detail": "无法验证凭据"}))
+            return
+        self._unbind_user(client)
+        client.user_id = user_id
+        self.users.setdefault(user_id, set()).add(client.id)
+        client.offer(encode_message({"type": "authenticated", "user_id": user_id}))
+    
+    def _unbind_user(self, client: ClientConnection):
+        if client.user_id is None:
+            return
+        ids = self.users.get(client.user_id)
+        if ids is not None:
+            ids.discard(client.id)
+            if not ids:
+                del self.users[client.user_id]
+        client.user_id = None
+    
+    def _subscribe(self, client: ClientConnection, topics: List[str]):
+        for topic in topics:
+            client.topics.add(topic)
+            self.subscribers.setdefault(topic, set()).add(client.id)
+    
+    def _unsubscribe(self, client: ClientConnection, topics: List[str]):
+        for topic in topics:
+            client.topics.discard(topic)
+            ids = self.subscribers.get(topic)
+            if ids is not None:
+                ids.discard(client.id)
+                if not ids:
+                    del self.subscribers[topic]
+    
+    def broadcast(self, message, car_topics: Optional[List[Set[str]]] = None) -> int:
+        """广播消息，返回因积压而重新同步的连接数。
+        car_topics 与 message["cars"] 一一对应时按订阅主题过滤，
+        订阅了主题的连接只收到与其主题相关的车辆"""
+        # 消息只序列化一次，所有连接共享同一份文本
+        payload = encode_message(message)
+        snapshots: Dict[frozenset, str] = {}
+        if car_topics is None:
+            clients = list(self.active_connections.values())
+            self.last_fanout = len(clients)
+            return sum(self._offer(client, payload, snapshots) for client in clients)
+        
+        # 通过主题索引找到每个订阅者关心的车辆
+        matched: Dict[int, Set[int]] = {}
+        for index, topics in enumerate(car_topics):
+            for topic in topics:
+                for connection_id in self.subscribers.get(topic, ()):
+                    matched.setdefault(connection_id, set()).add(index)
+        
+        # 关心相同车辆集合的连接共享同一份序列化结果
+        payloads: Dict[frozenset, str] = {}
+        resynced = 0
+        self.last_fanout = 0
+        for client in list(self.active_connections.values()):
+            if not client.topics:
+                self.last_fanout += 1
+                resynced += self._offer(client, payload, snapshots)
+                continue
+            indexes = matched.get(client.id)
+            if not indexes:
+                continue
+            key = frozenset(indexes)
+            if key not in payloads:
+                payloads[key] = encode_message({
+                    **message,
+                    "cars": [message["cars"][index] for index in sorted(indexes)],
+                })
+            self.last_fanout += 1
+            resynced += self._offer(client, payloads[key], snapshots)
+        return resynced
+    
+    def _offer(self, client: ClientConnection, payload: str, snapshots: Dict[frozenset, str]) -> int:
+        if client.offer(payload):
+            return 0
+        # 慢客户端：合并积压为一条快照，订阅范围相同的连接共享同一份快照
+        if self.snapshot_provider:
+            key = frozenset(client.topics)
+            if key not in snapshots:
+                snapshots[key] = encode_message(self.snapshot_provider(client.topics))
+            client.resync(snapshots[key])
+        else:
+            client.dropped += 1
+        return 1
+    
+    def stats(self) -> List[dict]:
+        """各连接的发送滞后统计"""
+        return [client.stats() for client in self.active_connections.values()]
+
+def _validate_topic(topic) -> str:
+    prefix, _, value = topic.partition(":") if isinstance(topic, str) else ("", "", "")
+    if prefix not in TOPIC_PREFIXES or not value:
+        raise ValueError(f"无效的主题 {topic!r}")
+    return topic
 
 # 创建连接管理器实例
-manager = ConnectionManager()
+manager = ConnectionManager(snapshot_provider=broadcaster.snapshot)
+registry.gauge("scenic_ws_connections", "WebSocket状态推送连接数",
+               callback=lambda: len(manager.active_connections))
+# 候补预留的通知通过用户的状态推送连接发送
+reservation_service.notify = manager.send_to_user
 
 # 从app.db导入sessionmaker
 from app.db import async_session
 
-# 模拟车辆状态更新任务
+# 增量推送的合并窗口（秒），窗口内的多次变更合并为一条增量消息
+BROADCAST_INTERVAL = 0.2
+# 与数据库对账的间隔（秒），用于兜底发现绕过接口直接修改数据库的变更；
+# 多worker部署时只有事件总线的领导者执行对账
+RESYNC_INTERVAL = 30
+
+async def _load_cars():
+    async with async_session() as session:
+        return await crud.get_all_cars(session)
+
+# 车辆状态增量推送任务
 async def car_status_update_task():
-    """定期更新车辆状态并广播给所有连接的客户端"""
+    """等待车辆变更并把增量推送给所有连接的客户端"""
+    loop = asyncio.get_running_loop()
+    last_resync = loop.time()
+    
     while True:
         try:
-            # 获取数据库会话
-            async with async_session() as session:
-                # 获取所有车辆
-                cars = await crud.get_all_cars(session)
-                # 构建状态更新消息
-                status_updates = []
-                for car in cars:
-                    status_updates.append({
-                        "car_id": car.id,
-                        "battery": car.battery,
-                        "status": car.status
-                    })
-                # 广播状态更新
-                await manager.broadcast(status_updates)
+            # 有变更时稍等片刻，合并同一时间段内的多次变更
+            if await broadcaster.wait_for_changes(RESYNC_INTERVAL):
+                await asyncio.sleep(BROADCAST_INTERVAL)
+            
+            # 定期与数据库对账
+            if bus.is_leader and loop.time() - last_resync >= RESYNC_INTERVAL:
+                fleet_store.reconcile(await _load_cars())
+                last_resync = loop.time()
+            
+            # 只广播发生变化的车辆
+            delta = broadcaster.collect_delta()
+            if delta:
+                message, car_topics = delta
+                started = time.perf_counter()
+                resynced = manager.broadcast(message, car_topics)
+                ws_broadcast_latency.observe(time.perf_counter() - started)
+                ws_broadcast_fanout.observe(manager.last_fanout)
+                if resynced:
+                    ws_resyncs.inc(amount=resynced)
         except Exception as e:
-            print(f"获取车辆状态时出错: {e}")
-        
-        # 每秒更新一次
-        await asyncio.sleep(1)
+            print(f"推送车辆状态时出错: {e}")
+            await asyncio.sleep(1)
 
 # 启动状态更新任务
 async def start_status_update_task():
     """启动车辆状态更新任务"""
-    asyncio.create_task(car_status_update_task())
\ No newline at end of file
+    # 先加载全量状态，保证最早连接的客户端也能收到完整快照
+    try:
+        cars = await _load_cars()
+        broadcaster.load(cars)
+        fleet_store.load(cars)
+        nearby_index.load(fleet_store.rows())
+    except Exception as e:
+        print(f"加载车辆状态时出错: {e}")
+    asyncio.create_task(car_status_update_task())
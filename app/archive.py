@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta
+from typing import Optional
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import delete, insert, select
+
+from .bus import bus
+from .config import env_int
+from .crud import ORDER_COLUMNS
+from .db import async_session
+from .models import RentOrder, RentOrderArchive
+
+# 订单归档：结束超过 ARCHIVE_DAYS 天的订单由领导者定期从 rent_order 移到 rent_order_archive，
+# 近期表只保留未结束和最近的订单，租车/还车/当前订单查询的耗时不随历史订单增长。
+# 需要历史数据的查询（订单列表、导出、统计报表）读取两张表的并集，见 crud.order_history
+
+# 订单结束多少天后归档，设置为空字符串表示不归档
+ARCHIVE_DAYS = env_int("SCENIC_ARCHIVE_DAYS", 90)
+# 检查间隔（秒）
+ARCHIVE_INTERVAL = env_int("SCENIC_ARCHIVE_INTERVAL", 3600)
+# 每个事务移动的订单数，避免长时间占用写锁
+ARCHIVE_BATCH = 5000
+
+class OrderArchiver:
+    def __init__(self, days: Optional[int] = ARCHIVE_DAYS, interval: float = ARCHIVE_INTERVAL,
+                 session_factory=async_session, batch_size: int = ARCHIVE_BATCH):
+        self.days = days
+        self.interval = interval
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        # 统计：累计归档的订单数、最近一次运行时间
+        self.archived = 0
+        self.last_run: Optional[datetime] = None
+
+    async def _archive_batch(self, cutoff: datetime) -> int:
+        """把一批已结束且早于cutoff的订单移入归档表，插入和删除在同一事务中"""
+        async with self.session_factory() as session:
+            # 按id顺序扫描，最早的订单最先结束，找够一批即可停止
+            ids = (await session.execute(
+                select(RentOrder.id)
+                .where(RentOrder.end_at.is_not(None), RentOrder.end_at < cutoff)
+                .order_by(RentOrder.id)
+                .limit(self.batch_size)
+            )).scalars().all()
+            if not ids:
+                return 0
+            await session.execute(insert(RentOrderArchive).from_select(
+                ORDER_COLUMNS,
+                select(*(getattr(RentOrder, column) for column in ORDER_COLUMNS)).where(RentOrder.id.in_(ids)),
+            ))
+            await session.execute(delete(RentOrder).where(RentOrder.id.in_(ids)))
+            await session.commit()
+        return len(ids)
+
+    async def archive(self, days: Optional[int] = None) -> int:
+        """归档结束超过days天的订单，返回移动的订单数"""
+        days = self.days if days is None else days
+        if days is None:
+            return 0
+        cutoff = datetime.now() - timedelta(days=days)
+        total = 0
+        while True:
+            moved = await self._archive_batch(cutoff)
+            total += moved
+            if moved < self.batch_size:
+                break
+            # 批次之间让出事件循环和数据库写锁
+            await asyncio.sleep(0)
+        self.archived += total
+        self.last_run = datetime.now()
+        return total
+
+    async def run(self) -> None:
+        while True:
+            try:
+                if bus.is_leader:
+                    await self.archive()
+            except Exception as e:
+                print(f"归档订单时出错: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self.days is not None and self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "days": self.days,
+            "archived": self.archived,
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+        }
+
+# 创建订单归档实例
+order_archiver = OrderArchiver()
+
+async def _main(args) -> None:
+    from .db import create_engine, create_session_factory
+    from .migrations import migrate
+
+    engine = create_engine()
+    try:
+        await migrate(engine)
+        archiver = OrderArchiver(args.days, session_factory=create_session_factory(engine))
+        started = time.perf_counter()
+        moved = await archiver.archive()
+        print(f"已归档 {moved} 条订单，耗时 {time.perf_counter() - started:.2f}s")
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    # python -m app.archive --days 90
+    parser = argparse.ArgumentParser(description="立即归档结束超过指定天数的订单")
+    parser.add_argument("--days", type=int, default=ARCHIVE_DAYS if ARCHIVE_DAYS is not None else 90)
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,272 @@
+from typing import Callable, Dict, List, Optional
+import asyncio
+import fcntl
+import json
+import os
+import uuid
+
+# 车队事件总线：在多个uvicorn worker之间同步车辆变更等事件
+# SCENIC_EVENT_BUS=memory  单进程，事件只在本进程内分发（默认）
+# SCENIC_EVENT_BUS=unix    单机多worker，由领导者worker通过Unix套接字转发事件
+# SCENIC_EVENT_BUS=redis   多机部署，使用Redis（或兼容RESP协议的服务）的发布订阅
+
+EVENT_BUS = os.environ.get("SCENIC_EVENT_BUS", "memory")
+BUS_SOCKET_PATH = os.environ.get("SCENIC_BUS_SOCKET", "/tmp/scenic-bus.sock")
+REDIS_URL = os.environ.get("SCENIC_REDIS_URL", "redis://localhost:6379/0")
+REDIS_CHANNEL = os.environ.get("SCENIC_REDIS_CHANNEL", "scenic:fleet")
+
+# 跟随者重连领导者的间隔（秒）
+RECONNECT_DELAY = 0.5
+# 单个跟随者允许积压的发送缓冲（字节），超过后断开该跟随者
+MAX_PEER_BUFFER = 4 * 1024 * 1024
+# Redis领导者锁的有效期（毫秒）
+LEADER_LOCK_TTL = 5000
+
+def encode_event(event: dict) -> bytes:
+    return json.dumps(event, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8") + b"\n"
+
+class EventBus:
+    """事件总线基类：publish 是同步非阻塞的，可以在提交事务后直接调用"""
+    def __init__(self):
+        self._handlers: Dict[str, List[Callable[[dict], None]]] = {}
+        # 领导者负责数据库轮询等只需要一个worker执行的任务
+        self.is_leader = True
+
+    def subscribe(self, event_type: str, handler: Callable[[dict], None]) -> None:
+        self._handlers.setdefault(event_type, []).append(handler)
+
+    def publish(self, event: dict) -> None:
+        self._dispatch(event)
+
+    def _dispatch(self, event: dict) -> None:
+        for handler in self._handlers.get(event.get("type"), ()):
+            try:
+                handler(event)
+            except Exception as e:
+                print(f"处理事件时出错: {e}")
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+class InProcessBus(EventBus):
+    """进程内事件总线，适用于单worker部署"""
+
+class UnixSocketBus(EventBus):
+    """单机多worker事件总线：抢到文件锁的worker成为领导者并监听Unix套接字，
+    其他worker连接到领导者；领导者把收到的事件转发给其他所有worker"""
+    def __init__(self, path: str = BUS_SOCKET_PATH):
+        super().__init__()
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.is_leader = False
+        self._lock_fd: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._peers = set()
+        self._upstream: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def publish(self, event: dict) -> None:
+        line = encode_event(event)
+        self._dispatch(event)
+        if self.is_leader:
+            self._relay(line)
+        elif self._upstream is not None:
+            self._upstream.write(line)
+        else:
+            print("事件总线未连接，丢弃事件")
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+        if self._server:
+            self._server.close()
+        for peer in list(self._peers):
+            peer.close()
+        if self._upstream:
+            self._upstream.close()
+        if self._lock_fd is not None:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            os.close(self._lock_fd)
+            self._lock_fd = None
+        self.is_leader = False
+
+    def _try_lock(self) -> bool:
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    async def _run(self):
+        while True:
+            if self._try_lock():
+                await self._serve()
+                return
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                # 领导者尚未监听，稍后重试
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            self._upstream = writer
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    self._dispatch_line(line)
+            except (ConnectionError, OSError):
+                pass
+            finally:
+                self._upstream = None
+                writer.close()
+            # 领导者退出后重新竞选
+            print("事件总线领导者已断开，重新竞选")
+
+    async def _serve(self):
+        # 持有文件锁，残留的套接字文件可以安全删除
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle_peer, path=self.path)
+        self.is_leader = True
+        print(f"当前worker成为事件总线领导者: {os.getpid()}")
+        await self._server.serve_forever()
+
+    async def _handle_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._peers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self._relay(line, exclude=writer)
+                self._dispatch_line(line)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+    def _relay(self, line: bytes, exclude=None):
+        for peer in list(self._peers):
+            if peer is exclude:
+                continue
+            # 跟随者长时间不读取时断开，避免领导者内存无限增长
+            if peer.transport.get_write_buffer_size() > MAX_PEER_BUFFER:
+                self._peers.discard(peer)
+                peer.close()
+                continue
+            peer.write(line)
+
+    def _dispatch_line(self, line: bytes):
+        try:
+            event = json.loads(line)
+        except ValueError:
+            return
+        self._dispatch(event)
+
+class RedisBus(EventBus):
+    """基于Redis发布订阅的事件总线，需要安装 redis 包；
+    任何兼容RESP协议的服务（如本地替身服务）都可以通过 SCENIC_REDIS_URL 替换"""
+    def __init__(self, url: str = REDIS_URL, channel: str = REDIS_CHANNEL):
+        super().__init__()
+        self.url = url
+        self.channel = channel
+        self.node_id = uuid.uuid4().hex
+        self.is_leader = False
+        self._redis = None
+        self._outbox: asyncio.Queue = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+
+    def publish(self, event: dict) -> None:
+        self._dispatch(event)
+        self._outbox.put_nowait(encode_event({"origin": self.node_id, "event": event}))
+
+    async def start(self) -> None:
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("使用Redis事件总线需要安装 redis 包")
+        self._redis = redis.from_url(self.url)
+        self._tasks = [
+            asyncio.create_task(self._send()),
+            asyncio.create_task(self._listen()),
+            asyncio.create_task(self._elect()),
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        if self._redis is not None:
+            if self.is_leader:
+                await self._redis.delete(self._lock_key)
+            await self._redis.close()
+        self.is_leader = False
+
+    @property
+    def _lock_key(self) -> str:
+        return self.channel + ":leader"
+
+    async def _send(self):
+        while True:
+            line = await self._outbox.get()
+            try:
+                await self._redis.publish(self.channel, line)
+            except Exception as e:
+                print(f"发布事件失败: {e}")
+
+    async def _listen(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub()
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    envelope = json.loads(message["data"])
+                    if envelope.get("origin") != self.node_id:
+                        self._dispatch(envelope["event"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"订阅事件失败: {e}")
+                await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _elect(self):
+        while True:
+            try:
+                if await self._redis.set(self._lock_key, self.node_id, nx=True, px=LEADER_LOCK_TTL):
+                    self.is_leader = True
+                elif self.is_leader:
+                    # 续期自己持有的锁，锁已被他人持有时放弃领导者身份
+                    owner = await self._redis.get(self._lock_key)
+                    self.is_leader = owner is not None and owner.decode() == self.node_id
+                    if self.is_leader:
+                        await self._redis.pexpire(self._lock_key, LEADER_LOCK_TTL)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"竞选事件总线领导者失败: {e}")
+                self.is_leader = False
+            await asyncio.sleep(LEADER_LOCK_TTL / 3000)
+
+def create_bus(kind: str = EVENT_BUS) -> EventBus:
+    """根据配置创建事件总线"""
+    if kind == "unix":
+        return UnixSocketBus()
+    if kind == "redis":
+        return RedisBus()
+    return InProcessBus()
+
+# 创建事件总线实例
+bus = create_bus()
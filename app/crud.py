@@ -1,12 +1,17 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update
-from typing import List, Optional
+from sqlalchemy import select, update, insert, func, or_, union_all
+from sqlalchemy.exc import IntegrityError
+from typing import AsyncIterator, List, Optional
 from datetime import datetime, timedelta
-import math
-import bcrypt
+from itertools import islice
+import heapq
 
-from .models import Car, User, RentOrder
+from .models import Car, User, RentOrder, RentOrderArchive
 from .schemas import CarCreate, UserCreate, RentOrderCreate
+from .fleet import area_of, broadcaster
+from .rides import ride_registry
+from .tariff import tariff_engine
+from .passwords import hash_password_async
 
 # 车辆相关CRUD
 
@@ -23,35 +28,45 @@ async def get_all_cars(session: AsyncSession) -> List[Car]:
     return result.scalars().all()
 
 async def create_car(session: AsyncSession, car: CarCreate) -> Car:
-    db_car = Car(
-        name=car.name,
-        plate=car.plate,
-        status=car.status,
-        battery=car.battery,
-        qrcode=car.qrcode
+    # INSERT ... RETURNING 一次往返拿到完整的车辆记录
+    result = await session.execute(
+        insert(Car)
+        .values(
+            name=car.name,
+            plate=car.plate,
+            status=car.status,
+            battery=car.battery,
+            qrcode=car.qrcode,
+            lat=car.lat,
+            lng=car.lng
+        )
+        .returning(Car)
     )
-    session.add(db_car)
+    db_car = result.scalar_one()
     await session.commit()
-    await session.refresh(db_car)
+    broadcaster.publish_car(db_car)
     return db_car
 
-async def update_car_status(session: AsyncSession, car_id: int, status: int) -> Optional[Car]:
-    result = await session.execute(select(Car).where(Car.id == car_id))
+async def _update_car(session: AsyncSession, car_id: int, **values) -> Optional[Car]:
+    # UPDATE ... RETURNING 代替先查询再修改再刷新
+    result = await session.execute(
+        update(Car)
+        .where(Car.id == car_id)
+        .values(**values)
+        .returning(Car)
+        .execution_options(populate_existing=True)
+    )
     car = result.scalar_one_or_none()
+    await session.commit()
     if car:
-        car.status = status
-        await session.commit()
-        await session.refresh(car)
+        broadcaster.publish_car(car)
     return car
 
+async def update_car_status(session: AsyncSession, car_id: int, status: int) -> Optional[Car]:
+    return await _update_car(session, car_id, status=status)
+
 async def update_car_battery(session: AsyncSession, car_id: int, battery: int) -> Optional[Car]:
-    result = await session.execute(select(Car).where(Car.id == car_id))
-    car = result.scalar_one_or_none()
-    if car:
-        car.battery = battery
-        await session.commit()
-        await session.refresh(car)
-    return car
+    return await _update_car(session, car_id, battery=battery)
 
 # 用户相关CRUD
 
@@ -71,74 +86,301 @@ async def get_user_by_phone(session: AsyncSession, phone: str) -> Optional[User]
     result = await session.execute(select(User).where(User.phone == phone))
     return result.scalar_one_or_none()
 
-# 密码哈希处理
-def hash_password(password: str) -> str:
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed.decode('utf-8')
-
-def verify_password(password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
-
 async def create_user(session: AsyncSession, user: UserCreate) -> User:
-    # 密码哈希处理
-    hashed_password = hash_password(user.password)
+    # 密码哈希处理（在线程池中执行，不阻塞事件循环）
+    hashed_password = await hash_password_async(user.password)
     
-    db_user = User(
-        openid=user.openid,
-        nickname=user.nickname,
-        phone=user.phone,
-        password=hashed_password,
-        role=getattr(user, 'role', 0),  # 默认角色为游客(0)
-        deposit=getattr(user, 'deposit', 0.0)  # 默认押金为0
+    result = await session.execute(
+        insert(User)
+        .values(
+            openid=user.openid,
+            nickname=user.nickname,
+            phone=user.phone,
+            password=hashed_password,
+            role=getattr(user, 'role', 0),  # 默认角色为游客(0)
+            deposit=getattr(user, 'deposit', 0.0)  # 默认押金为0
+        )
+        .returning(User)
     )
-    session.add(db_user)
+    db_user = result.scalar_one()
     await session.commit()
-    await session.refresh(db_user)
     return db_user
 
+async def _update_user(session: AsyncSession, user_id: int, **values) -> Optional[User]:
+    result = await session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(**values)
+        .returning(User)
+        .execution_options(populate_existing=True)
+    )
+    user = result.scalar_one_or_none()
+    await session.commit()
+    return user
+
+# 角色和押金变更使已签发令牌中的声明失效
+_NEXT_TOKEN_VERSION = func.coalesce(User.token_version, 0) + 1
+
+async def update_user_role(session: AsyncSession, user_id: int, role: int) -> Optional[User]:
+    return await _update_user(session, user_id, role=role, token_version=_NEXT_TOKEN_VERSION)
+
+async def update_user_deposit(session: AsyncSession, user_id: int, deposit: float) -> Optional[User]:
+    return await _update_user(session, user_id, deposit=deposit, token_version=_NEXT_TOKEN_VERSION)
+
+async def update_user_password(session: AsyncSession, user_id: int, hashed_password: str) -> None:
+    await session.execute(update(User).where(User.id == user_id).values(password=hashed_password))
+    await session.commit()
+
 # 订单相关CRUD
 
-async def get_orders(session: AsyncSession, skip: int = 0, limit: int = 100) -> List[RentOrder]:
-    result = await session.execute(select(RentOrder).offset(skip).limit(limit))
-    return result.scalars().all()
+# 订单分为近期表和归档表（见 app.archive），两张表的列相同；未结束的订单只在近期表中
+ORDER_TIERS = (RentOrder, RentOrderArchive)
+# 订单列表返回的列，与 schemas.RentOrder 一致
+ORDER_COLUMNS = ("id", "user_id", "car_id", "start_at", "end_at", "fee")
 
 async def get_orders_by_user(session: AsyncSession, user_id: int) -> List[RentOrder]:
-    result = await session.execute(select(RentOrder).where(RentOrder.user_id == user_id))
-    return result.scalars().all()
+    """用户的全部订单，包括已归档的"""
+    orders = []
+    for table in ORDER_TIERS:
+        result = await session.execute(select(table).where(table.user_id == user_id))
+        orders.extend(result.scalars().all())
+    return orders
+
+def order_history(name: str = "order_history"):
+    """近期订单和归档订单的 UNION ALL 子查询，列为 ORDER_COLUMNS"""
+    return union_all(*(
+        select(*(getattr(table, column) for column in ORDER_COLUMNS)) for table in ORDER_TIERS
+    )).subquery(name)
+
+def _order_tiers(is_open: Optional[bool]):
+    # 只查未结束的订单时不需要读归档表
+    return ORDER_TIERS[:1] if is_open else ORDER_TIERS
+
+async def list_orders(
+    session: AsyncSession,
+    user_id: Optional[int] = None,
+    car_id: Optional[int] = None,
+    start_from: Optional[datetime] = None,
+    start_to: Optional[datetime] = None,
+    is_open: Optional[bool] = None,
+    before_id: Optional[int] = None,
+    limit: int = 100,
+) -> List[RentOrder]:
+    """按id倒序的键集分页，before_id 为上一页最后一条订单的id；
+    翻页代价与页码无关，不会像OFFSET一样随着翻页越来越慢。
+    近期表和归档表各取一页后按id合并，归档订单返回 RentOrderArchive 对象"""
+    pages = []
+    for table in _order_tiers(is_open):
+        query = _order_page(select(table), table, user_id, car_id, start_from, start_to, is_open, before_id, limit)
+        pages.append((await session.execute(query)).scalars().all())
+    return _merge_pages(pages, limit, key=lambda order: order.id)
+
+async def list_order_rows(
+    session: AsyncSession,
+    user_id: Optional[int] = None,
+    car_id: Optional[int] = None,
+    start_from: Optional[datetime] = None,
+    start_to: Optional[datetime] = None,
+    is_open: Optional[bool] = None,
+    before_id: Optional[int] = None,
+    limit: int = 100,
+) -> List[tuple]:
+    """与 list_orders 相同的分页，只查询 ORDER_COLUMNS 列元组，不构造ORM对象"""
+    pages = []
+    for table in _order_tiers(is_open):
+        query = _order_page(
+            select(*(getattr(table, column) for column in ORDER_COLUMNS)), table,
+            user_id, car_id, start_from, start_to, is_open, before_id, limit,
+        )
+        pages.append((await session.execute(query)).all())
+    return _merge_pages(pages, limit, key=lambda row: row[0])
+
+def _merge_pages(pages, limit: int, key) -> list:
+    if len(pages) == 1:
+        return list(pages[0])
+    return list(islice(heapq.merge(*pages, key=key, reverse=True), limit))
+
+def _order_page(query, table, user_id, car_id, start_from, start_to, is_open, before_id, limit):
+    query = _filter_orders(query, user_id, car_id, start_from, start_to, is_open, table)
+    if before_id is not None:
+        query = query.where(table.id < before_id)
+    return query.order_by(table.id.desc()).limit(limit)
+
+def _filter_orders(query, user_id=None, car_id=None, start_from=None, start_to=None, is_open=None, table=RentOrder):
+    """table 可以是订单模型或 order_history() 子查询的列"""
+    if user_id is not None:
+        query = query.where(table.user_id == user_id)
+    if car_id is not None:
+        query = query.where(table.car_id == car_id)
+    if start_from is not None:
+        query = query.where(table.start_at >= start_from)
+    if start_to is not None:
+        query = query.where(table.start_at < start_to)
+    if is_open is not None:
+        query = query.where(table.end_at.is_(None) if is_open else table.end_at.is_not(None))
+    return query
+
+# 导出订单的列
+ORDER_EXPORT_COLUMNS = ORDER_COLUMNS
+
+async def stream_orders(
+    session: AsyncSession,
+    user_id: Optional[int] = None,
+    car_id: Optional[int] = None,
+    start_from: Optional[datetime] = None,
+    start_to: Optional[datetime] = None,
+    is_open: Optional[bool] = None,
+    batch_size: int = 5000,
+) -> AsyncIterator[list]:
+    """按id顺序分批读取订单列（不构造ORM对象，包括已归档的订单），内存占用与订单总数无关"""
+    history = order_history()
+    query = _filter_orders(select(history), user_id, car_id, start_from, start_to, is_open, history.c)
+    result = await session.stream(
+        query.order_by(history.c.id).execution_options(yield_per=batch_size)
+    )
+    async for partition in result.partitions():
+        yield partition
 
 async def get_order(session: AsyncSession, order_id: int) -> Optional[RentOrder]:
-    result = await session.execute(select(RentOrder).where(RentOrder.id == order_id))
-    return result.scalar_one_or_none()
+    """先查近期表，没有时查归档表"""
+    for table in ORDER_TIERS:
+        result = await session.execute(select(table).where(table.id == order_id))
+        order = result.scalar_one_or_none()
+        if order is not None:
+            return order
+    return None
 
 async def create_order(session: AsyncSession, order: RentOrderCreate) -> RentOrder:
-    db_order = RentOrder(
-        user_id=order.user_id,
-        car_id=order.car_id
+    result = await session.execute(
+        insert(RentOrder)
+        .values(user_id=order.user_id, car_id=order.car_id, start_at=datetime.now())
+        .returning(RentOrder)
     )
-    session.add(db_order)
+    db_order = result.scalar_one()
     await session.commit()
-    await session.refresh(db_order)
     return db_order
 
-async def return_car(session: AsyncSession, order_id: int) -> Optional[RentOrder]:
-    result = await session.execute(select(RentOrder).where(RentOrder.id == order_id))
-    order = result.scalar_one_or_none()
+async def get_user_fees_on(session: AsyncSession, user_id: int, day: datetime) -> float:
+    """用户在day当天结束的订单的费用合计（只查近期表，用于当天的封顶计费）"""
+    day_start = day.replace(hour=0, minute=0, second=0, microsecond=0)
+    result = await session.execute(
+        select(func.coalesce(func.sum(RentOrder.fee), 0)).where(
+            RentOrder.user_id == user_id,
+            RentOrder.end_at >= day_start,
+            RentOrder.end_at < day_start + timedelta(days=1),
+        )
+    )
+    return float(result.scalar())
+
+def _not_held_for_others(user_id: int, now: datetime):
+    """车辆没有预留、预留给该用户或预留已过期"""
+    return or_(Car.held_by.is_(None), Car.held_by == user_id, Car.held_until < now)
+
+async def rent_car(session: AsyncSession, car_id: int, user_id: int):
+    """原子租车：只有车辆仍为可租状态时才能租出，返回订单(id, user_id, car_id, start_at)；
+    车辆不可租或用户已有未结束的订单时返回None"""
+    # 条件更新：并发租同一辆车时只有一个请求能把状态从0改为1；预留给其他用户的车辆不能租
+    result = await session.execute(
+        update(Car)
+        .where(Car.id == car_id, Car.status == 0, _not_held_for_others(user_id, datetime.now()))
+        .values(status=1, held_by=None, held_until=None)
+        .returning(Car)
+        .execution_options(populate_existing=True)
+    )
+    car = result.scalar_one_or_none()
+    if car is None:
+        await session.rollback()
+        return None
     
-    if order and not order.end_at:
-        # 计算费用
-        order.end_at = datetime.now()
-        duration = (order.end_at - order.start_at).total_seconds() / 60  # 转换为分钟
-        order.fee = max(1.0, math.ceil(duration) * 0.5)  # 最小1元，每分钟0.5元
-        
-        # 更新车辆状态
-        await session.execute(
-            update(Car)
-            .where(Car.id == order.car_id)
-            .values(status=0)
+    # 在同一事务中创建订单；用户已有未结束的订单时违反部分唯一索引
+    try:
+        result = await session.execute(
+            insert(RentOrder)
+            .values(user_id=user_id, car_id=car_id, start_at=datetime.now())
+            .returning(RentOrder.id, RentOrder.user_id, RentOrder.car_id, RentOrder.start_at)
         )
-        
-        await session.commit()
-        await session.refresh(order)
+    except IntegrityError:
+        await session.rollback()
+        return None
+    order = result.one()
+    await session.commit()
+    broadcaster.publish_car(car)
+    ride_registry.publish_start(order)
+    return order
+
+async def return_car(session: AsyncSession, order_id: int) -> Optional[RentOrder]:
+    """原子还车：只有未结束的订单才能结算，订单不存在或已结束时返回None"""
+    result = await session.execute(
+        select(RentOrder.start_at, RentOrder.car_id, RentOrder.user_id, Car.name)
+        .outerjoin(Car, Car.id == RentOrder.car_id)
+        .where(RentOrder.id == order_id)
+    )
+    row = result.one_or_none()
+    if row is None:
+        return None
     
-    return order
\ No newline at end of file
+    # 按当前计费规则计算费用
+    end_at = datetime.now()
+    tariff = tariff_engine.current()
+    spent_today = 0.0
+    if tariff.rules.daily_cap is not None:
+        spent_today = await get_user_fees_on(session, row.user_id, end_at)
+    fee = tariff.price(row.start_at, end_at, area_of(row.name or ""), spent_today)
+    
+    # 条件更新：并发还车时只有一个请求能结束订单
+    result = await session.execute(
+        update(RentOrder)
+        .where(RentOrder.id == order_id, RentOrder.end_at.is_(None))
+        .values(end_at=end_at, fee=fee)
+        .returning(RentOrder)
+        .execution_options(populate_existing=True)
+    )
+    order = result.scalar_one_or_none()
+    if order is None:
+        await session.rollback()
+        return None
+    
+    # 更新车辆状态，维修中的车辆保持维修状态
+    result = await session.execute(
+        update(Car)
+        .where(Car.id == row.car_id, Car.status == 1)
+        .values(status=0)
+        .returning(Car)
+        .execution_options(populate_existing=True)
+    )
+    car = result.scalar_one_or_none()
+    await session.commit()
+    if car is not None:
+        broadcaster.publish_car(car)
+    ride_registry.publish_end(order)
+    return order
+
+# 候补预留相关CRUD
+
+async def hold_car(session: AsyncSession, car_id: int, user_id: int, until: datetime) -> bool:
+    """把空闲车辆预留给用户；车辆已被租用、维修或预留给他人时返回False"""
+    # 预留不算车辆状态变更，保持updated_at不变，避免对账时被当作变更重新发布
+    result = await session.execute(
+        update(Car)
+        .where(Car.id == car_id, Car.status == 0, _not_held_for_others(user_id, datetime.now()))
+        .values(held_by=user_id, held_until=until, updated_at=Car.updated_at)
+    )
+    await session.commit()
+    return result.rowcount == 1
+
+async def release_hold(session: AsyncSession, car_id: int, user_id: int) -> bool:
+    """取消车辆对该用户的预留，预留已不属于该用户时返回False"""
+    result = await session.execute(
+        update(Car)
+        .where(Car.id == car_id, Car.held_by == user_id)
+        .values(held_by=None, held_until=None, updated_at=Car.updated_at)
+    )
+    await session.commit()
+    return result.rowcount == 1
+
+async def get_holds(session: AsyncSession) -> List[tuple]:
+    """所有预留 (car_id, user_id, 到期时间)"""
+    result = await session.execute(
+        select(Car.id, Car.held_by, Car.held_until).where(Car.held_by.is_not(None))
+    )
+    return result.all()
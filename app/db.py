@@ -1,17 +1,69 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
-# 创建异步引擎
-engine = create_async_engine("sqlite+aiosqlite:///./scenic.db", echo=True)
+from .config import DatabaseSettings, database_settings
+from .metrics import instrument_engine
+
+def _sqlite_pragmas(settings: DatabaseSettings):
+    pragmas = [
+        ("journal_mode", settings.journal_mode),
+        ("synchronous", settings.synchronous),
+        ("busy_timeout", settings.busy_timeout),
+        ("mmap_size", settings.mmap_size),
+        ("cache_size", settings.cache_size),
+    ]
+    return [f"PRAGMA {name}={value}" for name, value in pragmas if value is not None]
+
+def create_engine(settings: DatabaseSettings = database_settings) -> AsyncEngine:
+    """根据配置创建异步引擎，应用和 init_db.py 共用"""
+    kwargs = {"echo": settings.echo}
+    if settings.is_sqlite and ":memory:" in settings.url:
+        # 内存数据库只能使用同一个连接
+        kwargs["poolclass"] = StaticPool
+    else:
+        kwargs.update(
+            pool_size=settings.pool_size,
+            max_overflow=settings.max_overflow,
+            pool_timeout=settings.pool_timeout,
+            pool_recycle=settings.pool_recycle,
+        )
+    if settings.is_postgres:
+        # 网络数据库的连接可能被服务端断开，取用前先检测
+        kwargs["pool_pre_ping"] = True
+        # asyncpg在服务端预编译语句并按连接缓存，重复的SQL省去解析和规划
+        kwargs["connect_args"] = {"prepared_statement_cache_size": settings.statement_cache_size}
+    engine = create_async_engine(settings.url, **kwargs)
+
+    if settings.is_sqlite:
+        pragmas = _sqlite_pragmas(settings)
+
+        # 每个新连接建立时设置WAL、busy_timeout等参数
+        @event.listens_for(engine.sync_engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in pragmas:
+                cursor.execute(pragma)
+            cursor.close()
+
+    return engine
+
+def create_session_factory(engine: AsyncEngine):
+    return sessionmaker(
+        bind=engine,
+        class_=AsyncSession,
+        expire_on_commit=False
+    )
+
+# 创建异步引擎，记录SQL耗时
+engine = create_engine()
+instrument_engine(engine)
 
 # 创建会话工厂
-async_session = sessionmaker(
-    bind=engine,
-    class_=AsyncSession,
-    expire_on_commit=False
-)
+async_session = create_session_factory(engine)
 
 # 依赖项：获取数据库会话
 async def get_session() -> AsyncSession:
     async with async_session() as session:
-        yield session
\ No newline at end of file
+        yield session
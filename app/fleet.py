@@ -0,0 +1,241 @@
+from bisect import insort
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import asyncio
+import hashlib
+import re
+
+from .bus import bus
+from .responses import dumps
+
+# 车队状态变更跟踪：记录最近一次推送给客户端的状态，只推送发生变化的车辆
+
+# 推送给客户端的车辆字段
+STATUS_FIELDS = ("battery", "status")
+# 车辆事件携带的完整字段，与 schemas.Car 一致
+CAR_FIELDS = ("name", "plate", "status", "battery", "qrcode", "lat", "lng", "updated_at")
+# 车辆列表缓存的分页数，(skip, limit) 由客户端决定，只保留最近使用的几页
+LIST_CACHE_SIZE = 16
+
+# 可订阅的主题前缀：car:{car_id}、area:{景区}、status:{状态}
+TOPIC_PREFIXES = ("car", "area", "status")
+
+def area_of(name: Optional[str]) -> str:
+    """从车辆名称中取出景区名，如 西湖0101 -> 西湖"""
+    match = re.match(r"\D+", name or "")
+    return match.group(0) if match else ""
+
+def car_event(car) -> dict:
+    """由ORM车辆对象生成事件总线上的车辆事件"""
+    event = {"type": "car", "car_id": car.id}
+    for field in CAR_FIELDS:
+        value = getattr(car, field)
+        event[field] = value.isoformat() if isinstance(value, datetime) else value
+    return event
+
+def car_topics(car_id: int, area: str, *statuses) -> Set[str]:
+    """车辆对应的订阅主题"""
+    topics = {f"car:{car_id}"}
+    if area:
+        topics.add(f"area:{area}")
+    for status in statuses:
+        if status is not None:
+            topics.add(f"status:{status}")
+    return topics
+
+class FleetBroadcaster:
+    def __init__(self):
+        # 已推送的版本号，每推送一次增量加1
+        self.version = 0
+        # 最近一次推送的车辆状态 car_id -> {"battery", "status"}
+        self._state: Dict[int, dict] = {}
+        # 尚未推送的变更，同一辆车的多次变更只保留最新值
+        self._pending: Dict[int, dict] = {}
+        # 车辆所属景区 car_id -> 景区名
+        self._areas: Dict[int, str] = {}
+        self._changed = asyncio.Event()
+
+    def load(self, cars) -> None:
+        """用数据库中的车辆初始化状态（不产生增量）"""
+        self._state = {
+            car.id: {"battery": car.battery, "status": car.status}
+            for car in cars
+        }
+        self._areas = {car.id: area_of(car.name) for car in cars}
+        self._pending.clear()
+
+    def publish(self, car_id: int, **fields) -> None:
+        """通过事件总线发布车辆变更，所有worker都会收到"""
+        changes = {
+            key: value for key, value in fields.items()
+            if key in CAR_FIELDS and value is not None
+        }
+        if changes:
+            bus.publish({"type": "car", "car_id": car_id, **changes})
+
+    def apply(self, event: dict) -> None:
+        """登记事件总线上的车辆变更，字段与上次推送一致时忽略"""
+        car_id = event["car_id"]
+        if event.get("name") is not None:
+            self._areas[car_id] = area_of(event["name"])
+        current = self._pending.get(car_id) or self._state.get(car_id) or {}
+        changes = {
+            key: event[key] for key in STATUS_FIELDS
+            if event.get(key) is not None and current.get(key) != event[key]
+        }
+        if not changes:
+            return
+        self._pending[car_id] = {**current, **changes}
+        self._changed.set()
+
+    def publish_car(self, car) -> None:
+        """发布ORM车辆对象的完整最新状态"""
+        bus.publish(car_event(car))
+
+    async def wait_for_changes(self, timeout: float) -> bool:
+        """等待新的变更，超时返回False"""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def collect_delta(self) -> Optional[Tuple[dict, List[Set[str]]]]:
+        """取出待推送的变更，生成增量消息及每辆车对应的订阅主题，没有变更时返回None"""
+        self._changed.clear()
+        if not self._pending:
+            return None
+        pending, self._pending = self._pending, {}
+        # 状态变化的车辆同时发给新旧两个状态主题的订阅者，便于客户端移除
+        topics = [
+            car_topics(car_id, self._areas.get(car_id, ""),
+                       car.get("status"), self._state.get(car_id, {}).get("status"))
+            for car_id, car in sorted(pending.items())
+        ]
+        self._state.update(pending)
+        self.version += 1
+        message = {
+            "type": "delta",
+            "version": self.version,
+            "cars": _to_messages(pending),
+        }
+        return message, topics
+
+    def snapshot(self, topics: Optional[Iterable[str]] = None) -> dict:
+        """生成全量快照，用于新连接或重连的客户端；指定主题时只包含订阅的车辆"""
+        cars = self._state
+        if topics:
+            topics = set(topics)
+            cars = {
+                car_id: car for car_id, car in cars.items()
+                if topics & car_topics(car_id, self._areas.get(car_id, ""), car.get("status"))
+            }
+        return {
+            "type": "snapshot",
+            "version": self.version,
+            "cars": _to_messages(cars),
+        }
+
+def _to_messages(cars: Dict[int, dict]) -> List[dict]:
+    return [
+        {"car_id": car_id, "battery": car.get("battery"), "status": car.get("status")}
+        for car_id, car in sorted(cars.items())
+    ]
+
+# 内存车队快照：/cars 接口直接读取，不访问数据库
+class FleetStore:
+    def __init__(self):
+        # 每次车辆变更加1
+        self.version = 0
+        self.loaded = False
+        # car_id -> 与 schemas.Car 相同结构的字典
+        self._cars: Dict[int, dict] = {}
+        self._ids: List[int] = []
+        # 预序列化的响应 (skip, limit) -> (body, etag)，按最近使用排序，车辆变更时清空
+        self._list_cache: "OrderedDict[Tuple[int, int], Tuple[bytes, str]]" = OrderedDict()
+        self._car_cache: Dict[int, Tuple[bytes, str]] = {}
+
+    def load(self, cars) -> None:
+        """用数据库中的车辆重建快照"""
+        self._cars = {}
+        for car in cars:
+            event = car_event(car)
+            self._cars[car.id] = _to_row(car.id, event)
+        self._ids = sorted(self._cars)
+        self._invalidate()
+        self.loaded = True
+
+    def apply(self, event: dict) -> None:
+        """把事件总线上的车辆变更合并进快照"""
+        car_id = event["car_id"]
+        row = self._cars.get(car_id)
+        if row is None:
+            row = self._cars[car_id] = _to_row(car_id, event)
+            insort(self._ids, car_id)
+        else:
+            row.update((field, event[field]) for field in CAR_FIELDS if field in event)
+        self._car_cache.pop(car_id, None)
+        self._list_cache.clear()
+        self.version += 1
+
+    def get(self, car_id: int) -> Optional[dict]:
+        return self._cars.get(car_id)
+
+    def rows(self) -> List[dict]:
+        return [self._cars[car_id] for car_id in self._ids]
+
+    def differs(self, car) -> bool:
+        """数据库中的车辆是否与快照不一致"""
+        row = self._cars.get(car.id)
+        return row is None or _to_row(car.id, car_event(car)) != row
+
+    def reconcile(self, cars) -> None:
+        """与数据库对账，只发布与快照不一致的车辆"""
+        for car in cars:
+            if self.differs(car):
+                broadcaster.publish_car(car)
+
+    def list_payload(self, skip: int = 0, limit: int = 100) -> Tuple[bytes, str]:
+        """车辆列表的序列化结果和ETag，同一版本内只序列化一次"""
+        key = (skip, limit)
+        cached = self._list_cache.get(key)
+        if cached is None:
+            rows = [self._cars[car_id] for car_id in self._ids[skip:skip + limit]]
+            cached = self._list_cache[key] = _encode(rows)
+            if len(self._list_cache) > LIST_CACHE_SIZE:
+                self._list_cache.popitem(last=False)
+        else:
+            self._list_cache.move_to_end(key)
+        return cached
+
+    def car_payload(self, car_id: int) -> Optional[Tuple[bytes, str]]:
+        """单个车辆的序列化结果和ETag，车辆不存在时返回None"""
+        cached = self._car_cache.get(car_id)
+        if cached is None:
+            row = self._cars.get(car_id)
+            if row is None:
+                return None
+            cached = self._car_cache[car_id] = _encode(row)
+        return cached
+
+    def _invalidate(self) -> None:
+        self._list_cache.clear()
+        self._car_cache.clear()
+        self.version += 1
+
+def _to_row(car_id: int, event: dict) -> dict:
+    row = {field: event.get(field) for field in CAR_FIELDS}
+    row["id"] = car_id
+    return row
+
+def _encode(value) -> Tuple[bytes, str]:
+    body = dumps(value)
+    # ETag由内容计算，多个worker对同一份数据给出相同的ETag
+    return body, '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+# 创建车队状态广播器和快照实例
+broadcaster = FleetBroadcaster()
+fleet_store = FleetStore()
+bus.subscribe("car", broadcaster.apply)
+bus.subscribe("car", fleet_store.apply)
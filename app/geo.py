@@ -0,0 +1,124 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+import heapq
+import math
+
+from .bus import bus
+from .fleet import fleet_store
+
+# 附近车辆查询：可租车辆按经纬度放入固定大小的网格，车辆移动或状态变化时只更新所在格子；
+# 查询时从所在格子一圈圈向外扩展，已找到的第k近车辆比下一圈的最近可能距离还近时停止
+
+EARTH_RADIUS = 6371000.0
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+# 网格边长（度），纬度方向约280米
+CELL_DEGREES = 0.0025
+# 不限半径时最多向外扩展的圈数
+MAX_RINGS = 200
+
+def distance(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """两点间的球面距离（米）"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+def _cell(lat: float, lng: float) -> Tuple[int, int]:
+    return math.floor(lat / CELL_DEGREES), math.floor(lng / CELL_DEGREES)
+
+class GridIndex:
+    def __init__(self):
+        # 格子 -> {car_id: (lat, lng)}
+        self._cells: Dict[Tuple[int, int], Dict[int, Tuple[float, float]]] = {}
+        # car_id -> 所在格子
+        self._where: Dict[int, Tuple[int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def put(self, car_id: int, lat: float, lng: float) -> None:
+        cell = _cell(lat, lng)
+        old = self._where.get(car_id)
+        if old is not None and old != cell:
+            self._discard(old, car_id)
+        self._cells.setdefault(cell, {})[car_id] = (lat, lng)
+        self._where[car_id] = cell
+
+    def remove(self, car_id: int) -> None:
+        cell = self._where.pop(car_id, None)
+        if cell is not None:
+            self._discard(cell, car_id)
+
+    def _discard(self, cell: Tuple[int, int], car_id: int) -> None:
+        cars = self._cells.get(cell)
+        if cars is not None:
+            cars.pop(car_id, None)
+            if not cars:
+                del self._cells[cell]
+
+    def nearest(self, lat: float, lng: float, k: int = 10, radius: Optional[float] = None,
+                exclude: Iterable[int] = ()) -> List[Tuple[float, int]]:
+        """距离最近的k辆车 [(距离米, car_id)]，按距离排序"""
+        if not self._where or k <= 0:
+            return []
+        exclude = exclude if isinstance(exclude, (set, frozenset, dict)) else set(exclude)
+        row, col = _cell(lat, lng)
+        # 经度方向的格子更窄，按较窄的一边估计下一圈的最近距离
+        cos_lat = max(math.cos(math.radians(min(abs(lat) + CELL_DEGREES, 90.0))), 1e-6)
+        ring_meters = CELL_DEGREES * METERS_PER_DEGREE * cos_lat
+        rings = MAX_RINGS if radius is None else min(MAX_RINGS, math.ceil(radius / ring_meters) + 1)
+        # 最大堆（取负距离）保存当前最近的k辆
+        best: List[Tuple[float, int]] = []
+        for ring in range(rings + 1):
+            for cell in _ring_cells(row, col, ring):
+                for car_id, (car_lat, car_lng) in self._cells.get(cell, {}).items():
+                    if car_id in exclude:
+                        continue
+                    d = distance(lat, lng, car_lat, car_lng)
+                    if radius is not None and d > radius:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-d, car_id))
+                    elif d < -best[0][0]:
+                        heapq.heapreplace(best, (-d, car_id))
+            # 下一圈中的车辆至少相距 ring 个格子
+            reach = ring * ring_meters
+            if len(best) == k and -best[0][0] <= reach:
+                break
+            if radius is not None and reach > radius:
+                break
+        return sorted((-d, car_id) for d, car_id in best)
+
+def _ring_cells(row: int, col: int, ring: int):
+    if ring == 0:
+        yield row, col
+        return
+    for c in range(col - ring, col + ring + 1):
+        yield row - ring, c
+        yield row + ring, c
+    for r in range(row - ring + 1, row + ring):
+        yield r, col - ring
+        yield r, col + ring
+
+class NearbyIndex(GridIndex):
+    """可租且有位置的车辆，随事件总线上的车辆变更增量更新"""
+    def load(self, rows: Iterable[dict]) -> None:
+        self._cells.clear()
+        self._where.clear()
+        for row in rows:
+            self.update(row)
+
+    def update(self, row: dict) -> None:
+        if row.get("status") == 0 and row.get("lat") is not None and row.get("lng") is not None:
+            self.put(row["id"], row["lat"], row["lng"])
+        else:
+            self.remove(row["id"])
+
+    def apply(self, event: dict) -> None:
+        # 快照已合并本次变更（fleet_store 先于本索引订阅）
+        row = fleet_store.get(event["car_id"])
+        if row is not None:
+            self.update(row)
+
+# 创建附近车辆索引实例
+nearby_index = NearbyIndex()
+bus.subscribe("car", nearby_index.apply)
@@ -0,0 +1,339 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+import asyncio
+import mmap
+import os
+import struct
+import time
+
+from .bus import bus
+from .config import env_int, env_str
+
+# 电量历史：每辆车的原始采样和1分钟/15分钟/1小时汇总先保存在定长数组环形缓冲区中，
+# 由事件总线领导者定期追加写入定长二进制文件，按时间二分查找实现快速区间查询
+
+HISTORY_DIR = env_str("SCENIC_HISTORY_DIR", "./data/history")
+# 写盘间隔（秒）
+HISTORY_FLUSH_INTERVAL = env_int("SCENIC_HISTORY_FLUSH_INTERVAL", 30)
+# 每辆车每个粒度在内存中保留的最近记录数，需大于一个写盘间隔内产生的记录数
+HISTORY_RING_SIZE = env_int("SCENIC_HISTORY_RING_SIZE", 1024)
+# 汇总桶结束后再等待的秒数，事件总线延迟到达的采样仍计入所属的桶
+HISTORY_LATE_SECONDS = env_int("SCENIC_HISTORY_LATE_SECONDS", 60)
+
+# 汇总粒度（秒）
+RESOLUTIONS = {"1m": 60, "15m": 900, "1h": 3600}
+RAW = "raw"
+
+# 磁盘记录格式（小端）：
+# 原始采样 时间戳uint32 电量uint8
+# 汇总     桶开始时间uint32 平均值float32 最小值uint8 最大值uint8 采样数uint16
+RAW_RECORD = struct.Struct("<IB")
+ROLLUP_RECORD = struct.Struct("<IfBBH")
+# 内存中对应的列类型
+RAW_COLUMNS = ("I", "B")
+ROLLUP_COLUMNS = ("I", "f", "B", "B", "H")
+
+class RecordRing:
+    """定长环形缓冲区，每个字段一个array，按时间顺序追加"""
+    def __init__(self, typecodes: Tuple[str, ...], capacity: int):
+        self.capacity = capacity
+        self._columns = [array(code, bytes(array(code).itemsize * capacity)) for code in typecodes]
+        self._head = 0  # 下一条记录的位置
+        self.size = 0
+
+    def append(self, values: tuple) -> None:
+        for column, value in zip(self._columns, values):
+            column[self._head] = value
+        self._head = (self._head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def last_ts(self) -> Optional[int]:
+        if not self.size:
+            return None
+        return self._columns[0][self._head - 1]
+
+    def pop(self) -> tuple:
+        """取出最新的一条记录"""
+        self._head = (self._head - 1) % self.capacity
+        self.size -= 1
+        return tuple(column[self._head] for column in self._columns)
+
+    def records(self, after: int = -1, start: int = 0, end: int = 2 ** 32) -> List[tuple]:
+        """时间戳大于after且在[start, end]内的记录，按时间排序"""
+        # 从最新的记录往前找，通常只需要看最近几条
+        result = []
+        timestamps = self._columns[0]
+        for offset in range(1, self.size + 1):
+            index = (self._head - offset) % self.capacity
+            ts = timestamps[index]
+            if ts <= after or ts < start:
+                break
+            if ts <= end:
+                result.append(tuple(column[index] for column in self._columns))
+        result.reverse()
+        return result
+
+class _Bucket:
+    """尚未结束的汇总桶"""
+    __slots__ = ("start", "total", "low", "high", "count")
+
+    def __init__(self, start: int, battery: int):
+        self.start = start
+        self.total = battery
+        self.low = self.high = battery
+        self.count = 1
+
+    @classmethod
+    def reopen(cls, record: tuple) -> "_Bucket":
+        """由已结束的汇总记录恢复桶，用于合并迟到的采样"""
+        start, mean, low, high, count = record
+        bucket = cls(start, low)
+        bucket.total, bucket.high, bucket.count = round(mean * count), high, count
+        return bucket
+
+    def add(self, battery: int) -> None:
+        self.low = min(self.low, battery)
+        self.high = max(self.high, battery)
+        # 采样数以uint16存储，饱和后均值按已计入的采样计算
+        if self.count < 0xFFFF:
+            self.total += battery
+            self.count += 1
+
+    def record(self) -> tuple:
+        return (self.start, self.total / self.count, self.low, self.high, self.count)
+
+class _TimestampView:
+    """把mmap中的定长记录当作时间戳序列，供bisect二分查找"""
+    def __init__(self, buffer, record: struct.Struct, count: int):
+        self._buffer = buffer
+        self._record = record
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int) -> int:
+        return struct.unpack_from("<I", self._buffer, index * self._record.size)[0]
+
+class CarSeries:
+    """单辆车的电量历史"""
+    def __init__(self, capacity: int):
+        self.rings = {RAW: RecordRing(RAW_COLUMNS, capacity)}
+        self.rings.update({name: RecordRing(ROLLUP_COLUMNS, capacity) for name in RESOLUTIONS})
+        self.buckets: Dict[str, _Bucket] = {}
+        self.last: Optional[Tuple[int, int]] = None
+        # 各粒度已写盘的最后一个桶的开始时间，写盘后的桶不再重新打开
+        self.written: Dict[str, int] = {}
+
+    def add(self, ts: int, battery: int) -> bool:
+        """追加一个采样，时间倒退或与上一采样相同的上报被忽略"""
+        if self.last is not None and (ts < self.last[0] or self.last == (ts, battery)):
+            return False
+        if self.last is None or ts > self.last[0]:
+            self.rings[RAW].append((ts, battery))
+        self.last = (ts, battery)
+        for name, seconds in RESOLUTIONS.items():
+            start = ts - ts % seconds
+            bucket = self.buckets.get(name)
+            if bucket is not None and bucket.start == start:
+                bucket.add(battery)
+                continue
+            ring = self.rings[name]
+            if bucket is not None:
+                ring.append(bucket.record())
+            elif ring.last_ts() == start:
+                # 所属的桶已按时间结束：尚未写盘时重新打开合并，已写盘时只保留原始采样
+                if start > self.written.get(name, -1):
+                    bucket = self.buckets[name] = _Bucket.reopen(ring.pop())
+                    bucket.add(battery)
+                continue
+            self.buckets[name] = _Bucket(start, battery)
+        return True
+
+    def close_buckets(self, now: int, late: int = HISTORY_LATE_SECONDS) -> None:
+        """结束时间已过的汇总桶再等待late秒后移入环形缓冲区，等待写盘"""
+        for name, seconds in RESOLUTIONS.items():
+            bucket = self.buckets.get(name)
+            if bucket is not None and now >= bucket.start + seconds + late:
+                self.rings[name].append(bucket.record())
+                del self.buckets[name]
+
+class BatteryHistory:
+    def __init__(self, directory: str = HISTORY_DIR, capacity: int = HISTORY_RING_SIZE,
+                 interval: float = HISTORY_FLUSH_INTERVAL):
+        self.directory = directory
+        self.capacity = capacity
+        self.interval = interval
+        self._series: Dict[int, CarSeries] = {}
+        # 各文件最后一条记录的时间戳，写盘和查询时只取更新的内存记录
+        self._disk_last: Dict[Tuple[str, int], int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def apply(self, event: dict) -> None:
+        """记录事件总线上车辆变更中的电量"""
+        battery = event.get("battery")
+        if battery is None:
+            return
+        self.add(event["car_id"], battery, _event_ts(event))
+
+    def add(self, car_id: int, battery: int, ts: Optional[int] = None) -> bool:
+        series = self._series.get(car_id)
+        if series is None:
+            series = self._series[car_id] = CarSeries(self.capacity)
+        return series.add(int(time.time()) if ts is None else ts, battery)
+
+    def _path(self, name: str, car_id: int) -> str:
+        return os.path.join(self.directory, name, f"{car_id}.bin")
+
+    def _last_on_disk(self, name: str, car_id: int) -> int:
+        key = (name, car_id)
+        if key not in self._disk_last:
+            record = RAW_RECORD if name == RAW else ROLLUP_RECORD
+            last = -1
+            try:
+                with open(self._path(name, car_id), "rb") as f:
+                    f.seek(0, os.SEEK_END)
+                    size = f.tell() - f.tell() % record.size
+                    if size:
+                        f.seek(size - record.size)
+                        last = record.unpack(f.read(record.size))[0]
+            except FileNotFoundError:
+                pass
+            self._disk_last[key] = last
+        return self._disk_last[key]
+
+    def collect(self, now: Optional[int] = None) -> List[tuple]:
+        """收集尚未写盘的记录，返回 [(文件名, car_id, 数据, 最后时间戳)]"""
+        now = int(time.time()) if now is None else now
+        batches = []
+        for car_id, series in self._series.items():
+            series.close_buckets(now)
+            for name, ring in series.rings.items():
+                records = ring.records(after=self._last_on_disk(name, car_id))
+                if records:
+                    record = RAW_RECORD if name == RAW else ROLLUP_RECORD
+                    data = b"".join(record.pack(*values) for values in records)
+                    batches.append((name, car_id, data, records[-1][0]))
+        return batches
+
+    def write(self, batches: List[tuple]) -> int:
+        """追加写入collect的结果，可以在线程中执行"""
+        for name, car_id, data, _ in batches:
+            path = self._path(name, car_id)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "ab") as f:
+                f.write(data)
+        return len(batches)
+
+    async def flush(self) -> int:
+        """把尚未写盘的记录追加到文件，返回写入的文件数；可重复调用"""
+        batches = self.collect()
+        if batches:
+            await asyncio.to_thread(self.write, batches)
+            for name, car_id, _, last in batches:
+                self._disk_last[(name, car_id)] = last
+                if name != RAW:
+                    self._series[car_id].written[name] = last
+        return len(batches)
+
+    def _read_disk(self, name: str, car_id: int, start: int, end: int) -> List[tuple]:
+        record = RAW_RECORD if name == RAW else ROLLUP_RECORD
+        try:
+            f = open(self._path(name, car_id), "rb")
+        except FileNotFoundError:
+            return []
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            count = size // record.size
+            if not count:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                view = _TimestampView(buffer, record, count)
+                lo = bisect_left(view, start)
+                hi = bisect_right(view, end)
+                return list(record.iter_unpack(buffer[lo * record.size:hi * record.size]))
+
+    def query(self, car_id: int, start: int, end: int, resolution: str = RAW) -> List[tuple]:
+        """区间内的记录：磁盘上的记录 + 内存中尚未写盘的记录 + 未结束的汇总桶"""
+        records = self._read_disk(resolution, car_id, start, end)
+        # 区间内已写盘的记录都在records中，内存里只需要取更新的记录
+        disk_last = records[-1][0] if records else -1
+        series = self._series.get(car_id)
+        if series is None:
+            return records
+        records.extend(series.rings[resolution].records(after=disk_last, start=start, end=end))
+        bucket = series.buckets.get(resolution)
+        if bucket is not None and bucket.start > disk_last and start <= bucket.start <= end:
+            records.append(bucket.record())
+        return records
+
+    def iter_query(self, car_id: int, start: int, end: int, resolution: str = RAW,
+                   window: int = 86400) -> Iterator[List[tuple]]:
+        """按时间窗口分段查询，导出长时间范围时每次只持有一个窗口的记录"""
+        while start <= end:
+            chunk_end = min(end, start + window - 1)
+            records = self.query(car_id, start, chunk_end, resolution)
+            if records:
+                yield records
+            start = chunk_end + 1
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                # 多worker部署时所有worker都记录采样，只有领导者写盘
+                if bus.is_leader:
+                    await self.flush()
+                else:
+                    # 领导者可能变化，重新成为领导者时以文件为准
+                    self._disk_last.clear()
+                    now = int(time.time())
+                    for series in self._series.values():
+                        series.close_buckets(now)
+            except Exception as e:
+                print(f"写入电量历史时出错: {e}")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if bus.is_leader:
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"写入电量历史时出错: {e}")
+
+def to_epoch(value: datetime) -> int:
+    """不带时区的时间按UTC处理，与数据库中的时间一致"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+def _event_ts(event: dict) -> Optional[int]:
+    """车辆事件中的更新时间，没有时使用当前时间"""
+    updated_at = event.get("updated_at")
+    if not updated_at:
+        return None
+    try:
+        return to_epoch(datetime.fromisoformat(updated_at))
+    except (TypeError, ValueError):
+        return None
+
+def pick_resolution(start: int, end: int, max_points: int) -> str:
+    """选择点数不超过max_points的最细粒度"""
+    if end - start <= max_points * 5:
+        return RAW
+    for name, seconds in RESOLUTIONS.items():
+        if (end - start) / seconds <= max_points:
+            return name
+    return "1h"
+
+# 创建电量历史实例
+battery_history = BatteryHistory()
+bus.subscribe("car", battery_history.apply)
@@ -1,25 +1,61 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, BackgroundTasks
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 
+from .archive import order_archiver
 from .db import engine
-from .models import Base
-from .api import cars, orders, ws, users
+from .bus import bus
+from .history import battery_history
+from .metrics import registry, MetricsMiddleware
+from .migrations import migrate
+from .ratelimit import RateLimitMiddleware
+from .responses import FastJSONResponse
+from .api import cars, orders, ws, users, telemetry, reports, tariff, exports, reservations
+from .reservations import reservation_service
+from .rides import ride_registry
 
 # 创建应用启动时的生命周期上下文管理器
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # 创建数据库表
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    # 执行尚未执行的数据库迁移
+    await migrate(engine)
+    
+    # 连接事件总线
+    await bus.start()
+    
+    # 启动事件循环延迟探测和指标写出
+    registry.start()
     
     # 启动WebSocket状态更新任务
     await ws.start_status_update_task()
     
+    # 加载进行中的订单
+    await ride_registry.start()
+    
+    # 加载车辆预留并启动候补分配
+    await reservation_service.start()
+    
+    # 启动车辆遥测的定期写入
+    telemetry.telemetry_buffer.start()
+    
+    # 启动电量历史的定期写盘
+    battery_history.start()
+    
+    # 启动历史订单归档
+    order_archiver.start()
+    
     # 应用运行中
     yield
     
-    # 应用关闭时清理
+    # 应用关闭时清理，先写入剩余的遥测再断开事件总线
+    await telemetry.telemetry_buffer.stop()
+    await battery_history.stop()
+    await order_archiver.stop()
+    await reservation_service.stop()
+    await ride_registry.stop()
+    await bus.stop()
+    registry.stop()
     await engine.dispose()
 
 # 创建FastAPI应用实例
@@ -27,9 +63,22 @@ app = FastAPI(
     title="景区共享观光车实时租还管理系统",
     description="基于Python+FastAPI的景区共享观光车实时租还管理系统",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    # 设置 SCENIC_FAST_JSON=1 时用orjson序列化
+    default_response_class=FastJSONResponse,
 )
 
+# 记录请求耗时
+app.add_middleware(MetricsMiddleware)
+
+# 限流，最后添加的中间件最先执行，被拒绝的请求不再经过后面的处理
+app.add_middleware(RateLimitMiddleware, identify=users.token_subject)
+
+# Prometheus指标
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 # WebSocket路由
 @app.websocket("/ws/status")
 async def websocket_status(websocket: WebSocket):
@@ -37,20 +86,35 @@ async def websocket_status(websocket: WebSocket):
     # 连接客户端并获取连接ID
     connection_id = await ws.manager.connect(websocket)
     try:
-        # 保持连接，处理可能的客户端消息
+        # 保持连接，处理客户端的订阅/取消订阅消息
         while True:
-            # 接收客户端消息（可选，这里不做处理）
             data = await websocket.receive_text()
-            print(f"接收到消息: {data}")
+            ws.manager.handle_message(connection_id, data)
     except WebSocketDisconnect:
         # 客户端断开连接时处理
         ws.manager.disconnect(connection_id)
         print(f"客户端断开连接: {connection_id}")
 
+# 车辆遥测WebSocket，车辆保持长连接持续上报电量和状态
+@app.websocket("/ws/telemetry")
+async def websocket_telemetry(websocket: WebSocket):
+    await websocket.accept()
+    try:
+        while True:
+            data = await websocket.receive_text()
+            await websocket.send_json(telemetry.handle_message(data))
+    except WebSocketDisconnect:
+        pass
+
 # 注册API路由
 app.include_router(cars.router)
 app.include_router(orders.router)
 app.include_router(users.router)
+app.include_router(telemetry.router)
+app.include_router(reports.router)
+app.include_router(tariff.router)
+app.include_router(exports.router)
+app.include_router(reservations.router)
 
 # 挂载静态文件目录
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -0,0 +1,305 @@
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import glob
+import json
+import os
+import re
+import time
+
+from .config import env_str
+
+# 运行指标：请求耗时、SQL耗时、WebSocket广播、事件循环延迟，以Prometheus文本格式输出。
+# 多worker部署时每个worker定期把自己的指标写到 SCENIC_METRICS_DIR，
+# /metrics 汇总目录中所有worker的指标，不论请求落到哪个worker结果都相同
+
+METRICS_DIR = env_str("SCENIC_METRICS_DIR", None)
+# 写出本worker指标的间隔（秒），超过3个间隔未更新的文件视为worker已退出
+METRICS_DUMP_INTERVAL = 5
+# 事件循环延迟探测间隔（秒）
+LOOP_LAG_INTERVAL = 0.5
+
+# 延迟类直方图的默认分桶（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+LabelValues = Tuple[str, ...]
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def dump(self) -> dict:
+        raise NotImplementedError
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def dump(self) -> dict:
+        return {"values": [[list(key), value] for key, value in self._values.items()]}
+
+class Gauge(Metric):
+    """瞬时值；多个worker按 aggregate（sum 或 max）合并。可以传入回调在采集时取值"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), aggregate: str = "sum",
+                 callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, help, labels)
+        self.aggregate = aggregate
+        self.callback = callback
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, *label_values: str) -> None:
+        self._values[label_values] = value
+
+    def dump(self) -> dict:
+        if self.callback is not None:
+            self._values[()] = float(self.callback())
+        return {"aggregate": self.aggregate,
+                "values": [[list(key), value] for key, value in self._values.items()]}
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # 标签 -> [各分桶计数..., 超出最大分桶的计数, 总和]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        counts = self._values.get(label_values)
+        if counts is None:
+            counts = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def dump(self) -> dict:
+        return {"buckets": list(self.buckets),
+                "values": [[list(key), list(counts)] for key, counts in self._values.items()]}
+
+class MetricsRegistry:
+    def __init__(self, directory: Optional[str] = METRICS_DIR):
+        self.directory = directory
+        self._metrics: Dict[str, Metric] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = (), **kwargs) -> Gauge:
+        return self.register(Gauge(name, help, labels, **kwargs))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), **kwargs) -> Histogram:
+        return self.register(Histogram(name, help, labels, **kwargs))
+
+    def snapshot(self) -> dict:
+        """本worker的全部指标"""
+        return {
+            name: {"kind": metric.kind, "help": metric.help, "labels": list(metric.labels), **metric.dump()}
+            for name, metric in self._metrics.items()
+        }
+
+    def _path(self) -> str:
+        return os.path.join(self.directory, f"{os.getpid()}.json")
+
+    def write_snapshot(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        # 先写临时文件再改名，其他worker不会读到写了一半的文件
+        tmp = self._path() + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False)
+        os.replace(tmp, self._path())
+
+    def _worker_snapshots(self) -> List[dict]:
+        snapshots = [self.snapshot()]
+        if not self.directory:
+            return snapshots
+        stale_before = time.time() - 3 * METRICS_DUMP_INTERVAL
+        own = self._path()
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            if path == own:
+                continue
+            try:
+                if os.path.getmtime(path) < stale_before:
+                    continue
+                with open(path, encoding="utf-8") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self) -> str:
+        """汇总所有worker的指标，输出Prometheus文本格式"""
+        merged: Dict[str, dict] = {}
+        for snapshot in self._worker_snapshots():
+            for name, metric in snapshot.items():
+                target = merged.get(name)
+                if target is None:
+                    merged[name] = target = {**metric, "values": {}}
+                _merge(target, metric)
+        lines = []
+        for name, metric in merged.items():
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['kind']}")
+            labels = metric["labels"]
+            for key, value in metric["values"].items():
+                if metric["kind"] != "histogram":
+                    lines.append(f"{name}{_labels(labels, key)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric["buckets"] + ["+Inf"], value[:-1]):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else _number(bound)
+                    lines.append(f"{name}_bucket{_labels(labels, key, le=le)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels, key)} {_number(value[-1])}")
+                lines.append(f"{name}_count{_labels(labels, key)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    async def run(self) -> None:
+        """探测事件循环延迟，并定期写出本worker的指标"""
+        loop = asyncio.get_running_loop()
+        last_dump = 0.0
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            lag = max(0.0, loop.time() - started - LOOP_LAG_INTERVAL)
+            loop_lag.observe(lag)
+            loop_lag_last.set(lag)
+            if self.directory and started - last_dump >= METRICS_DUMP_INTERVAL:
+                last_dump = started
+                try:
+                    await asyncio.to_thread(self.write_snapshot)
+                except OSError as e:
+                    print(f"写出运行指标失败: {e}")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.directory:
+            try:
+                os.remove(self._path())
+            except OSError:
+                pass
+
+def _merge(target: dict, metric: dict) -> None:
+    values = target["values"]
+    for key, value in metric["values"]:
+        key = tuple(key)
+        current = values.get(key)
+        if current is None:
+            values[key] = list(value) if isinstance(value, list) else value
+        elif metric["kind"] == "histogram":
+            values[key] = [a + b for a, b in zip(current, value)]
+        elif metric.get("aggregate") == "max":
+            values[key] = max(current, value)
+        else:
+            values[key] = current + value
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Sequence[str], **extra) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra.items()]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class MetricsMiddleware:
+    """记录每个HTTP请求的耗时，按路由模板（而不是实际路径）归类"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope["method"]
+            http_requests.inc(method, route, str(status))
+            http_latency.observe(time.perf_counter() - started, method, route)
+
+def instrument_engine(engine) -> None:
+    """通过SQLAlchemy引擎事件记录每条SQL的耗时"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._scenic_started = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_scenic_started", None)
+        if started is not None:
+            sql_latency.observe(time.perf_counter() - started, statement_label(statement))
+
+# SQL语句按 操作+表名 归类，同一语句文本只解析一次
+_STATEMENT_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN)\s+\"?(\w+)", re.IGNORECASE)
+_statement_labels: Dict[str, str] = {}
+
+def statement_label(statement: str) -> str:
+    label = _statement_labels.get(statement)
+    if label is None:
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "?"
+        match = _STATEMENT_TABLE.search(statement)
+        label = f"{verb} {match.group(1)}" if match else verb
+        if len(_statement_labels) < 10000:
+            _statement_labels[statement] = label
+    return label
+
+# 创建指标注册表和常用指标
+registry = MetricsRegistry()
+http_requests = registry.counter(
+    "scenic_http_requests_total", "HTTP请求数", ("method", "route", "status"))
+http_latency = registry.histogram(
+    "scenic_http_request_duration_seconds", "HTTP请求耗时", ("method", "route"))
+sql_latency = registry.histogram(
+    "scenic_sql_duration_seconds", "SQL语句耗时", ("statement",))
+ws_broadcast_latency = registry.histogram(
+    "scenic_ws_broadcast_duration_seconds", "WebSocket增量广播耗时")
+ws_broadcast_fanout = registry.histogram(
+    "scenic_ws_broadcast_fanout", "每次广播发送的连接数", buckets=SIZE_BUCKETS)
+ws_resyncs = registry.counter(
+    "scenic_ws_resyncs_total", "因积压改发快照的次数")
+rate_limited = registry.counter(
+    "scenic_rate_limited_total", "被限流拒绝的请求数", ("rule", "reason"))
+loop_lag = registry.histogram(
+    "scenic_event_loop_lag_seconds", "事件循环延迟")
+loop_lag_last = registry.gauge(
+    "scenic_event_loop_lag_last_seconds", "最近一次探测的事件循环延迟（各worker取最大值）", aggregate="max")
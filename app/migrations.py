@@ -0,0 +1,201 @@
+from datetime import datetime
+from typing import Callable, List, Tuple
+import asyncio
+import sys
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .models import Base, Car, RentOrder, RentOrderArchive, User
+
+# 数据库迁移：schema_version 表记录已执行的迁移，启动时只执行尚未执行的迁移，不删除任何数据。
+# 每个迁移都可以重复执行（建表、建索引、加列前先检查是否已存在），
+# 没有 schema_version 表的旧库执行迁移时只会补齐缺少的部分。
+# 修改模型后在 MIGRATIONS 末尾追加一个新版本，不要修改已发布的迁移
+
+schema_version = Table(
+    "schema_version", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+# PostgreSQL上多个worker同时启动时用咨询锁串行执行迁移
+PG_MIGRATION_LOCK = 7240319
+
+def create_tables(conn: Connection, *tables) -> None:
+    Base.metadata.create_all(conn, tables=[table.__table__ for table in tables], checkfirst=True)
+
+def create_indexes(conn: Connection, table, *names: str) -> None:
+    for index in table.__table__.indexes:
+        if not names or index.name in names:
+            index.create(conn, checkfirst=True)
+
+def add_columns(conn: Connection, table, *names: str) -> None:
+    """给已有的表加列，列类型取自模型；新加的列只能允许为空"""
+    table = table.__table__
+    existing = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    preparer = conn.dialect.identifier_preparer
+    for name in names:
+        if name in existing:
+            continue
+        column = table.c[name]
+        conn.execute(text(
+            f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN "
+            f"{preparer.format_column(column)} {column.type.compile(conn.dialect)}"
+        ))
+
+def _initial(conn: Connection) -> None:
+    create_tables(conn, Car, User, RentOrder)
+
+def _order_indexes(conn: Connection) -> None:
+    create_indexes(conn, RentOrder, "ix_rent_order_user_id_id", "ix_rent_order_car_id_id", "ix_rent_order_start_at")
+
+def _car_holds(conn: Connection) -> None:
+    add_columns(conn, Car, "held_by", "held_until")
+
+def _car_location(conn: Connection) -> None:
+    add_columns(conn, Car, "lat", "lng")
+
+def _order_archive(conn: Connection) -> None:
+    create_tables(conn, RentOrderArchive)
+    create_indexes(conn, RentOrderArchive)
+
+def _close_duplicate_open_orders(conn: Connection) -> None:
+    """每个用户、每辆车只保留最新的未结束订单，其余按零时长、零费用结束，
+    不再有未结束订单的车辆恢复为可租"""
+    closed = []
+    for column in (RentOrder.user_id, RentOrder.car_id):
+        open_orders = (RentOrder.end_at.is_(None), column.is_not(None))
+        newest = select(func.max(RentOrder.id)).where(*open_orders).group_by(column)
+        ids = conn.execute(
+            select(RentOrder.id).where(*open_orders, RentOrder.id.not_in(newest))
+        ).scalars().all()
+        if ids:
+            conn.execute(update(RentOrder).where(RentOrder.id.in_(ids)).values(end_at=RentOrder.start_at, fee=0))
+            closed.extend(ids)
+    if not closed:
+        return
+    cars = conn.execute(select(RentOrder.car_id).where(RentOrder.id.in_(closed)).distinct()).scalars().all()
+    still_open = select(RentOrder.car_id).where(RentOrder.end_at.is_(None), RentOrder.car_id.is_not(None))
+    conn.execute(
+        update(Car).where(Car.id.in_(cars), Car.status == 1, Car.id.not_in(still_open)).values(status=0)
+    )
+    print(f"已关闭 {len(closed)} 个重复的未结束订单: {sorted(closed)[:20]}")
+
+def _open_order_indexes(conn: Connection) -> None:
+    # 已有数据违反唯一约束时建索引会失败，先关闭重复的订单
+    _close_duplicate_open_orders(conn)
+    create_indexes(conn, RentOrder, "ux_rent_order_open_user", "ux_rent_order_open_car")
+
+def _user_token_version(conn: Connection) -> None:
+    add_columns(conn, User, "token_version")
+
+def _car_telemetry_at(conn: Connection) -> None:
+    add_columns(conn, Car, "telemetry_at")
+
+def _order_autoincrement(conn: Connection) -> None:
+    # SQLite的rowid表按当前最大id分配新id，归档走最新订单后会重用其id；
+    # 重建为AUTOINCREMENT表，序列从两张表的最大id继续。PostgreSQL的序列本身不重用
+    if conn.dialect.name != "sqlite":
+        return
+    table = RentOrder.__table__
+    ddl = conn.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table.name}
+    ).scalar()
+    if "AUTOINCREMENT" not in ddl.upper():
+        quote = conn.dialect.identifier_preparer.quote
+        old = f"{table.name}_old"
+        columns = ", ".join(quote(column.name) for column in table.columns)
+        conn.execute(text(f"ALTER TABLE {quote(table.name)} RENAME TO {quote(old)}"))
+        # 索引随表改名，先删除再随新表创建
+        for index in inspect(conn).get_indexes(old):
+            conn.execute(text(f"DROP INDEX {quote(index['name'])}"))
+        table.create(conn)
+        conn.execute(text(f"INSERT INTO {quote(table.name)} ({columns}) SELECT {columns} FROM {quote(old)}"))
+        conn.execute(text(f"DROP TABLE {quote(old)}"))
+    last_id = max(
+        conn.execute(select(func.max(RentOrder.id))).scalar() or 0,
+        conn.execute(select(func.max(RentOrderArchive.id))).scalar() or 0,
+    )
+    # 已经重用了归档订单id的订单改用新id，否则无法再归档
+    reused = conn.execute(
+        select(RentOrder.id).where(RentOrder.id.in_(select(RentOrderArchive.id))).order_by(RentOrder.id)
+    ).scalars().all()
+    for order_id in reused:
+        last_id += 1
+        conn.execute(update(RentOrder).where(RentOrder.id == order_id).values(id=last_id))
+    if reused:
+        print(f"已为 {len(reused)} 个与归档订单id重复的订单分配新id: {reused[:20]}")
+    conn.execute(text("DELETE FROM sqlite_sequence WHERE name = :name"), {"name": table.name})
+    conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)"),
+                 {"name": table.name, "seq": last_id})
+
+# 版本号, 说明, 迁移函数
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "创建车辆、用户、订单表", _initial),
+    (2, "订单分页和统计索引", _order_indexes),
+    (3, "车辆候补预留", _car_holds),
+    (4, "车辆位置", _car_location),
+    (5, "历史订单归档表", _order_archive),
+    (6, "未结束订单的唯一索引", _open_order_indexes),
+    (7, "用户令牌版本", _user_token_version),
+    (8, "车辆遥测采集时间", _car_telemetry_at),
+    (9, "订单id不重用", _order_autoincrement),
+]
+
+def _applied(conn: Connection) -> set:
+    schema_version.create(conn, checkfirst=True)
+    return set(conn.execute(select(schema_version.c.version)).scalars())
+
+def _migrate(conn: Connection) -> List[int]:
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PG_MIGRATION_LOCK})
+    applied = _applied(conn)
+    done = []
+    for version, description, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        migration(conn)
+        conn.execute(schema_version.insert().values(
+            version=version, description=description, applied_at=datetime.now()))
+        done.append(version)
+    return done
+
+async def migrate(engine: AsyncEngine) -> List[int]:
+    """执行尚未执行的迁移，返回本次执行的版本号；已是最新时只查询一次版本表"""
+    try:
+        async with engine.begin() as conn:
+            return await conn.run_sync(_migrate)
+    except (IntegrityError, OperationalError):
+        # SQLite上多个worker同时迁移时，后完成的一方会在建表或写版本号时冲突，
+        # 重新执行一次即可看到对方已完成的迁移
+        await asyncio.sleep(0.5)
+        async with engine.begin() as conn:
+            return await conn.run_sync(_migrate)
+
+async def pending(engine: AsyncEngine) -> List[Tuple[int, str]]:
+    async with engine.begin() as conn:
+        applied = await conn.run_sync(_applied)
+    return [(version, description) for version, description, _ in MIGRATIONS if version not in applied]
+
+async def _main(show_status: bool) -> None:
+    from .db import create_engine
+
+    engine = create_engine()
+    try:
+        if show_status:
+            for version, description in await pending(engine):
+                print(f"待执行 {version}: {description}")
+            return
+        done = await migrate(engine)
+        print(f"已执行迁移: {done}" if done else "数据库已是最新版本")
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    # python -m app.migrations          执行待执行的迁移
+    # python -m app.migrations status   只列出待执行的迁移
+    asyncio.run(_main(sys.argv[1:2] == ["status"]))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.ext.declarative import declarative_base
@@ -16,6 +16,14 @@ class Car(Base):
     battery = Column(Integer, default=100)  # 电量%
     qrcode = Column(String)  # /rent/{id} 完整URL
     updated_at = Column(DateTime, default=func.current_timestamp(), onupdate=func.current_timestamp())
+    # 候补预留：车辆空闲时留给候补队列中的用户，到期前其他人不能租
+    held_by = Column(Integer)  # 预留给的用户id
+    held_until = Column(DateTime)  # 预留到期时间
+    # 车辆位置（WGS84），由遥测上报更新
+    lat = Column(Float)
+    lng = Column(Float)
+    # 最近一次写入的遥测的采集时间（UTC），更早的上报不再覆盖
+    telemetry_at = Column(DateTime)
     
     # 建立与订单的关系
     orders = relationship("RentOrder", back_populates="car")
@@ -30,6 +38,8 @@ class User(Base):
     password = Column(String, nullable=False)
     role = Column(Integer, default=0)  # 0游客 1运维 2管理员
     deposit = Column(Float, default=0)
+    # 角色或押金变更时加一，签发时间早于变更的令牌中的声明随之失效
+    token_version = Column(Integer, default=0)
     
     # 建立与订单的关系
     orders = relationship("RentOrder", back_populates="user")
@@ -46,4 +56,35 @@ class RentOrder(Base):
     
     # 建立与用户和车辆的关系
     user = relationship("User", back_populates="orders")
-    car = relationship("Car", back_populates="orders")
\ No newline at end of file
+    car = relationship("Car", back_populates="orders")
+    
+    # 订单列表按id倒序分页，按用户/车辆筛选时使用组合索引
+    __table_args__ = (
+        Index("ix_rent_order_user_id_id", "user_id", "id"),
+        Index("ix_rent_order_car_id_id", "car_id", "id"),
+        Index("ix_rent_order_start_at", "start_at"),
+        # 未结束订单的部分唯一索引：每个用户、每辆车最多一个未结束的订单
+        Index("ux_rent_order_open_user", "user_id", unique=True,
+              sqlite_where=end_at.is_(None), postgresql_where=end_at.is_(None)),
+        Index("ux_rent_order_open_car", "car_id", unique=True,
+              sqlite_where=end_at.is_(None), postgresql_where=end_at.is_(None)),
+        # 订单归档后近期表可能为空或不含最大id，SQLite需要AUTOINCREMENT才不会重用已归档订单的id
+        {"sqlite_autoincrement": True},
+    )
+
+class RentOrderArchive(Base):
+    """已归档的历史订单，列与 rent_order 相同，由 app.archive 从 rent_order 移入"""
+    __tablename__ = "rent_order_archive"
+    
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, ForeignKey("user.id"))
+    car_id = Column(Integer, ForeignKey("car.id"))
+    start_at = Column(DateTime)
+    end_at = Column(DateTime)
+    fee = Column(Float)
+    
+    __table_args__ = (
+        Index("ix_rent_order_archive_user_id_id", "user_id", "id"),
+        Index("ix_rent_order_archive_car_id_id", "car_id", "id"),
+        Index("ix_rent_order_archive_start_at", "start_at"),
+    )
@@ -0,0 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import bcrypt
+
+from .config import env_int
+
+# 密码哈希：bcrypt计算耗时数百毫秒，放到独立的线程池中执行，避免阻塞事件循环
+
+# bcrypt计算成本，修改后旧密码会在用户下次登录时自动重新哈希
+BCRYPT_ROUNDS = env_int("SCENIC_BCRYPT_ROUNDS", 12)
+# 密码哈希线程数
+PASSWORD_WORKERS = env_int("SCENIC_PASSWORD_WORKERS", 2)
+# 允许排队等待的请求数，超过后直接拒绝
+PASSWORD_QUEUE_LIMIT = env_int("SCENIC_PASSWORD_QUEUE_LIMIT", 64)
+
+class PasswordHasherBusy(Exception):
+    """密码哈希线程池已满"""
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix="bcrypt")
+# 正在执行和排队的任务数
+_inflight = 0
+
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    salt = bcrypt.gensalt(rounds=rounds)
+    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
+    return hashed.decode('utf-8')
+
+def verify_password(password: str, hashed_password: str) -> bool:
+    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+def needs_rehash(hashed_password: str) -> bool:
+    """哈希的计算成本与当前配置不一致时需要重新哈希"""
+    try:
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+async def _run(func, *args):
+    global _inflight
+    # 超过线程池和排队上限时立即拒绝，而不是让请求无限堆积
+    if _inflight >= PASSWORD_WORKERS + PASSWORD_QUEUE_LIMIT:
+        raise PasswordHasherBusy()
+    _inflight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+    finally:
+        _inflight -= 1
+
+async def hash_password_async(password: str) -> str:
+    return await _run(hash_password, password)
+
+async def verify_password_async(password: str, hashed_password: str) -> bool:
+    return await _run(verify_password, password, hashed_password)
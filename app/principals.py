@@ -0,0 +1,69 @@
+from collections import OrderedDict
+from typing import Optional
+import time
+
+from .bus import bus
+from .config import env_int
+
+# 已认证用户缓存：按令牌主体(手机号)缓存用户信息，避免每个请求都查询数据库。
+# 角色/押金变更时数据库中用户的 token_version 加一，令牌中带签发时的版本，
+# 缓存的版本与令牌一致时才直接使用令牌中的声明；worker重启或缓存过期后先查一次数据库
+
+# 最多缓存的用户数
+PRINCIPAL_CACHE_SIZE = env_int("SCENIC_PRINCIPAL_CACHE_SIZE", 10000)
+# 缓存有效期（秒）
+PRINCIPAL_CACHE_TTL = env_int("SCENIC_PRINCIPAL_CACHE_TTL", 60)
+# 令牌版本的缓存有效期（秒），限制漏收变更事件时旧声明继续生效的时间
+PRINCIPAL_VERSION_TTL = env_int("SCENIC_PRINCIPAL_VERSION_TTL", 300)
+
+class PrincipalCache:
+    def __init__(self, maxsize: int, ttl: float, version_ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # subject -> (过期时间, 用户)，按最近使用排序
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # subject -> (过期时间, 令牌版本)，版本来自数据库或变更事件；令牌声明只在版本一致时可信
+        self._versions: "OrderedDict[str, tuple]" = OrderedDict()
+        self.version_ttl = version_ttl
+
+    def get(self, subject: str):
+        return self._lookup(self._entries, subject)
+
+    def put(self, subject: str, principal) -> None:
+        self._store(self._entries, subject, self.ttl, principal)
+
+    def version(self, subject: str) -> Optional[int]:
+        """已知的令牌版本，未知时返回None，调用方应查询数据库"""
+        return self._lookup(self._versions, subject)
+
+    def put_version(self, subject: str, version: Optional[int]) -> None:
+        self._store(self._versions, subject, self.version_ttl, version or 0)
+
+    def _lookup(self, entries: OrderedDict, subject: str):
+        entry = entries.get(subject)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del entries[subject]
+            return None
+        entries.move_to_end(subject)
+        return value
+
+    def _store(self, entries: OrderedDict, subject: str, ttl: float, value) -> None:
+        entries[subject] = (time.monotonic() + ttl, value)
+        entries.move_to_end(subject)
+        while len(entries) > self.maxsize:
+            entries.popitem(last=False)
+
+    def invalidate(self, subject: str, version: Optional[int]) -> None:
+        """用户角色或押金变更后调用，通过事件总线通知所有worker"""
+        bus.publish({"type": "user", "subject": subject, "version": version or 0})
+
+    def apply(self, event: dict) -> None:
+        self._entries.pop(event["subject"], None)
+        self.put_version(event["subject"], event["version"])
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._versions.clear()
@@ -0,0 +1,268 @@
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+import time
+
+from starlette.routing import compile_path
+
+from .config import env_bool, env_int, env_str
+from .metrics import rate_limited
+
+# 限流和准入控制：租车、登录、WebSocket连接按令牌桶限速，超出时返回429和Retry-After；
+# 租车另外限制每个worker同时处理的请求数。令牌桶按 规则+用户/IP/路由 分桶，
+# 多worker部署时令牌桶放在各worker共同映射的文件中（SCENIC_RATE_LIMIT_STORE=shared）
+
+# 是否启用限流（压测时关闭）
+RATE_LIMIT = env_bool("SCENIC_RATE_LIMIT", True)
+# 令牌桶存储：memory 每个worker独立，shared 同一台机器上的worker共用
+RATE_LIMIT_STORE = env_str("SCENIC_RATE_LIMIT_STORE", "memory")
+RATE_LIMIT_FILE = env_str("SCENIC_RATE_LIMIT_FILE", "/tmp/scenic-ratelimit")
+# 共享存储的槽位数，每个槽位24字节
+RATE_LIMIT_SLOTS = env_int("SCENIC_RATE_LIMIT_SLOTS", 65536)
+# 每个worker同时处理的租车请求数
+RENT_CONCURRENCY = env_int("SCENIC_RENT_CONCURRENCY", 32)
+
+@dataclass(frozen=True)
+class RateRule:
+    name: str
+    # HTTP方法，WebSocket连接为 WEBSOCKET
+    method: str
+    # 路由模板，与路由声明相同
+    path: str
+    # 每秒补充的令牌数和桶容量
+    rate: float
+    burst: int
+    # user：已登录时按用户，否则按IP；ip：按IP；route：该路由所有请求共用一个桶
+    key: str = "user"
+    # 每个worker同时处理的请求数上限
+    concurrency: Optional[int] = None
+
+# 同一请求匹配多条规则时先检查范围小的桶，单个用户/IP超限时不消耗全局的桶
+_KEY_ORDER = {"user": 0, "ip": 1, "route": 2}
+
+RULES = (
+    # 扫码后反复重试租车
+    RateRule("rent", "POST", "/rent/{car_id}", rate=0.5, burst=5, key="user", concurrency=RENT_CONCURRENCY),
+    # 撞库：每个IP每分钟10次；bcrypt的并发由 passwords 的线程池队列限制
+    RateRule("login", "POST", "/users/token", rate=10 / 60, burst=10, key="ip"),
+    # 断线重连：单个IP的重连频率，以及所有客户端合计的建连速度
+    RateRule("ws_ip", "WEBSOCKET", "/ws/status", rate=1, burst=20, key="ip"),
+    RateRule("ws_total", "WEBSOCKET", "/ws/status", rate=200, burst=400, key="route"),
+)
+
+class MemoryBucketStore:
+    """单个worker内的令牌桶"""
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        # key -> [令牌数, 更新时间, 每秒补充数, 容量]
+        self._buckets: Dict[str, list] = {}
+
+    def take(self, key: str, rate: float, burst: int, now: Optional[float] = None) -> float:
+        """取一个令牌，成功返回0，否则返回需要等待的秒数"""
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._prune(now)
+            bucket = self._buckets[key] = [float(burst), now, rate, burst]
+        tokens, wait = _refill(bucket[0], bucket[1], now, rate, burst)
+        bucket[0], bucket[1] = tokens, now
+        return wait
+
+    def refund(self, key: str, burst: int) -> None:
+        """退还取出的令牌（后续规则拒绝了请求）"""
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket[0] = min(float(burst), bucket[0] + 1)
+
+    def _prune(self, now: float) -> None:
+        # 已回满的桶与新桶等价，可以删除；仍然太多时清空
+        for key, (tokens, updated, rate, burst) in list(self._buckets.items()):
+            if tokens + (now - updated) * rate >= burst:
+                del self._buckets[key]
+        if len(self._buckets) >= self.max_keys:
+            self._buckets.clear()
+
+# 共享存储的槽位：key哈希、令牌数、更新时间
+_SLOT = struct.Struct("<Qdd")
+# 哈希冲突时向后查找的槽位数
+_PROBES = 8
+
+class SharedBucketStore:
+    """同一台机器上的worker共用的令牌桶：各worker映射同一个文件作为开放寻址哈希表，
+    读改写期间持有文件锁。更新时间使用系统范围的单调时钟"""
+    def __init__(self, path: str, slots: int = RATE_LIMIT_SLOTS):
+        import fcntl
+
+        self._fcntl = fcntl
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            size = os.fstat(self._fd).st_size
+            if size < slots * _SLOT.size:
+                size = slots * _SLOT.size
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self.slots = size // _SLOT.size
+        self._map = mmap.mmap(self._fd, self.slots * _SLOT.size)
+
+    def take(self, key: str, rate: float, burst: int, now: Optional[float] = None) -> float:
+        now = time.monotonic() if now is None else now
+        digest = _digest(key)
+        self._fcntl.flock(self._fd, self._fcntl.LOCK_EX)
+        try:
+            index, tokens, updated = self._find(digest, digest % self.slots, now, burst)
+            tokens, wait = _refill(tokens, updated, now, rate, burst)
+            _SLOT.pack_into(self._map, index * _SLOT.size, digest, tokens, now)
+        finally:
+            self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+        return wait
+
+    def refund(self, key: str, burst: int) -> None:
+        digest = _digest(key)
+        self._fcntl.flock(self._fd, self._fcntl.LOCK_EX)
+        try:
+            for probe in range(_PROBES):
+                offset = (digest % self.slots + probe) % self.slots * _SLOT.size
+                stored, tokens, updated = _SLOT.unpack_from(self._map, offset)
+                if stored == digest:
+                    _SLOT.pack_into(self._map, offset, digest, min(float(burst), tokens + 1), updated)
+                    return
+                if stored == 0:
+                    return
+        finally:
+            self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+
+    def _find(self, digest: int, start: int, now: float, burst: int) -> Tuple[int, float, float]:
+        """key所在的槽位；没有时取空槽位，都被占用时复用最久未更新的槽位"""
+        oldest, oldest_at = start, math.inf
+        for probe in range(_PROBES):
+            index = (start + probe) % self.slots
+            stored, tokens, updated = _SLOT.unpack_from(self._map, index * _SLOT.size)
+            if stored == digest:
+                return index, tokens, updated
+            if stored == 0:
+                return index, float(burst), now
+            if updated < oldest_at:
+                oldest, oldest_at = index, updated
+        return oldest, float(burst), now
+
+    def close(self) -> None:
+        self._map.close()
+        os.close(self._fd)
+
+def _digest(key: str) -> int:
+    # 0 表示空槽位
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+def _refill(tokens: float, updated: float, now: float, rate: float, burst: int) -> Tuple[float, float]:
+    """补充令牌后取一个，返回 (剩余令牌数, 需要等待的秒数)"""
+    tokens = min(float(burst), tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+def create_store(kind: Optional[str] = RATE_LIMIT_STORE):
+    if kind == "shared":
+        return SharedBucketStore(RATE_LIMIT_FILE)
+    if kind in (None, "memory"):
+        return MemoryBucketStore()
+    raise ValueError(f"不支持的限流存储: {kind}")
+
+def _client_ip(scope) -> str:
+    # 经Nginx转发时uvicorn已按X-Forwarded-For替换客户端地址
+    client = scope.get("client")
+    return client[0] if client else "-"
+
+def _bearer_token(scope) -> Optional[str]:
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            return token.strip() if scheme.lower() == "bearer" and token else None
+    return None
+
+class RateLimitMiddleware:
+    """按 RULES 限流的ASGI中间件；identify 由令牌得到用户标识，令牌无效时返回None"""
+    def __init__(self, app, identify: Optional[Callable[[str], Optional[str]]] = None,
+                 rules=RULES, store=None, enabled: bool = RATE_LIMIT):
+        self.app = app
+        self.identify = identify
+        self.enabled = enabled
+        self.store = store if store is not None or not enabled else create_store()
+        # 方法 -> [(路由正则, 规则)]
+        self._rules: Dict[str, List[Tuple[object, RateRule]]] = {}
+        for rule in sorted(rules, key=lambda rule: _KEY_ORDER[rule.key]):
+            self._rules.setdefault(rule.method, []).append((compile_path(rule.path)[0], rule))
+        # 规则名 -> 本worker正在处理的请求数
+        self._inflight: Dict[str, int] = {}
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        method = "WEBSOCKET" if scope["type"] == "websocket" else scope["method"]
+        rules = [rule for pattern, rule in self._rules.get(method, ()) if pattern.match(scope["path"])]
+        if not rules:
+            await self.app(scope, receive, send)
+            return
+        taken = []
+        for rule in rules:
+            key = f"{rule.name}:{self._key(rule, scope)}"
+            wait = self.store.take(key, rule.rate, rule.burst)
+            if wait > 0:
+                self._refund(taken)
+                rate_limited.inc(rule.name, "rate")
+                await _reject(scope, send, wait)
+                return
+            taken.append((rule, key))
+        limited = [rule for rule in rules if rule.concurrency]
+        for rule in limited:
+            if self._inflight.get(rule.name, 0) >= rule.concurrency:
+                self._refund(taken)
+                rate_limited.inc(rule.name, "concurrency")
+                await _reject(scope, send, 1)
+                return
+        for rule in limited:
+            self._inflight[rule.name] = self._inflight.get(rule.name, 0) + 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            for rule in limited:
+                self._inflight[rule.name] -= 1
+
+    def _refund(self, taken) -> None:
+        # 被拒绝的请求不占用已通过的规则的额度
+        for rule, key in taken:
+            self.store.refund(key, rule.burst)
+
+    def _key(self, rule: RateRule, scope) -> str:
+        if rule.key == "route":
+            return "*"
+        if rule.key == "user" and self.identify is not None:
+            token = _bearer_token(scope)
+            subject = self.identify(token) if token else None
+            if subject is not None:
+                return f"user:{subject}"
+        return f"ip:{_client_ip(scope)}"
+
+async def _reject(scope, send, wait: float) -> None:
+    retry_after = str(max(1, math.ceil(wait))).encode()
+    body = json.dumps({"detail": "请求过于频繁，请稍后重试"}, ensure_ascii=False).encode("utf-8")
+    headers = [(b"content-type", b"application/json"), (b"retry-after", retry_after),
+               (b"content-length", str(len(body)).encode())]
+    if scope["type"] == "http":
+        await send({"type": "http.response.start", "status": 429, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+    elif "websocket.http.response" in scope.get("extensions", {}):
+        # 服务器支持时在握手阶段直接返回429
+        await send({"type": "websocket.http.response.start", "status": 429, "headers": headers})
+        await send({"type": "websocket.http.response.body", "body": body})
+    else:
+        # 1013: Try Again Later
+        await send({"type": "websocket.close", "code": 1013})
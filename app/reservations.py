@@ -0,0 +1,338 @@
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import asyncio
+import heapq
+import math
+import time
+
+from . import crud
+from .bus import bus
+from .config import env_int
+from .db import async_session
+from .fleet import area_of, fleet_store
+
+# 候补预约：没有空闲车辆时用户加入景区的候补队列；车辆空闲时（还车、维修结束）预留给队首用户，
+# 并通过 /ws/status 通知该用户，预留到期由时间轮回收并轮到下一位。
+# 所有worker通过事件总线维护相同的队列和预留，只有领导者写数据库和分配车辆
+
+# 预留时长（秒）
+HOLD_SECONDS = env_int("SCENIC_HOLD_SECONDS", 180)
+# 时间轮每格的秒数和格数
+WHEEL_TICK = 1.0
+WHEEL_SLOTS = 64
+# 领导者定期检查所有有人候补的景区，兜底领导者切换或漏掉的车辆事件（秒）
+SWEEP_INTERVAL = 30
+
+class TimerWheel:
+    """单层时间轮：每格tick秒，到期时间超过一圈的定时器在格子里等到对应的圈数"""
+    def __init__(self, slots: int = WHEEL_SLOTS, tick: float = WHEEL_TICK):
+        self.tick = tick
+        self._slots: List[Dict[object, int]] = [{} for _ in range(slots)]
+        # key -> 所在格子
+        self._where: Dict[object, int] = {}
+        # 已处理到的格子序号，None表示下次推进时检查所有格子
+        self._last: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def schedule(self, key, deadline: float) -> None:
+        self.cancel(key)
+        due = math.ceil(deadline / self.tick)
+        if self._last is not None and due <= self._last:
+            due = self._last + 1
+        slot = due % len(self._slots)
+        self._slots[slot][key] = due
+        self._where[key] = slot
+
+    def cancel(self, key) -> None:
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            self._slots[slot].pop(key, None)
+
+    def advance(self, now: float) -> List:
+        """推进到now，返回到期的key"""
+        current = math.floor(now / self.tick)
+        count = len(self._slots)
+        first = current - count + 1 if self._last is None else max(self._last + 1, current - count + 1)
+        expired = []
+        for tick in range(first, current + 1):
+            slot = self._slots[tick % count]
+            for key, due in list(slot.items()):
+                if due <= current:
+                    del slot[key]
+                    del self._where[key]
+                    expired.append(key)
+        self._last = current
+        return expired
+
+    def rewind(self) -> None:
+        """下次推进时重新检查所有格子"""
+        self._last = None
+
+class Waitlist:
+    """各景区的候补队列：最小堆按加入时间排序，离开队列时只做标记，出堆时跳过"""
+    def __init__(self):
+        self._heaps: Dict[str, list] = {}
+        # user_id -> [加入时间, user_id, 景区, 是否仍在队列中]
+        self._entries: Dict[int, list] = {}
+
+    def join(self, user_id: int, area: str, joined_at: float) -> bool:
+        if user_id in self._entries:
+            return False
+        entry = [joined_at, user_id, area, True]
+        self._entries[user_id] = entry
+        heapq.heappush(self._heaps.setdefault(area, []), entry)
+        return True
+
+    def leave(self, user_id: int) -> Optional[str]:
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return None
+        entry[3] = False
+        return entry[2]
+
+    def peek(self, area: str) -> Optional[int]:
+        """队首用户"""
+        heap = self._heaps.get(area)
+        while heap and not heap[0][3]:
+            heapq.heappop(heap)
+        if not heap:
+            self._heaps.pop(area, None)
+            return None
+        return heap[0][1]
+
+    def area_of(self, user_id: int) -> Optional[str]:
+        entry = self._entries.get(user_id)
+        return entry[2] if entry else None
+
+    def position(self, user_id: int) -> int:
+        """前面还有几人"""
+        entry = self._entries[user_id]
+        return sum(1 for other in self._heaps.get(entry[2], ()) if other[3] and other < entry)
+
+    def areas(self) -> List[str]:
+        return [area for area in list(self._heaps) if self.peek(area) is not None]
+
+class ReservationService:
+    def __init__(self, hold_seconds: int = HOLD_SECONDS, session_factory=async_session):
+        self.hold_seconds = hold_seconds
+        self.session_factory = session_factory
+        self.waitlist = Waitlist()
+        # car_id -> (user_id, 到期时间戳)
+        self.holds: Dict[int, Tuple[int, float]] = {}
+        # user_id -> car_id
+        self._user_holds: Dict[int, int] = {}
+        self.wheel = TimerWheel()
+        # 通知用户的回调 (user_id, 消息)，由WebSocket连接管理器设置
+        self.notify: Optional[Callable[[int, dict], None]] = None
+        # 领导者待处理的空闲车辆和待检查的景区
+        self._pending_cars: Set[int] = set()
+        self._pending_areas: Set[str] = set()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    # 以下由各接口调用，通过事件总线同步到所有worker
+
+    def join(self, user_id: int, area: str) -> None:
+        bus.publish({"type": "reservation", "action": "join", "user_id": user_id, "area": area, "at": time.time()})
+
+    def leave(self, user_id: int) -> None:
+        bus.publish({"type": "reservation", "action": "leave", "user_id": user_id})
+
+    async def cancel_hold(self, user_id: int) -> bool:
+        """用户放弃预留的车辆，车辆留给下一位候补用户"""
+        car_id = self._user_holds.get(user_id)
+        if car_id is None:
+            return False
+        async with self.session_factory() as session:
+            await crud.release_hold(session, car_id, user_id)
+        self._publish_release(car_id, user_id, "cancelled")
+        return True
+
+    def status(self, user_id: int) -> dict:
+        car_id = self._user_holds.get(user_id)
+        if car_id is not None:
+            car = fleet_store.get(car_id)
+            return {
+                "status": "held",
+                "car_id": car_id,
+                "area": area_of(car["name"]) if car else None,
+                "held_until": datetime.fromtimestamp(self.holds[car_id][1]),
+            }
+        area = self.waitlist.area_of(user_id)
+        if area is not None:
+            return {"status": "waiting", "area": area, "position": self.waitlist.position(user_id)}
+        return {"status": "none"}
+
+    # 事件总线
+
+    def apply(self, event: dict) -> None:
+        action, user_id = event["action"], event["user_id"]
+        if action == "join":
+            if self.waitlist.join(user_id, event["area"], event["at"]):
+                self._schedule_area(event["area"])
+        elif action == "leave":
+            self.waitlist.leave(user_id)
+        elif action == "hold":
+            self.waitlist.leave(user_id)
+            self._add_hold(event["car_id"], user_id, event["until"])
+            self._notify(user_id, {
+                "status": "held",
+                "car_id": event["car_id"],
+                "area": event["area"],
+                "held_until": datetime.fromtimestamp(event["until"]).isoformat(timespec="seconds"),
+            })
+        elif action == "release":
+            car_id = event["car_id"]
+            if self.holds.get(car_id, (None,))[0] == user_id:
+                self._drop_hold(car_id)
+            self._notify(user_id, {"status": event["reason"], "car_id": car_id})
+            # 车辆空出，留给下一位候补用户
+            self._schedule_car(car_id)
+
+    def apply_car(self, event: dict) -> None:
+        """车辆变为空闲时分配给候补用户；预留中的车辆被租走或进入维修时取消预留"""
+        status = event.get("status")
+        if status is None:
+            return
+        car_id = event["car_id"]
+        if status == 0:
+            self._schedule_car(car_id)
+            return
+        hold = self.holds.get(car_id)
+        if hold is not None:
+            self._drop_hold(car_id)
+            if status != 1:
+                self._notify(hold[0], {"status": "unavailable", "car_id": car_id})
+
+    def _add_hold(self, car_id: int, user_id: int, until: float) -> None:
+        self.holds[car_id] = (user_id, until)
+        self._user_holds[user_id] = car_id
+        self.wheel.schedule(car_id, until)
+
+    def _drop_hold(self, car_id: int) -> None:
+        user_id, _ = self.holds.pop(car_id)
+        self._user_holds.pop(user_id, None)
+        self.wheel.cancel(car_id)
+
+    def _notify(self, user_id: int, message: dict) -> None:
+        if self.notify is not None:
+            self.notify(user_id, {"type": "reservation", **message})
+
+    def _publish_release(self, car_id: int, user_id: int, reason: str) -> None:
+        bus.publish({"type": "reservation", "action": "release", "user_id": user_id,
+                     "car_id": car_id, "reason": reason})
+
+    def _schedule_car(self, car_id: int) -> None:
+        if bus.is_leader:
+            self._pending_cars.add(car_id)
+            self._wake.set()
+
+    def _schedule_area(self, area: str) -> None:
+        if bus.is_leader:
+            self._pending_areas.add(area)
+            self._wake.set()
+
+    # 领导者分配和回收
+
+    async def _assign(self, car_id: int) -> bool:
+        """把空闲车辆预留给所在景区的队首用户"""
+        car = fleet_store.get(car_id)
+        if car is None or car["status"] != 0 or car_id in self.holds:
+            return False
+        area = area_of(car["name"])
+        user_id = self.waitlist.peek(area)
+        if user_id is None:
+            return False
+        until = time.time() + self.hold_seconds
+        async with self.session_factory() as session:
+            held = await crud.hold_car(session, car_id, user_id, datetime.fromtimestamp(until))
+        if held:
+            bus.publish({"type": "reservation", "action": "hold", "user_id": user_id,
+                         "car_id": car_id, "area": area, "until": until})
+        return held
+
+    async def _dispatch(self) -> None:
+        cars, self._pending_cars = self._pending_cars, set()
+        areas, self._pending_areas = self._pending_areas, set()
+        for car_id in sorted(cars):
+            await self._assign(car_id)
+        if not areas:
+            return
+        # 有新的候补用户时查找景区内已经空闲的车辆
+        for car in fleet_store.rows():
+            area = area_of(car["name"])
+            if area in areas and car["status"] == 0 and car["id"] not in self.holds:
+                if self.waitlist.peek(area) is None:
+                    areas.discard(area)
+                    if not areas:
+                        return
+                    continue
+                await self._assign(car["id"])
+
+    async def _expire(self) -> None:
+        now = time.time()
+        for car_id in self.wheel.advance(now):
+            hold = self.holds.get(car_id)
+            if hold is None:
+                continue
+            user_id, until = hold
+            if until > now:
+                self.wheel.schedule(car_id, until)
+                continue
+            # 写库失败时下一格重试，成功后发布的release事件会取消该定时器
+            self.wheel.schedule(car_id, now + WHEEL_TICK)
+            async with self.session_factory() as session:
+                await crud.release_hold(session, car_id, user_id)
+            self._publish_release(car_id, user_id, "expired")
+
+    async def load(self) -> None:
+        """从数据库加载尚未到期的预留（候补队列只保存在内存中，重启后需要重新加入）"""
+        async with self.session_factory() as session:
+            holds = await crud.get_holds(session)
+        for car_id, user_id, held_until in holds:
+            self._add_hold(car_id, user_id, held_until.timestamp())
+
+    async def run(self) -> None:
+        last_sweep = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), WHEEL_TICK)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                if not bus.is_leader:
+                    # 跟随者只同步状态；成为领导者后检查所有定时器和景区
+                    self.wheel.rewind()
+                    self._pending_cars.clear()
+                    self._pending_areas.clear()
+                    last_sweep = 0.0
+                    continue
+                if time.monotonic() - last_sweep >= SWEEP_INTERVAL:
+                    last_sweep = time.monotonic()
+                    self._pending_areas.update(self.waitlist.areas())
+                await self._expire()
+                await self._dispatch()
+            except Exception as e:
+                print(f"分配候补车辆时出错: {e}")
+                await asyncio.sleep(1)
+
+    async def start(self) -> None:
+        try:
+            await self.load()
+        except Exception as e:
+            print(f"加载车辆预留时出错: {e}")
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+# 创建候补预约实例
+reservation_service = ReservationService()
+bus.subscribe("reservation", reservation_service.apply)
+bus.subscribe("car", reservation_service.apply_car)
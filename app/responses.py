@@ -0,0 +1,42 @@
+from typing import Any, Iterable, Sequence
+import json
+
+from fastapi.responses import JSONResponse
+
+from .config import env_bool
+
+# 快速JSON输出（可选）：SCENIC_FAST_JSON=1 时用orjson序列化响应，
+# 列表接口直接读取列元组并跳过Pydantic校验，数据库中的记录视为可信数据。
+# 未安装orjson时退回标准库json，输出格式相同
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FAST_JSON = env_bool("SCENIC_FAST_JSON", False)
+if FAST_JSON and orjson is None:
+    print("已设置SCENIC_FAST_JSON但未安装orjson，使用标准库json")
+    FAST_JSON = False
+
+def _default(value):
+    # 标准库json不支持datetime，与Pydantic一样输出ISO格式
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"无法序列化的类型: {type(value).__name__}")
+
+_encoder = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=_default)
+
+def dumps(value: Any) -> bytes:
+    """紧凑的UTF-8 JSON"""
+    if FAST_JSON:
+        return orjson.dumps(value)
+    return _encoder.encode(value).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+def rows_response(rows: Iterable[Sequence], columns: Sequence[str], **kwargs) -> FastJSONResponse:
+    """把列元组直接编码为对象数组，不经过response_model校验"""
+    return FastJSONResponse([dict(zip(columns, row)) for row in rows], **kwargs)
@@ -0,0 +1,122 @@
+from datetime import datetime
+from typing import Dict, Optional
+import asyncio
+
+from sqlalchemy import select
+
+from .bus import bus
+from .db import async_session
+from .models import RentOrder
+
+# 进行中的骑行：未结束订单按用户和车辆各建一个内存映射，租车/还车通过事件总线同步到所有worker，
+# "我的当前订单"和"一人一单"检查不查数据库。数据库中 end_at IS NULL 的部分唯一索引兜底并发冲突
+
+# 定期与数据库对账的间隔（秒），兜底事件总线重连期间丢失的事件
+RIDE_RESYNC_INTERVAL = 60
+
+def ride_row(order) -> dict:
+    """订单对象或行 -> 进行中骑行的记录，字段与 schemas.RentOrder 一致"""
+    start_at = order.start_at
+    return {
+        "id": order.id,
+        "user_id": order.user_id,
+        "car_id": order.car_id,
+        "start_at": start_at.isoformat() if isinstance(start_at, datetime) else start_at,
+        "end_at": None,
+        "fee": None,
+    }
+
+class RideRegistry:
+    def __init__(self, session_factory=async_session):
+        self.session_factory = session_factory
+        self.loaded = False
+        # user_id -> 进行中的订单
+        self._by_user: Dict[int, dict] = {}
+        # car_id -> order_id
+        self._by_car: Dict[int, int] = {}
+        # 收到的事件数，对账期间有新事件时放弃本次对账结果
+        self._changes = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._by_user)
+
+    def active(self, user_id: int) -> Optional[dict]:
+        """用户进行中的订单"""
+        return self._by_user.get(user_id)
+
+    def order_of_car(self, car_id: int) -> Optional[int]:
+        """车辆进行中的订单id"""
+        return self._by_car.get(car_id)
+
+    # 由租车/还车调用，通过事件总线同步到所有worker
+
+    def publish_start(self, order) -> None:
+        bus.publish({"type": "ride", "action": "start", **ride_row(order)})
+
+    def publish_end(self, order) -> None:
+        bus.publish({"type": "ride", "action": "end", "id": order.id,
+                     "user_id": order.user_id, "car_id": order.car_id})
+
+    def apply(self, event: dict) -> None:
+        self._changes += 1
+        if event["action"] == "start":
+            self._add({key: event[key] for key in ("id", "user_id", "car_id", "start_at", "end_at", "fee")})
+        else:
+            self._remove(event["id"], event["user_id"], event["car_id"])
+
+    def _add(self, row: dict) -> None:
+        previous = self._by_user.get(row["user_id"])
+        if previous is not None:
+            self._by_car.pop(previous["car_id"], None)
+        self._by_user[row["user_id"]] = row
+        self._by_car[row["car_id"]] = row["id"]
+
+    def _remove(self, order_id: int, user_id: int, car_id: int) -> None:
+        current = self._by_user.get(user_id)
+        if current is not None and current["id"] == order_id:
+            del self._by_user[user_id]
+        if self._by_car.get(car_id) == order_id:
+            del self._by_car[car_id]
+
+    async def load(self) -> bool:
+        """从数据库重建（走未结束订单的部分索引），读取期间收到事件时放弃，返回是否已重建"""
+        changes = self._changes
+        async with self.session_factory() as session:
+            rows = (await session.execute(
+                select(RentOrder.id, RentOrder.user_id, RentOrder.car_id, RentOrder.start_at)
+                .where(RentOrder.end_at.is_(None))
+            )).all()
+        if changes != self._changes:
+            return False
+        self._by_user.clear()
+        self._by_car.clear()
+        for row in rows:
+            self._add(ride_row(row))
+        self.loaded = True
+        return True
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(RIDE_RESYNC_INTERVAL)
+            try:
+                await self.load()
+            except Exception as e:
+                print(f"加载进行中的订单时出错: {e}")
+
+    async def start(self) -> None:
+        try:
+            await self.load()
+        except Exception as e:
+            print(f"加载进行中的订单时出错: {e}")
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+# 创建进行中骑行的登记实例
+ride_registry = RideRegistry()
+bus.subscribe("ride", ride_registry.apply)
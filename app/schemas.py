@@ -1,6 +1,6 @@
-from pydantic import BaseModel, Field
-from datetime import datetime
-from typing import Optional
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+from datetime import date, datetime
+from typing import Dict, List, Optional
 
 # 车辆模型
 default_car_battery = 100
@@ -12,6 +12,8 @@ class CarBase(BaseModel):
     status: int = Field(default=default_car_status)
     battery: int = Field(default=default_car_battery)
     qrcode: Optional[str] = None
+    lat: Optional[float] = Field(default=None, ge=-90, le=90)
+    lng: Optional[float] = Field(default=None, ge=-180, le=180)
 
 class CarCreate(CarBase):
     pass
@@ -20,8 +22,11 @@ class Car(CarBase):
     id: int
     updated_at: datetime
     
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+# 附近的可租车辆，distance为距离（米）
+class NearbyCar(Car):
+    distance: float
 
 # 用户模型
 default_user_role = 0
@@ -45,8 +50,19 @@ class UserLogin(BaseModel):
 class User(UserBase):
     id: int
     
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+# 由令牌声明构造的当前用户，只包含授权所需的字段
+class Principal(BaseModel):
+    id: int
+    phone: str
+    role: int
+
+class UserRoleUpdate(BaseModel):
+    role: int = Field(ge=0, le=2)
+
+class UserDepositUpdate(BaseModel):
+    deposit: float = Field(ge=0)
 
 # 订单模型
 class RentOrderBase(BaseModel):
@@ -62,8 +78,7 @@ class RentOrder(RentOrderBase):
     end_at: Optional[datetime] = None
     fee: Optional[float] = None
     
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 # 租车响应
 class RentResponse(BaseModel):
@@ -80,4 +95,83 @@ class ReturnResponse(BaseModel):
 class CarStatusUpdate(BaseModel):
     car_id: int
     battery: int
-    status: int
\ No newline at end of file
+    status: int
+# 车辆遥测上报
+class TelemetryReport(BaseModel):
+    car_id: int
+    battery: Optional[int] = Field(default=None, ge=0, le=100)
+    status: Optional[int] = Field(default=None, ge=0, le=2)
+    # 车辆位置，经纬度需同时上报
+    lat: Optional[float] = Field(default=None, ge=-90, le=90)
+    lng: Optional[float] = Field(default=None, ge=-180, le=180)
+    # 车辆采集时间，用于丢弃乱序到达的旧上报
+    reported_at: Optional[datetime] = None
+
+    @model_validator(mode="after")
+    def check_location(self):
+        if (self.lat is None) != (self.lng is None):
+            raise ValueError("lat和lng需同时上报")
+        return self
+
+class TelemetryBatch(BaseModel):
+    reports: List[TelemetryReport]
+
+class TelemetryResult(BaseModel):
+    accepted: int
+    rejected: List[int]
+
+# 电量历史，按列返回便于前端绘图；原始采样没有min/max
+class BatteryHistory(BaseModel):
+    car_id: int
+    resolution: str
+    t: List[int]
+    battery: List[float]
+    min: Optional[List[int]] = None
+    max: Optional[List[int]] = None
+
+# 计费规则
+class TariffBand(BaseModel):
+    # 时段 [start, end)，格式 HH:MM，end 可为 24:00；end 小于 start 表示跨零点
+    start: str = Field(pattern=r"^([01]\d|2[0-3]):[0-5]\d$")
+    end: str = Field(pattern=r"^(([01]\d|2[0-3]):[0-5]\d|24:00)$")
+    multiplier: float = Field(gt=0)
+
+    @model_validator(mode="after")
+    def check_range(self):
+        # start 需早于 end（跨零点的时段除外），两者相同时时段为空
+        if self.start == self.end:
+            raise ValueError("时段的start和end不能相同")
+        return self
+
+class TariffRules(BaseModel):
+    name: str = "default"
+    rate_per_minute: float = Field(default=0.5, ge=0)
+    minimum_fee: float = Field(default=1.0, ge=0)
+    # 开始后的免费分钟数，骑行不超过该时长时不收费
+    free_minutes: int = Field(default=0, ge=0)
+    bands: List[TariffBand] = []
+    # 景区 -> 价格倍数
+    area_multipliers: Dict[str, float] = {}
+    # 单次封顶和用户每日封顶，为None时不封顶
+    ride_cap: Optional[float] = Field(default=None, ge=0)
+    daily_cap: Optional[float] = Field(default=None, ge=0)
+    # 租车所需的最低押金
+    min_deposit: float = Field(default=0, ge=0)
+
+class TariffWhatIf(BaseModel):
+    rules: TariffRules
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+
+# 候补预约
+class WaitlistJoin(BaseModel):
+    area: str = Field(min_length=1)
+
+class Reservation(BaseModel):
+    # none 无 / waiting 候补中 / held 已预留车辆
+    status: str
+    area: Optional[str] = None
+    # 前面还有几人
+    position: Optional[int] = None
+    car_id: Optional[int] = None
+    held_until: Optional[datetime] = None
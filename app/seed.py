@@ -0,0 +1,177 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence
+import argparse
+import asyncio
+import random
+import time
+
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from .fleet import area_of
+from .models import Car, RentOrder, User
+from .passwords import BCRYPT_ROUNDS, hash_password
+from .tariff import tariff_engine
+
+# 批量生成测试数据：车辆、用户和历史订单用Core insert分批executemany写入，
+# 所有用户共用一个预先计算的密码哈希，十万级数据几秒内写完，用于预发布环境和压测。
+# 只追加数据，新数据的id接在现有最大id之后
+
+AREAS = ("西湖", "良渚", "西溪", "灵隐", "宋城")
+# 各景区的中心位置，车辆散布在中心附近约1.5公里内
+AREA_CENTERS = {
+    "西湖": (30.2460, 120.1510),
+    "良渚": (30.3890, 120.0260),
+    "西溪": (30.2710, 120.0650),
+    "灵隐": (30.2410, 120.1010),
+    "宋城": (30.1720, 120.1020),
+}
+AREA_SPREAD = 0.015
+# 每批写入的行数
+SEED_BATCH = 5000
+
+def seed_phone(user_id: int) -> str:
+    """测试用户的手机号，由用户id决定"""
+    return f"139{user_id:08d}"
+
+async def _next_id(conn: AsyncConnection, model) -> int:
+    return ((await conn.execute(select(func.max(model.id)))).scalar() or 0) + 1
+
+async def _insert(conn: AsyncConnection, model, rows: Iterable[dict]) -> int:
+    """分批写入；同一条INSERT语句只编译一次，每批作为一次executemany执行"""
+    statement = insert(model)
+    batch: List[dict] = []
+    count = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= SEED_BATCH:
+            await conn.execute(statement, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        await conn.execute(statement, batch)
+        count += len(batch)
+    return count
+
+async def seed_cars(conn: AsyncConnection, count: int, rng: random.Random) -> range:
+    """写入车辆，按景区轮流分配，返回新车辆的id范围"""
+    first = await _next_id(conn, Car)
+    ids = range(first, first + count)
+
+    def rows():
+        for car_id in ids:
+            area = AREAS[car_id % len(AREAS)]
+            lat, lng = AREA_CENTERS[area]
+            yield {
+                "id": car_id,
+                "name": f"{area}{car_id:04d}",
+                "plate": f"SC{car_id:06d}",
+                # 约5%在维修
+                "status": 2 if rng.random() < 0.05 else 0,
+                "battery": rng.randint(20, 100),
+                "qrcode": f"http://localhost:8000/static/rent.html?id={car_id}",
+                "lat": round(lat + rng.uniform(-AREA_SPREAD, AREA_SPREAD), 6),
+                "lng": round(lng + rng.uniform(-AREA_SPREAD, AREA_SPREAD), 6),
+            }
+
+    await _insert(conn, Car, rows())
+    return ids
+
+async def seed_users(conn: AsyncConnection, count: int, password: str, rounds: int = BCRYPT_ROUNDS,
+                     deposit: float = 100.0) -> range:
+    """写入游客用户，密码只哈希一次，返回新用户的id范围"""
+    hashed = hash_password(password, rounds=rounds)
+    first = await _next_id(conn, User)
+    ids = range(first, first + count)
+    await _insert(conn, User, (
+        {"id": user_id, "nickname": f"测试用户{user_id}", "phone": seed_phone(user_id),
+         "password": hashed, "role": 0, "deposit": deposit}
+        for user_id in ids
+    ))
+    return ids
+
+def _ride_start(rng: random.Random, now: datetime, days: int) -> datetime:
+    """白天的订单多于夜间"""
+    day = now.date() - timedelta(days=rng.randrange(days))
+    hour = min(23, max(6, int(rng.gauss(14, 3.5))))
+    return datetime.combine(day, datetime.min.time()) + timedelta(
+        hours=hour, minutes=rng.randrange(60), seconds=rng.randrange(60))
+
+async def seed_orders(conn: AsyncConnection, count: int, cars: Dict[int, str], user_ids: Sequence[int],
+                      days: int, rng: random.Random) -> int:
+    """写入最近days天内已结束的历史订单，cars为 car_id -> 车辆名称，费用按当前计费规则计算"""
+    car_ids = list(cars)
+    areas = {car_id: area_of(name) for car_id, name in cars.items()}
+    tariff = tariff_engine.current()
+    now = datetime.now()
+    first = await _next_id(conn, RentOrder)
+
+    def rows():
+        for order_id in range(first, first + count):
+            car_id = rng.choice(car_ids)
+            start_at = _ride_start(rng, now, days)
+            end_at = min(now, start_at + timedelta(minutes=rng.randint(3, 120), seconds=rng.randrange(60)))
+            yield {
+                "id": order_id,
+                "user_id": rng.choice(user_ids),
+                "car_id": car_id,
+                "start_at": start_at,
+                "end_at": end_at,
+                "fee": tariff.price(start_at, end_at, areas[car_id]),
+            }
+
+    return await _insert(conn, RentOrder, rows())
+
+async def seed(engine: AsyncEngine, cars: int = 0, users: int = 0, orders: int = 0, days: int = 30,
+               password: str = "123456", rounds: int = BCRYPT_ROUNDS, random_seed: Optional[int] = None) -> dict:
+    """在一个事务中写入测试数据，订单使用本次写入的车辆和用户（没有时使用已有的）"""
+    rng = random.Random(random_seed)
+    async with engine.begin() as conn:
+        car_ids = await seed_cars(conn, cars, rng)
+        user_ids = await seed_users(conn, users, password, rounds) if users else range(0)
+        if orders:
+            query = select(Car.id, Car.name)
+            if car_ids:
+                query = query.where(Car.id.between(car_ids.start, car_ids.stop - 1))
+            car_names = dict((await conn.execute(query)).all())
+            if not user_ids:
+                user_ids = list((await conn.execute(select(User.id))).scalars())
+            if not car_names or not user_ids:
+                raise ValueError("写入订单需要先有车辆和用户")
+            orders = await seed_orders(conn, orders, car_names, user_ids, days, rng)
+        if conn.dialect.name == "postgresql":
+            # 显式写入了id，需要把自增序列推进到最大id之后
+            for model in (Car, User, RentOrder):
+                table = model.__tablename__
+                await conn.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), "
+                    f"COALESCE((SELECT MAX(id) FROM \"{table}\"), 0) + 1, false)"
+                ))
+    return {"cars": cars, "users": users, "orders": orders}
+
+async def _main(args) -> None:
+    from .db import create_engine
+    from .migrations import migrate
+
+    engine = create_engine()
+    try:
+        await migrate(engine)
+        started = time.perf_counter()
+        result = await seed(engine, args.cars, args.users, args.orders, args.days,
+                            args.password, args.bcrypt_rounds, args.seed)
+        print(f"已写入 车辆{result['cars']} 用户{result['users']} 订单{result['orders']}，"
+              f"耗时 {time.perf_counter() - started:.2f}s")
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    # python -m app.seed --cars 2000 --users 20000 --orders 200000
+    parser = argparse.ArgumentParser(description="批量写入测试数据")
+    parser.add_argument("--cars", type=int, default=0)
+    parser.add_argument("--users", type=int, default=0)
+    parser.add_argument("--orders", type=int, default=0)
+    parser.add_argument("--days", type=int, default=30, help="历史订单分布的天数")
+    parser.add_argument("--password", default="123456", help="测试用户的密码")
+    parser.add_argument("--bcrypt-rounds", type=int, default=BCRYPT_ROUNDS)
+    parser.add_argument("--seed", type=int, default=None, help="随机数种子")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,131 @@
+from array import array
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+import json
+import math
+import os
+import time
+
+from pydantic import ValidationError
+
+from .config import env_int, env_str
+from .schemas import TariffRules
+
+# 计费引擎：计费规则（时段价格、景区倍数、封顶、押金）编译成按分钟的前缀和表，
+# 单次计费只需几次查表；规则文件修改后自动重新加载
+
+# 规则文件不存在时使用默认规则：每分钟0.5元，最低1元
+TARIFF_FILE = env_str("SCENIC_TARIFF_FILE", "./tariff.json")
+# 检查规则文件是否修改的间隔（秒）
+TARIFF_RELOAD_INTERVAL = env_int("SCENIC_TARIFF_RELOAD_INTERVAL", 5)
+
+MINUTES_PER_DAY = 24 * 60
+
+def _minute_of_day(value: str) -> int:
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+class Tariff:
+    """编译后的计费规则"""
+    def __init__(self, rules: TariffRules):
+        self.rules = rules
+        rates = [rules.rate_per_minute] * MINUTES_PER_DAY
+        for band in rules.bands:
+            start, end = _minute_of_day(band.start), _minute_of_day(band.end)
+            minutes = range(start, end) if start < end else [*range(start, MINUTES_PER_DAY), *range(0, end)]
+            for minute in minutes:
+                rates[minute] = rules.rate_per_minute * band.multiplier
+        # 两天的前缀和，跨零点的区间也只需一次相减
+        self._prefix = array("d", [0.0])
+        total = 0.0
+        for rate in rates * 2:
+            total += rate
+            self._prefix.append(total)
+        self._day_total = self._prefix[MINUTES_PER_DAY]
+        self._areas = dict(rules.area_multipliers)
+
+    def minutes_fee(self, start_minute: int, minutes: int) -> float:
+        """从一天中的第start_minute分钟开始计费minutes分钟的基础费用"""
+        days, rest = divmod(minutes, MINUTES_PER_DAY)
+        return days * self._day_total + self._prefix[start_minute + rest] - self._prefix[start_minute]
+
+    def price(self, start_at: datetime, end_at: datetime, area: str = "", spent_today: float = 0.0) -> float:
+        """单次骑行费用，spent_today为该用户当天已产生的费用（用于每日封顶）"""
+        rules = self.rules
+        minutes = math.ceil((end_at - start_at).total_seconds() / 60)
+        charged = minutes - rules.free_minutes
+        if rules.free_minutes and charged <= 0:
+            return 0.0
+        start_minute = (start_at.hour * 60 + start_at.minute + rules.free_minutes) % MINUTES_PER_DAY
+        fee = self.minutes_fee(start_minute, max(charged, 0)) * self._areas.get(area, 1.0)
+        fee = max(rules.minimum_fee, fee)
+        if rules.ride_cap is not None:
+            fee = min(fee, rules.ride_cap)
+        if rules.daily_cap is not None:
+            fee = min(fee, max(0.0, rules.daily_cap - spent_today))
+        return round(fee, 2)
+
+class Repricer:
+    """批量重新计费，按用户累计当天费用以计算每日封顶；订单需按结束时间依次传入"""
+    def __init__(self, tariff: Tariff):
+        self.tariff = tariff
+        self._spent: Dict[Tuple[int, date], float] = {}
+        self._daily = tariff.rules.daily_cap is not None
+
+    def price(self, user_id: int, start_at: datetime, end_at: datetime, area: str) -> float:
+        if not self._daily:
+            return self.tariff.price(start_at, end_at, area)
+        key = (user_id, end_at.date())
+        fee = self.tariff.price(start_at, end_at, area, self._spent.get(key, 0.0))
+        self._spent[key] = self._spent.get(key, 0.0) + fee
+        return fee
+
+@lru_cache(maxsize=16)
+def compile_rules(rules_json: str) -> Tariff:
+    """按规则内容缓存编译结果，相同规则只编译一次"""
+    return Tariff(TariffRules.model_validate_json(rules_json))
+
+def compile_tariff(rules: TariffRules) -> Tariff:
+    return compile_rules(rules.model_dump_json())
+
+class TariffEngine:
+    """当前生效的计费规则，规则文件修改后自动重新编译"""
+    def __init__(self, path: Optional[str] = TARIFF_FILE, reload_interval: float = TARIFF_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._tariff = compile_tariff(TariffRules())
+        self._mtime: Optional[int] = None
+        self._checked_at = float("-inf")
+
+    def current(self) -> Tariff:
+        now = time.monotonic()
+        if self.path and now - self._checked_at >= self.reload_interval:
+            self._checked_at = now
+            self._reload_if_changed()
+        return self._tariff
+
+    def _reload_if_changed(self) -> None:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        if mtime is None:
+            self._tariff = compile_tariff(TariffRules())
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                rules = TariffRules.model_validate(json.load(f))
+            tariff = compile_tariff(rules)
+        except (OSError, ValueError, ValidationError) as e:
+            # 规则文件有误时继续使用当前规则
+            print(f"加载计费规则失败: {e}")
+            return
+        self._tariff = tariff
+        print(f"已加载计费规则: {rules.name}")
+
+# 创建计费引擎实例
+tariff_engine = TariffEngine()
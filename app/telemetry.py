@@ -0,0 +1,214 @@
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+import asyncio
+import json
+
+from pydantic import ValidationError
+from sqlalchemy import bindparam, or_, select, update
+
+from .config import env_int
+from .db import async_session
+from .fleet import broadcaster, fleet_store
+from .models import Car
+from .schemas import TelemetryReport
+
+# 车辆遥测批量写入：车辆上报的电量/状态/位置先在内存中按车辆合并，
+# 每个刷新周期用一条 executemany 写入数据库，再通过事件总线推送给客户端。
+# 带采集时间的上报只覆盖 telemetry_at 更早的记录，多个worker乱序写入时以采集时间为准
+
+# 刷新间隔（毫秒）
+TELEMETRY_FLUSH_MS = env_int("SCENIC_TELEMETRY_FLUSH_MS", 1000)
+# 单次请求/消息最多包含的上报条数
+TELEMETRY_MAX_BATCH = env_int("SCENIC_TELEMETRY_MAX_BATCH", 1000)
+# 车辆只能上报可用(0)或维修(2)，租用状态由订单决定
+REPORTABLE_STATUSES = (0, 2)
+
+# 可由遥测更新的列，位置为 lat/lng 两列
+TELEMETRY_FIELDS = ("battery", "status", "lat", "lng")
+
+@lru_cache(maxsize=None)
+def _update_statement(fields: Tuple[str, ...], timed: bool):
+    """更新指定列的语句，同一组列只构造一次；绑定参数名不能与列名相同，统一加 t_ 前缀"""
+    statement = update(Car).where(Car.id == bindparam("t_id"))
+    # 已租车辆的状态不被遥测覆盖
+    if "status" in fields:
+        statement = statement.where(Car.status != 1)
+    values = {field: bindparam(f"t_{field}") for field in fields}
+    if timed:
+        # 其他worker已写入更晚的上报时不覆盖
+        statement = statement.where(or_(Car.telemetry_at.is_(None), Car.telemetry_at < bindparam("t_reported_at")))
+        values["telemetry_at"] = bindparam("t_reported_at")
+    return statement.values(**values, updated_at=bindparam("t_updated_at"))
+
+async def _updated_ids(connection, fields: Tuple[str, ...], timed: bool, rows: List[dict]) -> List[int]:
+    """executemany 不返回每行是否更新：读回这些车辆，数据库中的值与本次写入一致的即为已更新"""
+    columns = [Car.id, Car.updated_at, Car.telemetry_at] + [getattr(Car, field) for field in fields]
+    result = await connection.execute(select(*columns).where(Car.id.in_([row["t_id"] for row in rows])))
+    current = {car.id: car for car in result}
+    updated = []
+    for row in rows:
+        car = current.get(row["t_id"])
+        if car is None or car.updated_at != row["t_updated_at"]:
+            continue
+        if timed and car.telemetry_at != row["t_reported_at"]:
+            continue
+        if all(getattr(car, field) == row[f"t_{field}"] for field in fields):
+            updated.append(row["t_id"])
+    return updated
+
+def _utcnow() -> datetime:
+    # 与SQLite的CURRENT_TIMESTAMP一致：UTC，不带时区，精确到秒
+    return datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+def _from_timestamp(value: float) -> datetime:
+    # telemetry_at 与 updated_at 相同，存储不带时区的UTC时间
+    return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
+
+class TelemetryBuffer:
+    def __init__(self, session_factory=async_session, interval: float = TELEMETRY_FLUSH_MS / 1000):
+        self.session_factory = session_factory
+        self.interval = interval
+        # 待写入的上报 car_id -> {"battery", "status", "lat", "lng", "reported_at"}，同一辆车只保留最新值
+        self._pending: Dict[int, dict] = {}
+        # 已写入的最新上报时间，用于丢弃迟到的旧上报
+        self._applied_at: Dict[int, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        # 统计：收到的上报数、写入的行数、刷新次数
+        self.received = 0
+        self.written = 0
+        self.flushes = 0
+
+    def submit(self, report: TelemetryReport) -> bool:
+        """登记一条上报，车辆不存在或上报过时返回False"""
+        if fleet_store.loaded and fleet_store.get(report.car_id) is None:
+            return False
+        if report.status is not None and report.status not in REPORTABLE_STATUSES:
+            return False
+        reported_at = report.reported_at.timestamp() if report.reported_at else None
+        current = self._pending.get(report.car_id)
+        last = current["reported_at"] if current else self._applied_at.get(report.car_id)
+        # 后写入者胜：带时间戳的上报按时间戳比较，否则按到达顺序
+        if reported_at is not None and last is not None and reported_at < last:
+            return False
+        entry = current or dict.fromkeys(TELEMETRY_FIELDS + ("reported_at",))
+        for field in TELEMETRY_FIELDS:
+            value = getattr(report, field)
+            if value is not None:
+                entry[field] = value
+        if reported_at is not None:
+            entry["reported_at"] = reported_at
+        self._pending[report.car_id] = entry
+        self.received += 1
+        return True
+
+    def submit_many(self, reports: Iterable[TelemetryReport]) -> Tuple[int, List[int]]:
+        """登记一批上报，返回接受的条数和被拒绝的车辆ID"""
+        accepted, rejected = 0, []
+        for report in reports:
+            if self.submit(report):
+                accepted += 1
+            else:
+                rejected.append(report.car_id)
+        return accepted, rejected
+
+    async def flush(self) -> int:
+        """把合并后的上报写入数据库，返回写入的车辆数"""
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        now = _utcnow()
+        # 按更新的列和是否带采集时间分组，每组一条语句
+        groups: Dict[Tuple[Tuple[str, ...], bool], List[dict]] = {}
+        for car_id, entry in pending.items():
+            if entry["status"] is not None:
+                current = fleet_store.get(car_id)
+                # 已租车辆只更新电量和位置
+                if current is not None and current["status"] == 1:
+                    entry["status"] = None
+            fields = tuple(field for field in TELEMETRY_FIELDS if entry[field] is not None)
+            if fields:
+                row = {"t_id": car_id, "t_updated_at": now}
+                row.update((f"t_{field}", entry[field]) for field in fields)
+                timed = entry["reported_at"] is not None
+                if timed:
+                    row["t_reported_at"] = _from_timestamp(entry["reported_at"])
+                groups.setdefault((fields, timed), []).append(row)
+        # 实际更新的车辆，跳过已租车辆的状态上报和其他worker已写入更晚数据的车辆
+        updated: List[int] = []
+        try:
+            async with self.session_factory() as session:
+                # 直接在连接上执行，每组参数对应一次 executemany
+                connection = await session.connection()
+                for (fields, timed), rows in groups.items():
+                    result = await connection.execute(_update_statement(fields, timed), rows)
+                    # SQLite的executemany行数是各行之和，全部更新时不需要读回
+                    if connection.dialect.supports_sane_multi_rowcount and result.rowcount == len(rows):
+                        updated.extend(row["t_id"] for row in rows)
+                    else:
+                        updated.extend(await _updated_ids(connection, fields, timed, rows))
+                await session.commit()
+        except Exception:
+            # 写入失败时放回缓冲区，不覆盖期间收到的更新上报
+            for car_id, entry in pending.items():
+                self._pending.setdefault(car_id, entry)
+            raise
+        for car_id in updated:
+            entry = pending[car_id]
+            if entry["reported_at"] is not None:
+                self._applied_at[car_id] = entry["reported_at"]
+            broadcaster.publish(car_id, **{field: entry[field] for field in TELEMETRY_FIELDS},
+                                updated_at=now.isoformat())
+        self.flushes += 1
+        self.written += len(updated)
+        return len(updated)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"写入车辆遥测时出错: {e}")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """停止刷新任务并写入剩余的上报"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"写入车辆遥测时出错: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "received": self.received,
+            "written": self.written,
+            "flushes": self.flushes,
+        }
+
+def parse_reports(data: str) -> List[TelemetryReport]:
+    """解析WebSocket遥测消息，支持单条上报或上报数组"""
+    payload = json.loads(data)
+    items = payload if isinstance(payload, list) else [payload]
+    if len(items) > TELEMETRY_MAX_BATCH:
+        raise ValueError(f"单条消息最多包含{TELEMETRY_MAX_BATCH}条上报")
+    return [TelemetryReport.model_validate(item) for item in items]
+
+def handle_message(data: str) -> dict:
+    """处理车辆WebSocket上报，返回确认消息"""
+    try:
+        reports = parse_reports(data)
+    except (ValueError, ValidationError) as e:
+        return {"type": "error", "detail": f"无效的消息: {e}"}
+    accepted, rejected = telemetry_buffer.submit_many(reports)
+    return {"type": "ack", "accepted": accepted, "rejected": rejected}
+
+# 创建遥测缓冲区实例
+telemetry_buffer = TelemetryBuffer()
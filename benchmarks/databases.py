@@ -0,0 +1,56 @@
+"""基准测试使用的临时数据库：SQLite临时文件，或在本机临时启动的PostgreSQL实例
+
+PostgreSQL需要本机安装 initdb/pg_ctl（可用 SCENIC_PG_BIN 指定所在目录）；
+也可以通过 SCENIC_TEST_POSTGRES_URL 直接使用已有的空数据库。
+"""
+import contextlib
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+
+BACKENDS = ("sqlite", "postgres")
+
+def _pg_tool(name: str) -> str:
+    bin_dir = os.environ.get("SCENIC_PG_BIN")
+    path = os.path.join(bin_dir, name) if bin_dir else shutil.which(name)
+    if not path or not os.path.exists(path):
+        raise RuntimeError(f"未找到 {name}，请安装PostgreSQL或设置 SCENIC_PG_BIN / SCENIC_TEST_POSTGRES_URL")
+    return path
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@contextlib.contextmanager
+def local_postgres():
+    """在临时目录中初始化并启动PostgreSQL，退出时停止并删除"""
+    url = os.environ.get("SCENIC_TEST_POSTGRES_URL")
+    if url:
+        yield url
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = os.path.join(tmp, "data")
+        port = _free_port()
+        subprocess.run([_pg_tool("initdb"), "-D", data_dir, "-U", "scenic", "-A", "trust"],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([_pg_tool("pg_ctl"), "-D", data_dir, "-w", "-l", os.path.join(tmp, "pg.log"),
+                        "-o", f"-p {port} -k {tmp} -c listen_addresses=127.0.0.1", "start"],
+                       check=True, stdout=subprocess.DEVNULL)
+        try:
+            yield f"postgresql+asyncpg://scenic@127.0.0.1:{port}/postgres"
+        finally:
+            subprocess.run([_pg_tool("pg_ctl"), "-D", data_dir, "-m", "fast", "stop"],
+                           stdout=subprocess.DEVNULL)
+
+@contextlib.contextmanager
+def temporary_database(backend: str):
+    """返回指定后端的临时数据库URL"""
+    if backend == "postgres":
+        with local_postgres() as url:
+            yield url
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        yield f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}"
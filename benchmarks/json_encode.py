@@ -0,0 +1,88 @@
+"""列表接口的序列化耗时（每1000行）：
+ORM对象 + response_model校验 + 标准库json（默认路径） vs 列元组 + orjson（SCENIC_FAST_JSON=1）
+
+用法: python -m benchmarks.json_encode --rows 1000 --repeat 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from typing import List
+
+import orjson
+from pydantic import TypeAdapter
+
+# 响应类按快速路径编码
+os.environ["SCENIC_FAST_JSON"] = "1"
+
+from app import crud, schemas
+from app.config import DatabaseSettings
+from app.db import create_engine, create_session_factory
+from app.migrations import migrate
+from app.responses import rows_response
+from app.seed import seed
+
+def stdlib_dumps(content) -> bytes:
+    # 与 fastapi.responses.JSONResponse.render 相同
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+async def timed(func, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        if asyncio.iscoroutine(result):
+            await result
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+async def run(args):
+    adapter = TypeAdapter(List[schemas.RentOrder])
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(DatabaseSettings(url=f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}"))
+        session_factory = create_session_factory(engine)
+        await migrate(engine)
+        await seed(engine, cars=200, users=100, orders=args.rows, rounds=4, random_seed=1)
+
+        async with session_factory() as session:
+            orders = await crud.list_orders(session, limit=args.rows)
+            rows = await crud.list_order_rows(session, limit=args.rows)
+
+            def default_encode():
+                # FastAPI按response_model逐行从ORM属性校验，再转为可JSON化的数据
+                content = adapter.dump_python(adapter.validate_python(orders, from_attributes=True), mode="json")
+                return stdlib_dumps(content)
+
+            def fast_encode():
+                content = [dict(zip(crud.ORDER_COLUMNS, row)) for row in rows]
+                return orjson.dumps(content)
+
+            assert json.loads(default_encode()) == json.loads(fast_encode()), "两种路径的输出不一致"
+            scale = 1000 / args.rows
+            results = {
+                "查询ORM对象": await timed(lambda: crud.list_orders(session, limit=args.rows), args.repeat),
+                "查询列元组": await timed(lambda: crud.list_order_rows(session, limit=args.rows), args.repeat),
+                "校验+标准库json": await timed(default_encode, args.repeat),
+                "列元组+orjson": await timed(fast_encode, args.repeat),
+                "列元组+响应对象": await timed(lambda: rows_response(rows, crud.ORDER_COLUMNS), args.repeat),
+            }
+        await engine.dispose()
+
+    print(f"{'步骤':<16}{'每1000行(ms)':>14}")
+    for name, elapsed in results.items():
+        print(f"{name:<16}{elapsed * scale:>14.3f}")
+    before = results["查询ORM对象"] + results["校验+标准库json"]
+    after = results["查询列元组"] + results["列元组+orjson"]
+    print(f"合计: 默认路径 {before * scale:.3f}ms, 快速路径 {after * scale:.3f}ms, {before / after:.1f}倍")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
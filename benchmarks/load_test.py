@@ -0,0 +1,325 @@
+"""端到端压测：登录风暴、租车→骑行→还车、大量 /ws/status 订阅者的推送延迟，结果输出为JSON
+
+默认在临时目录中建库、写入 N 辆车和 M 个用户，启动本地 uvicorn 实例后压测，结束时关闭：
+    python -m benchmarks.load_test --cars 2000 --users 2000 --rides 5000 --subscribers 1000 --output run.json
+压测已经启动的实例（先用 --seed-only 向 SCENIC_DATABASE_URL 指向的空库写入测试数据，实例需以 SCENIC_RATE_LIMIT=0 启动）：
+    python -m benchmarks.load_test --seed-only --cars 2000 --users 2000
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --users 2000 --output run.json
+大量订阅者需要足够的文件描述符（ulimit -n）
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+
+from app.seed import seed_phone
+
+PASSWORD = "secret"
+
+async def seed(url: str, cars: int, users: int, rounds: int, random_seed: int):
+    """写入测试车辆和用户"""
+    from app import seed as seeder
+    from app.config import DatabaseSettings
+    from app.db import create_engine
+    from app.migrations import migrate
+
+    engine = create_engine(DatabaseSettings(url=url))
+    await migrate(engine)
+    await seeder.seed(engine, cars=cars, users=users, password=PASSWORD, rounds=rounds, random_seed=random_seed)
+    await engine.dispose()
+
+def summarize(latencies, elapsed: Optional[float] = None) -> dict:
+    """延迟分布（毫秒），给出耗时时同时计算吞吐量"""
+    values = sorted(latencies)
+    result = {"count": len(values)}
+    if values:
+        def pick(q):
+            return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2)
+        result["latency_ms"] = {
+            "mean": round(sum(values) / len(values) * 1000, 2),
+            "p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99),
+            "max": round(values[-1] * 1000, 2),
+        }
+    if elapsed is not None:
+        result["elapsed_s"] = round(elapsed, 3)
+        result["throughput_per_s"] = round(len(values) / elapsed, 1) if elapsed > 0 else 0.0
+    return result
+
+class Recorder:
+    """记录某类请求的延迟和状态码"""
+    def __init__(self):
+        self.latencies = array("d")
+        self.statuses: Counter = Counter()
+
+    async def request(self, session: aiohttp.ClientSession, method: str, url: str, **kwargs) -> Tuple[int, dict]:
+        started = time.perf_counter()
+        try:
+            async with session.request(method, url, **kwargs) as response:
+                body = await response.json(content_type=None)
+                status = response.status
+        except aiohttp.ClientError as e:
+            self.statuses[type(e).__name__] += 1
+            return 0, {}
+        self.latencies.append(time.perf_counter() - started)
+        self.statuses[str(status)] += 1
+        return status, body if isinstance(body, dict) else {}
+
+    def result(self, elapsed: float) -> dict:
+        return {**summarize(self.latencies, elapsed), "statuses": dict(self.statuses)}
+
+async def login_storm(http: aiohttp.ClientSession, base: str, users: int, concurrency: int) -> Tuple[dict, Dict[int, str]]:
+    """所有用户以固定并发登录，返回统计和 用户序号 -> token"""
+    recorder = Recorder()
+    tokens: Dict[int, str] = {}
+    indexes = iter(range(1, users + 1))
+
+    async def worker():
+        for index in indexes:
+            status, body = await recorder.request(
+                http, "POST", f"{base}/users/token",
+                data={"username": seed_phone(index), "password": PASSWORD})
+            if status == 200:
+                tokens[index] = body["access_token"]
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return recorder.result(time.perf_counter() - started), tokens
+
+class Subscribers:
+    """大量 /ws/status 订阅者，统计每次状态变更推送到各订阅者的延迟"""
+    def __init__(self, count: int):
+        self.count = count
+        self.connected = 0
+        self.failed = 0
+        self.messages = 0
+        # (car_id, 状态) -> 变更完成时间，由骑行任务登记
+        self.changed_at: Dict[Tuple[int, int], float] = {}
+        self.lags = array("d")
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self, http: aiohttp.ClientSession, base: str, concurrency: int):
+        url = base.replace("http", "ws", 1) + "/ws/status"
+        semaphore = asyncio.Semaphore(concurrency)
+        opened = []
+
+        async def open_one():
+            async with semaphore:
+                try:
+                    websocket = await http.ws_connect(url, heartbeat=None)
+                    # 第一条消息是全量快照
+                    await websocket.receive()
+                except (aiohttp.ClientError, OSError):
+                    self.failed += 1
+                    return
+                self.connected += 1
+                opened.append(websocket)
+
+        await asyncio.gather(*(open_one() for _ in range(self.count)))
+        self._tasks = [asyncio.create_task(self._listen(websocket)) for websocket in opened]
+
+    async def _listen(self, websocket):
+        try:
+            async for message in websocket:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                received = time.perf_counter()
+                self.messages += 1
+                data = json.loads(message.data)
+                if data.get("type") != "delta":
+                    continue
+                for car in data["cars"]:
+                    changed = self.changed_at.get((car["car_id"], car["status"]))
+                    if changed is not None:
+                        self.lags.append(max(0.0, received - changed))
+        finally:
+            await websocket.close()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def result(self) -> dict:
+        return {
+            "subscribers": self.count,
+            "connected": self.connected,
+            "failed": self.failed,
+            "messages": self.messages,
+            "deliveries": summarize(self.lags),
+        }
+
+async def ride_flows(http: aiohttp.ClientSession, base: str, tokens: Dict[int, str], cars: int,
+                     rides: int, concurrency: int, ride_seconds: float,
+                     subscribers: Subscribers, rng: random.Random) -> dict:
+    """每个骑行者反复 租车→骑行→还车，车辆被占用(409)时换一辆"""
+    rent, ret = Recorder(), Recorder()
+    remaining = [rides]
+    completed = [0]
+    riders = list(tokens.items())[:concurrency]
+
+    async def rider(token: str):
+        headers = {"Authorization": f"Bearer {token}"}
+        while remaining[0] > 0:
+            # 先占用一个名额，租车失败时归还，避免并发骑行者超出总数
+            remaining[0] -= 1
+            car_id = rng.randint(1, cars)
+            # 请求发出时先登记一次，推送早于响应到达时也能计算延迟
+            subscribers.changed_at[(car_id, 1)] = time.perf_counter()
+            status, body = await rent.request(http, "POST", f"{base}/rent/{car_id}", headers=headers)
+            if status != 200:
+                remaining[0] += 1
+                if status not in (403, 404, 409):
+                    await asyncio.sleep(0.1)
+                continue
+            subscribers.changed_at[(car_id, 1)] = time.perf_counter()
+            await asyncio.sleep(rng.uniform(0, 2 * ride_seconds))
+            subscribers.changed_at[(car_id, 0)] = time.perf_counter()
+            status, _ = await ret.request(http, "POST", f"{base}/return/{body['order_id']}", headers=headers)
+            if status == 200:
+                subscribers.changed_at[(car_id, 0)] = time.perf_counter()
+                completed[0] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(rider(token) for _, token in riders))
+    elapsed = time.perf_counter() - started
+    return {
+        "riders": len(riders),
+        "completed": completed[0],
+        "elapsed_s": round(elapsed, 3),
+        "rides_per_s": round(completed[0] / elapsed, 1) if elapsed > 0 else 0.0,
+        "rent": rent.result(elapsed),
+        "return": ret.result(elapsed),
+    }
+
+async def wait_ready(base: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as http:
+        while time.monotonic() < deadline:
+            try:
+                async with http.get(f"{base}/cars/", params={"limit": 1}) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"等待 {base} 启动超时")
+
+async def run(args, base: str) -> dict:
+    await wait_ready(base)
+    rng = random.Random(args.seed)
+    result = {}
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as http:
+        result["login"], tokens = await login_storm(http, base, args.users, args.concurrency)
+        print(f"登录: {result['login']}")
+        if not tokens:
+            raise RuntimeError("没有用户登录成功，无法继续压测")
+
+        subscribers = Subscribers(args.subscribers)
+        await subscribers.start(http, base, args.concurrency)
+        print(f"订阅者: 已连接 {subscribers.connected}, 失败 {subscribers.failed}")
+
+        result["rides"] = await ride_flows(http, base, tokens, args.cars, args.rides, args.concurrency,
+                                           args.ride_seconds, subscribers, rng)
+        # 等最后一批增量推送到达
+        await asyncio.sleep(1.0)
+        await subscribers.stop()
+        result["ws"] = subscribers.result()
+        print(f"骑行: {result['rides']}")
+        print(f"推送: {result['ws']}")
+    return result
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def spawn_server(args, tmp: str, database_url: str) -> Tuple[subprocess.Popen, str]:
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "SCENIC_DATABASE_URL": database_url,
+        "SCENIC_BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+        "SCENIC_HISTORY_DIR": os.path.join(tmp, "history"),
+        "SCENIC_METRICS_DIR": os.path.join(tmp, "metrics"),
+        # 使用默认计费规则，结果不受本地 tariff.json 影响
+        "SCENIC_TARIFF_FILE": os.path.join(tmp, "tariff.json"),
+        # 所有请求来自同一IP，关闭限流
+        "SCENIC_RATE_LIMIT": "0",
+    })
+    if args.workers > 1:
+        env.setdefault("SCENIC_EVENT_BUS", "unix")
+        env.setdefault("SCENIC_BUS_SOCKET", os.path.join(tmp, "bus.sock"))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        env=env,
+    )
+    return server, f"http://127.0.0.1:{port}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="压测已启动的实例，不再建库和启动服务")
+    parser.add_argument("--seed-only", action="store_true", help="只向 SCENIC_DATABASE_URL 写入测试数据")
+    parser.add_argument("--cars", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rides", type=int, default=2000)
+    parser.add_argument("--subscribers", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50, help="并发登录数和同时骑行的用户数")
+    parser.add_argument("--ride-seconds", type=float, default=0.5, help="平均骑行时长")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--bcrypt-rounds", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=42, help="随机数种子")
+    parser.add_argument("--output", help="结果JSON文件，不指定时输出到标准输出")
+    args = parser.parse_args()
+
+    if args.seed_only:
+        from app.config import database_settings
+        asyncio.run(seed(database_settings.url, args.cars, args.users, args.bcrypt_rounds, args.seed))
+        print(f"已写入 {args.cars} 辆车和 {args.users} 个用户")
+        return
+
+    result = {
+        "config": vars(args),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    if args.url:
+        result.update(asyncio.run(run(args, args.url.rstrip("/"))))
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            database_url = f"sqlite+aiosqlite:///{os.path.join(tmp, 'load.db')}"
+            asyncio.run(seed(database_url, args.cars, args.users, args.bcrypt_rounds, args.seed))
+            server, base = spawn_server(args, tmp, database_url)
+            try:
+                result.update(asyncio.run(run(args, base)))
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"结果已写入 {args.output}")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""登录风暴下的事件循环延迟：bcrypt在事件循环内同步执行 vs 在线程池中执行
+
+用法: python -m benchmarks.login_storm --logins 200 --rounds 10
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+LAG_INTERVAL = 0.005
+
+async def probe_loop_lag(samples: list, stop: asyncio.Event):
+    """周期性睡眠，记录实际唤醒时间比预期晚了多少"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        samples.append(time.perf_counter() - started - LAG_INTERVAL)
+
+async def storm(args, mode: str):
+    from fastapi import HTTPException
+    from fastapi.security import OAuth2PasswordRequestForm
+    from sqlalchemy import insert
+
+    from app import passwords
+    from app.api import users
+    from app.db import async_session, engine
+    from app.models import Base, User
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        hashed = passwords.hash_password("secret", rounds=args.rounds)
+        await conn.execute(insert(User), [
+            {"phone": f"139{i:08d}", "password": hashed} for i in range(args.logins)
+        ])
+
+    verify_async = passwords.verify_password_async
+    if mode == "inline":
+        # 调整前：在事件循环中直接计算bcrypt
+        async def verify_inline(password, hashed_password):
+            return passwords.verify_password(password, hashed_password)
+        passwords.verify_password_async = verify_inline
+
+    async def login(i: int):
+        async with async_session() as session:
+            form = OAuth2PasswordRequestForm(username=f"139{i:08d}", password="secret")
+            try:
+                await users.login_for_access_token(form, session)
+                return 200
+            except HTTPException as e:
+                return e.status_code
+
+    samples, stop = [], asyncio.Event()
+    probe = asyncio.create_task(probe_loop_lag(samples, stop))
+    started = time.perf_counter()
+    statuses = await asyncio.gather(*(login(i) for i in range(args.logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe
+    passwords.verify_password_async = verify_async
+    await engine.dispose()
+
+    samples.sort()
+    p99 = samples[int(len(samples) * 0.99) - 1] if samples else 0.0
+    print(f"{mode}: 登录 {args.logins} 次, 成功 {statuses.count(200)}, 503 {statuses.count(503)}, "
+          f"耗时 {elapsed:.2f}s, 事件循环延迟 p50 {statistics.median(samples or [0]) * 1000:.1f}ms "
+          f"p99 {p99 * 1000:.1f}ms max {max(samples or [0]) * 1000:.1f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        # 必须在导入app之前设置数据库地址和计算成本
+        os.environ["SCENIC_DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ["SCENIC_BCRYPT_ROUNDS"] = str(args.rounds)
+        os.environ.setdefault("SCENIC_PASSWORD_QUEUE_LIMIT", str(args.logins))
+        for mode in ("inline", "pool"):
+            asyncio.run(storm(args, mode))
+
+if __name__ == "__main__":
+    main()
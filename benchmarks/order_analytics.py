@@ -0,0 +1,96 @@
+"""订单统计对比：逐条读取全部订单在应用中汇总 vs 数据库分组聚合 vs 增量刷新
+
+用法: python -m benchmarks.order_analytics --orders 200000
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import insert, select
+
+from app.analytics import OrderAnalytics
+from app.config import DatabaseSettings
+from app.db import create_engine, create_session_factory
+from app.models import Base, Car, RentOrder, User
+
+CARS = 200
+USERS = 1000
+
+def random_orders(count: int, days: int):
+    now = datetime.now()
+    for _ in range(count):
+        start_at = now - timedelta(minutes=random.randint(10, days * 24 * 60))
+        minutes = random.randint(1, 90)
+        yield {
+            "user_id": random.randint(1, USERS),
+            "car_id": random.randint(1, CARS),
+            "start_at": start_at,
+            "end_at": start_at + timedelta(minutes=minutes),
+            "fee": max(1.0, minutes * 0.5),
+        }
+
+async def seed(engine, orders: int, days: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(Car), [
+            {"name": f"测试{i:04d}", "plate": f"BM{i:05d}"} for i in range(1, CARS + 1)
+        ])
+        await conn.execute(insert(User), [
+            {"phone": f"139{i:08d}", "password": "-"} for i in range(1, USERS + 1)
+        ])
+        rows = list(random_orders(orders, days))
+        for start in range(0, len(rows), 20000):
+            await conn.execute(insert(RentOrder), rows[start:start + 20000])
+
+async def client_side(session_factory):
+    """原来的做法：读取全部订单对象再逐条汇总"""
+    revenue, per_car = 0.0, {}
+    async with session_factory() as session:
+        orders = (await session.execute(select(RentOrder))).scalars().all()
+    for order in orders:
+        revenue += order.fee or 0
+        per_car[order.car_id] = per_car.get(order.car_id, 0) + 1
+    return len(orders)
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(DatabaseSettings(url=f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}"))
+        session_factory = create_session_factory(engine)
+        await seed(engine, args.orders, args.days)
+        
+        started = time.perf_counter()
+        await client_side(session_factory)
+        print(f"逐条读取汇总: {time.perf_counter() - started:.3f}s")
+        
+        analytics = OrderAnalytics()
+        async with session_factory() as session:
+            started = time.perf_counter()
+            await analytics.refresh(session)
+            print(f"分组聚合(首次): {time.perf_counter() - started:.3f}s")
+        
+        # 新增一批订单后增量刷新
+        async with engine.begin() as conn:
+            await conn.execute(insert(RentOrder), list(random_orders(args.increment, 1)))
+        async with session_factory() as session:
+            started = time.perf_counter()
+            await analytics.refresh(session)
+            print(f"增量刷新({args.increment}条新订单): {time.perf_counter() - started:.3f}s")
+        
+        started = time.perf_counter()
+        analytics.report(date.today() - timedelta(days=args.days), date.today())
+        print(f"生成{args.days}天报表: {(time.perf_counter() - started) * 1000:.1f}ms")
+        await engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=200000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--increment", type=int, default=1000)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
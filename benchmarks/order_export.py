@@ -0,0 +1,81 @@
+"""订单导出对比：一次读取全部ORM对象再序列化JSON vs 分批流式编码CSV/NDJSON
+
+用法: python -m benchmarks.order_export --orders 200000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select
+
+from app import crud, schemas
+from app.api.exports import encode_header, encode_rows
+from app.config import DatabaseSettings
+from app.db import create_engine, create_session_factory
+from app.models import Base, RentOrder
+
+async def seed(engine, orders: int):
+    now = datetime.now()
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        for start in range(0, orders, 20000):
+            rows = []
+            for _ in range(min(20000, orders - start)):
+                start_at = now - timedelta(minutes=random.randint(10, 100000))
+                rows.append({"user_id": random.randint(1, 1000), "car_id": random.randint(1, 200),
+                             "start_at": start_at, "end_at": start_at + timedelta(minutes=30), "fee": 15.0})
+            await conn.execute(insert(RentOrder), rows)
+
+async def materialized(session_factory, orders: int):
+    """原来的做法：/orders?limit=N 读取全部ORM对象，整体序列化"""
+    async with session_factory() as session:
+        rows = (await session.execute(select(RentOrder).limit(orders))).scalars().all()
+        body = json.dumps([schemas.RentOrder.model_validate(row, from_attributes=True).model_dump(mode="json")
+                           for row in rows])
+    return len(body), None
+
+async def streamed(session_factory, fmt: str):
+    size, first_byte = 0, None
+    started = time.perf_counter()
+    size += len(encode_header(crud.ORDER_EXPORT_COLUMNS, fmt))
+    async with session_factory() as session:
+        async for rows in crud.stream_orders(session):
+            size += len(encode_rows(rows, crud.ORDER_EXPORT_COLUMNS, fmt))
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+    return size, first_byte
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(DatabaseSettings(url=f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}"))
+        session_factory = create_session_factory(engine)
+        await seed(engine, args.orders)
+        cases = (
+            ("一次性JSON", lambda: materialized(session_factory, args.orders)),
+            ("流式CSV", lambda: streamed(session_factory, "csv")),
+            ("流式NDJSON", lambda: streamed(session_factory, "ndjson")),
+        )
+        for name, case in cases:
+            tracemalloc.start()
+            started = time.perf_counter()
+            size, first_byte = await case()
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            first = f"{first_byte * 1000:.0f}ms" if first_byte is not None else f"{elapsed * 1000:.0f}ms"
+            print(f"{name}: 耗时 {elapsed:.2f}s, 首字节 {first}, 峰值内存 {peak / 1024 / 1024:.1f}MB, 输出 {size / 1024 / 1024:.1f}MB")
+        await engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=200000)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
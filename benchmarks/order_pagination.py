@@ -0,0 +1,90 @@
+"""订单分页基准：在数百万条订单上比较键集分页与OFFSET分页的取页耗时
+
+用法: python -m benchmarks.order_pagination --orders 1000000 --users 10000
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select
+
+from app import crud
+from app.config import DatabaseSettings
+from app.db import create_engine, create_session_factory
+from app.models import Base, Car, RentOrder, User
+
+BATCH = 50000
+
+async def offset_page(session, skip: int, limit: int):
+    """原来的OFFSET分页，作为对照"""
+    result = await session.execute(
+        select(RentOrder).order_by(RentOrder.id.desc()).offset(skip).limit(limit))
+    return result.scalars().all()
+
+async def seed(engine, orders: int, users: int, cars: int):
+    started = datetime(2024, 1, 1)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(Car), [
+            {"name": f"测试{i:04d}", "plate": f"BM{i:05d}"} for i in range(1, cars + 1)
+        ])
+        await conn.execute(insert(User), [
+            {"phone": f"139{i:08d}", "password": "-"} for i in range(1, users + 1)
+        ])
+        for offset in range(0, orders, BATCH):
+            rows = []
+            for i in range(offset, min(offset + BATCH, orders)):
+                start_at = started + timedelta(seconds=i * 30)
+                rows.append({
+                    "user_id": random.randint(1, users),
+                    "car_id": random.randint(1, cars),
+                    "start_at": start_at,
+                    "end_at": start_at + timedelta(minutes=20),
+                    "fee": 10.0,
+                })
+            await conn.execute(insert(RentOrder), rows)
+
+async def timed(func, repeat: int = 20) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await func()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(DatabaseSettings(url=f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}"))
+        session_factory = create_session_factory(engine)
+        started = time.perf_counter()
+        await seed(engine, args.orders, args.users, args.cars)
+        print(f"生成 {args.orders} 条订单耗时 {time.perf_counter() - started:.1f}s")
+        
+        async with session_factory() as session:
+            max_id = (await session.execute(select(RentOrder.id).order_by(RentOrder.id.desc()).limit(1))).scalar()
+            print(f"{'位置':<8}{'键集分页(ms)':>14}{'OFFSET分页(ms)':>16}{'按用户键集(ms)':>16}")
+            for fraction in (0.0, 0.5, 0.99):
+                depth = int(args.orders * fraction)
+                cursor = max_id - depth + 1
+                keyset = await timed(lambda: crud.list_orders(session, before_id=cursor, limit=args.page_size))
+                offset = await timed(lambda: offset_page(session, depth, args.page_size))
+                by_user = await timed(lambda: crud.list_orders(
+                    session, user_id=random.randint(1, args.users), before_id=cursor, limit=args.page_size))
+                print(f"{fraction:<8.0%}{keyset:>14.2f}{offset:>16.2f}{by_user:>16.2f}")
+        await engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--cars", type=int, default=500)
+    parser.add_argument("--page-size", type=int, default=100)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""并发租还车基准：大量请求同时抢租少量车辆，验证不会出现一车多租
+
+用法: python -m benchmarks.rent_concurrency --cars 20 --users 500 --requests 2000
+      python -m benchmarks.rent_concurrency --backend all   # 依次在SQLite和PostgreSQL上运行
+"""
+import argparse
+import asyncio
+import time
+from collections import Counter
+
+from sqlalchemy import func, insert, select
+
+from app import crud
+from app.config import DatabaseSettings
+from app.db import create_engine, create_session_factory
+from app.models import Base, Car, RentOrder, User
+from .databases import BACKENDS, temporary_database
+
+async def setup(engine, cars: int, users: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(Car), [
+            {"name": f"测试{i:04d}", "plate": f"BM{i:05d}", "status": 0, "battery": 100}
+            for i in range(1, cars + 1)
+        ])
+        # 基准测试不需要真实的密码哈希
+        await conn.execute(insert(User), [
+            {"phone": f"139{i:08d}", "password": "-", "role": 0}
+            for i in range(1, users + 1)
+        ])
+
+async def run(args, url: str):
+    engine = create_engine(DatabaseSettings(url=url))
+    session_factory = create_session_factory(engine)
+    await setup(engine, args.cars, args.users)
+    
+    semaphore = asyncio.Semaphore(args.concurrency)
+    
+    async def attempt_rent(i: int):
+        async with semaphore, session_factory() as session:
+            car_id = i % args.cars + 1
+            order = await crud.rent_car(session, car_id=car_id, user_id=i % args.users + 1)
+            return car_id if order else None
+    
+    started = time.perf_counter()
+    results = await asyncio.gather(*(attempt_rent(i) for i in range(args.requests)))
+    rent_elapsed = time.perf_counter() - started
+    rented = Counter(car_id for car_id in results if car_id is not None)
+    
+    async with session_factory() as session:
+        open_orders = (await session.execute(
+            select(RentOrder.car_id, func.count()).where(RentOrder.end_at.is_(None)).group_by(RentOrder.car_id)
+        )).all()
+        order_ids = (await session.execute(
+            select(RentOrder.id).where(RentOrder.end_at.is_(None))
+        )).scalars().all()
+    
+    # 每个订单同时发起两次还车，只能有一次成功
+    async def attempt_return(order_id: int):
+        async with semaphore, session_factory() as session:
+            return await crud.return_car(session, order_id) is not None
+    
+    started = time.perf_counter()
+    returned = await asyncio.gather(*(attempt_return(order_id) for order_id in order_ids for _ in range(2)))
+    return_elapsed = time.perf_counter() - started
+    await engine.dispose()
+    
+    double_rented = [car_id for car_id, count in open_orders if count > 1]
+    print(f"租车请求: {args.requests}, 成功: {sum(rented.values())}, 耗时: {rent_elapsed:.3f}s, "
+          f"吞吐: {args.requests / rent_elapsed:.0f} req/s")
+    print(f"还车请求: {len(returned)}, 成功: {sum(returned)}, 耗时: {return_elapsed:.3f}s")
+    print(f"一车多租: {len(double_rented)}, 重复还车: {sum(returned) - len(order_ids)}")
+    if double_rented or max(rented.values(), default=0) > 1 or sum(returned) != len(order_ids):
+        raise SystemExit("检测到并发冲突")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cars", type=int, default=20)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--backend", choices=BACKENDS + ("all",), default="sqlite")
+    args = parser.parse_args()
+    for backend in BACKENDS if args.backend == "all" else (args.backend,):
+        print(f"[{backend}]")
+        with temporary_database(backend) as url:
+            asyncio.run(run(args, url))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""SQLite调优前后的读写吞吐对比：默认日志模式+echo vs WAL/busy_timeout/mmap
+
+用法: python -m benchmarks.sqlite_tuning --seconds 5 --concurrency 32
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import insert, select, update
+
+from app.config import DatabaseSettings
+from app.db import create_engine, create_session_factory
+from app.models import Base, Car, RentOrder, User
+
+CARS = 200
+USERS = 200
+
+def baseline_settings(url: str) -> DatabaseSettings:
+    """调优前：打开echo，不设置任何PRAGMA"""
+    return DatabaseSettings(url=url, echo=True, journal_mode=None, synchronous=None,
+                            busy_timeout=None, mmap_size=None, cache_size=None)
+
+def tuned_settings(url: str) -> DatabaseSettings:
+    return DatabaseSettings(url=url)
+
+async def seed(engine):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(Car), [
+            {"name": f"测试{i:04d}", "plate": f"BM{i:05d}", "status": 0, "battery": 100}
+            for i in range(1, CARS + 1)
+        ])
+        await conn.execute(insert(User), [
+            {"phone": f"139{i:08d}", "password": "-", "role": 0}
+            for i in range(1, USERS + 1)
+        ])
+
+async def workload(settings: DatabaseSettings, seconds: float, concurrency: int, write_ratio: float):
+    engine = create_engine(settings)
+    session_factory = create_session_factory(engine)
+    await seed(engine)
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    deadline = time.perf_counter() + seconds
+    
+    async def worker():
+        while time.perf_counter() < deadline:
+            try:
+                async with session_factory() as session:
+                    if random.random() < write_ratio:
+                        if random.random() < 0.5:
+                            await session.execute(
+                                update(Car).where(Car.id == random.randint(1, CARS))
+                                .values(battery=random.randint(0, 100))
+                            )
+                        else:
+                            await session.execute(insert(RentOrder).values(
+                                user_id=random.randint(1, USERS), car_id=random.randint(1, CARS)
+                            ))
+                        await session.commit()
+                        counts["writes"] += 1
+                    else:
+                        await session.execute(select(Car).where(Car.id == random.randint(1, CARS)))
+                        await session.execute(select(Car).limit(100))
+                        counts["reads"] += 1
+            except Exception:
+                counts["errors"] += 1
+    
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    await engine.dispose()
+    return {key: value / seconds if key != "errors" else value for key, value in counts.items()}
+
+async def run(args):
+    results = {}
+    for name, make_settings in (("调优前", baseline_settings), ("调优后", tuned_settings)):
+        with tempfile.TemporaryDirectory() as tmp:
+            settings = make_settings(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}")
+            # echo输出到终端的开销不计入，只保留日志格式化的开销
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                results[name] = await workload(settings, args.seconds, args.concurrency, args.write_ratio)
+    for name, result in results.items():
+        print(f"{name}: 读 {result['reads']:.0f} ops/s, 写 {result['writes']:.0f} ops/s, 错误 {result['errors']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--write-ratio", type=float, default=0.3)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""车辆遥测写入对比：逐条 UPDATE+提交（PUT /cars/{id}/battery 的做法） vs 内存合并后批量 executemany
+
+用法: python -m benchmarks.telemetry_ingest --cars 500 --reports 20000
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import insert
+
+from app import crud
+from app.config import DatabaseSettings
+from app.db import create_engine, create_session_factory
+from app.models import Base, Car
+from app.schemas import TelemetryReport
+from app.telemetry import TelemetryBuffer
+
+async def seed(engine, cars: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(Car), [
+            {"name": f"测试{i:04d}", "plate": f"BM{i:05d}", "status": 0, "battery": 100}
+            for i in range(1, cars + 1)
+        ])
+
+def make_reports(cars: int, count: int):
+    return [TelemetryReport(car_id=random.randint(1, cars), battery=random.randint(0, 100))
+            for _ in range(count)]
+
+async def per_report(session_factory, reports, concurrency: int):
+    queue = list(reports)
+    
+    async def worker():
+        while queue:
+            report = queue.pop()
+            async with session_factory() as session:
+                await crud.update_car_battery(session, report.car_id, report.battery)
+    
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return len(reports)
+
+async def buffered(session_factory, reports, batch: int):
+    buffer = TelemetryBuffer(session_factory)
+    # 每收到 batch 条上报刷新一次，相当于一个刷新周期内到达的上报量
+    for start in range(0, len(reports), batch):
+        buffer.submit_many(reports[start:start + batch])
+        await buffer.flush()
+    return buffer.written
+
+async def run(args):
+    reports = make_reports(args.cars, args.reports)
+    for name in ("逐条写入", "合并批量写入"):
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(DatabaseSettings(url=f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}"))
+            session_factory = create_session_factory(engine)
+            await seed(engine, args.cars)
+            started = time.perf_counter()
+            if name == "逐条写入":
+                rows = await per_report(session_factory, reports, args.concurrency)
+            else:
+                rows = await buffered(session_factory, reports, args.batch)
+            elapsed = time.perf_counter() - started
+            await engine.dispose()
+        print(f"{name}: {len(reports) / elapsed:.0f} 条上报/s, 写入 {rows} 行, 耗时 {elapsed:.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cars", type=int, default=500)
+    parser.add_argument("--reports", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--batch", type=int, default=2000)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,13 @@
 # 启动Nginx
 service nginx start
 
-# 初始化数据库（如果需要）
+# 执行数据库迁移，空库时写入演示数据（不会删除已有数据）
 python init_db.py
 
-# 启动FastAPI应用
+# 启动FastAPI应用（多worker通过Unix套接字事件总线同步车辆变更）
+export SCENIC_EVENT_BUS=${SCENIC_EVENT_BUS:-unix}
+# 各worker的运行指标写到同一目录，/metrics 汇总所有worker
+export SCENIC_METRICS_DIR=${SCENIC_METRICS_DIR:-/tmp/scenic-metrics}
+# 各worker共用同一份限流令牌桶
+export SCENIC_RATE_LIMIT_STORE=${SCENIC_RATE_LIMIT_STORE:-shared}
 uvicorn app.main:app --host 0.0.0.0 --port 8000 --workers 4
\ No newline at end of file
@@ -0,0 +1,76 @@
+"""订单归档后订单id不重用：租车 → 还车 → 归档 → 租车 → 归档"""
+import asyncio
+import os
+import tempfile
+from datetime import datetime
+
+from sqlalchemy import insert, select, text
+
+from app import crud
+from app.archive import OrderArchiver
+from app.config import DatabaseSettings
+from app.db import create_engine, create_session_factory
+from app.migrations import migrate
+from app.models import Car, RentOrder, RentOrderArchive, User
+
+async def _setup(directory: str):
+    engine = create_engine(DatabaseSettings(url=f"sqlite+aiosqlite:///{os.path.join(directory, 'test.db')}"))
+    await migrate(engine)
+    async with engine.begin() as conn:
+        await conn.execute(insert(User).values(id=1, phone="13800000000", password="-"))
+        await conn.execute(insert(Car).values(id=1, name="测试车", status=0))
+    return engine, create_session_factory(engine)
+
+async def _ride(session_factory) -> int:
+    async with session_factory() as session:
+        order = await crud.rent_car(session, car_id=1, user_id=1)
+        await crud.return_car(session, order.id)
+    return order.id
+
+async def _ids(session_factory, table):
+    async with session_factory() as session:
+        return (await session.execute(select(table.id).order_by(table.id))).scalars().all()
+
+def test_archive_rent_archive_does_not_reuse_ids():
+    async def run():
+        with tempfile.TemporaryDirectory() as directory:
+            engine, session_factory = await _setup(directory)
+            archiver = OrderArchiver(days=0, session_factory=session_factory)
+            try:
+                first = await _ride(session_factory)
+                assert await archiver.archive() == 1
+                second = await _ride(session_factory)
+                assert second > first
+                assert await archiver.archive() == 1
+                assert await _ids(session_factory, RentOrderArchive) == [first, second]
+                async with session_factory() as session:
+                    assert (await crud.get_order(session, first)).id == first
+                    orders = await crud.list_orders(session, user_id=1)
+                    assert sorted(order.id for order in orders) == [first, second]
+            finally:
+                await engine.dispose()
+    asyncio.run(run())
+
+def test_migration_renumbers_orders_that_reused_archived_ids():
+    async def run():
+        with tempfile.TemporaryDirectory() as directory:
+            engine, session_factory = await _setup(directory)
+            try:
+                # 模拟迁移9之前的库：rent_order 不是AUTOINCREMENT表，新订单重用了已归档订单的id
+                async with engine.begin() as conn:
+                    await conn.execute(text("DROP TABLE rent_order"))
+                    await conn.execute(text(
+                        "CREATE TABLE rent_order (id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER, "
+                        "car_id INTEGER, start_at DATETIME, end_at DATETIME, fee FLOAT)"))
+                    await conn.execute(text("DELETE FROM schema_version WHERE version >= 9"))
+                    ended = datetime(2024, 1, 1)
+                    await conn.execute(insert(RentOrderArchive).values(
+                        id=1, user_id=1, car_id=1, start_at=ended, end_at=ended, fee=1.0))
+                    await conn.execute(insert(RentOrder).values(
+                        id=1, user_id=1, car_id=1, start_at=ended, end_at=ended, fee=2.0))
+                assert await migrate(engine) == [9]
+                assert await _ids(session_factory, RentOrder) == [2]
+                assert await _ride(session_factory) == 3
+            finally:
+                await engine.dispose()
+    asyncio.run(run())